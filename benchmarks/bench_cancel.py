@@ -0,0 +1,112 @@
+"""
+    bench_cancel.py
+    -----------
+    Measures the cancel-to-idle latency of the SpaceDock, Curse and CKAN pipelines: each pipeline is run against the
+    local mock server (see mock_server.py) in a scenario where it's blocked in a network call, stopped after a
+    while, and the time from "stop" until "run" has returned is measured.
+
+    Scenarios: a server that doesn't answer (long latency), a slow download (low bandwidth) and a throttling server
+    asking to retry after a long time.
+
+    Usage:
+        python3 benchmarks/bench_cancel.py [--delay S] [scenario ...]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer'))
+
+import ckan
+import curse
+import fetch
+import headless
+import helpers
+import mock_server
+import pipeline
+import spacedock
+
+# Mock server settings for each scenario
+SCENARIOS = {'hanging': {'latency': 60},
+             'slow': {'scale': 10, 'bandwidth': 16 * 1024},
+             'throttled': {'throttle_rate': 1.0, 'retry_after': 30}}
+
+
+def cancel_pipeline(name, delay):
+    """Runs a pipeline, stops it after "delay" seconds, returns (latency, result).
+
+    "latency" is the time (s) from "stop" until "run" returned, "result" is how the run ended.
+    """
+
+    db_file = os.path.join('data', 'database.db')
+    instance = headless.PIPELINES[name](db_file, False)
+    result = []
+
+    def run():
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                instance.run()
+            result.append('finished')
+        except pipeline.Cancelled:
+            result.append('cancelled')
+        except Exception as e:
+            result.append('error: {}'.format(e))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(delay)
+
+    start = time.perf_counter()
+    instance.stop()
+    thread.join()
+    return time.perf_counter() - start, result[0]
+
+def run_scenario(name, settings, delay):
+    """Cancels each pipeline in a mock server scenario, returns a list of (pipeline name, latency, result)."""
+
+    os.makedirs(os.path.join(name, 'data'))
+    os.chdir(name)
+    helpers.init_database(os.path.join('data', 'database.db'))
+
+    server = mock_server.MockRepositoryServer(**settings)
+    server.start()
+
+    # Point the repositories at the mock server, with a new fetcher
+    spacedock.SPACEDOCK_URL = server.url
+    curse.CURSE_URL = server.url + '/ksp-mods/kerbal'
+    ckan.CKAN_REPO = server.url + '/master.tar.gz'
+    fetch._fetcher = None
+
+    results = [(pipeline_name,) + cancel_pipeline(pipeline_name, delay) for pipeline_name in headless.PIPELINES]
+
+    server.stop()
+    os.chdir('..')
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures how fast the pipelines stop when cancelled.')
+    parser.add_argument('--delay', type=float, default=1.0, help='time (s) before stopping each pipeline')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default all): ' + ', '.join(SCENARIOS))
+    args = parser.parse_args()
+
+    print('{:12} {:12} {:>12}  {}'.format('Scenario', 'Pipeline', 'Cancel (ms)', 'Result'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The pipelines write to the 'data' directory in the current directory
+        cwd = os.getcwd()
+        os.chdir(directory)
+
+        for name in args.scenarios or SCENARIOS:
+            for pipeline_name, latency, result in run_scenario(name, SCENARIOS[name], args.delay):
+                print('{:12} {:12} {:12.1f}  {}'.format(name, pipeline_name, latency * 1000, result))
+
+        os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
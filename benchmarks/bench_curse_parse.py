@@ -0,0 +1,57 @@
+"""
+    bench_curse_parse.py
+    -----------
+    Measures the time to parse saved Curse pages with each available parser backend,
+    and verifies that all backends extract exactly the same mods as a full "html.parser" tree.
+
+    Usage:
+        python3 benchmarks/bench_curse_parse.py [repetitions]
+"""
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer'))
+
+import curse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'curse', '*.html')
+
+# Parser backends to compare, the first one is the reference (a full tree, as before the parser backends)
+BACKENDS = [('bs4 html.parser, full tree',
+             lambda html: curse.get_curse_mods(curse.make_soup(html, parse_only=None, parser='html.parser'))),
+            ('bs4 html.parser, listing only',
+             lambda html: curse.get_curse_mods(curse.make_soup(html, parser='html.parser'))),
+            ('bs4 lxml, listing only',
+             lambda html: curse.get_curse_mods(curse.make_soup(html, parser='lxml'))),
+            ('lxml',
+             lambda html: curse.parse_mods(html, backend='lxml'))]
+
+
+def main(repetitions):
+    pages = [open(file_name, 'rb').read() for file_name in sorted(glob.glob(FIXTURES))]
+    if not pages:
+        sys.exit('No fixtures found in ' + FIXTURES)
+
+    reference = [BACKENDS[0][1](html) for html in pages]
+
+    print('{} pages, {} repetitions'.format(len(pages), repetitions))
+    for name, parse in BACKENDS:
+        try:
+            parse(pages[0])
+        except Exception:
+            print('{:32} not available'.format(name))
+            continue
+
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            result = [parse(html) for html in pages]
+        per_page = (time.perf_counter() - start) / (repetitions * len(pages))
+
+        status = 'OK' if result == reference else 'DIFFERENT RESULT'
+        print('{:32} {:8.2f} ms/page  {}'.format(name, per_page * 1000, status))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
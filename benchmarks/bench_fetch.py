@@ -0,0 +1,99 @@
+"""
+    bench_fetch.py
+    -----------
+    Measures the throughput and resilience of the fetch layer by running the SpaceDock, Curse and CKAN pipelines
+    against the local mock server (see mock_server.py), in a number of network scenarios: no faults, latency,
+    limited bandwidth, throttling (429), server errors (503), an overloaded server and interrupted downloads.
+
+    Usage:
+        python3 benchmarks/bench_fetch.py [--scale N] [scenario ...]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer'))
+
+import ckan
+import curse
+import fetch
+import headless
+import mock_server
+import spacedock
+
+# Mock server settings for each scenario
+SCENARIOS = {'clean': {},
+             'latency': {'latency': 0.05, 'jitter': 0.05},
+             'bandwidth': {'bandwidth': 256 * 1024},
+             'throttled': {'throttle_rate': 0.1, 'retry_after': 0},
+             'errors': {'error_rate': 0.05},
+             'overloaded': {'max_concurrent': 2, 'retry_after': 0},
+             'interrupted': {'drop_rate': 0.9}}
+
+
+def run_scenario(name, settings, scale):
+    """Runs all pipelines against a mock server with "settings", returns a dict with the results.
+
+    Each scenario starts with an empty 'data' directory, so nothing is known from a previous scenario.
+    """
+
+    os.makedirs(name)
+    os.chdir(name)
+
+    server = mock_server.MockRepositoryServer(scale=scale, **settings)
+    server.start()
+
+    # Point the repositories at the mock server, with a new fetcher (the rate limits are learned per run)
+    spacedock.SPACEDOCK_URL = server.url
+    curse.CURSE_URL = server.url + '/ksp-mods/kerbal'
+    ckan.CKAN_REPO = server.url + '/master.tar.gz'
+    fetch._fetcher = None
+
+    error = None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            headless.update(list(headless.PIPELINES.keys()), db_file=os.path.join('data', 'database.db'))
+    except Exception as e:
+        error = e
+    elapsed = time.perf_counter() - start
+    server.stop()
+    os.chdir('..')
+
+    stats = server.stats
+    return {'name': name,
+            'time': elapsed,
+            'requests': stats['requests'],
+            'retried': stats['requests'] - stats['status_200'],
+            'bytes': stats['bytes'],
+            'error': error}
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs all pipelines against the mock server in several scenarios.')
+    parser.add_argument('--scale', type=int, default=10, help='size of the data, times the fixtures')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default all): ' + ', '.join(SCENARIOS))
+    args = parser.parse_args()
+
+    print('{:12} {:>8} {:>9} {:>8} {:>12} {:>10}  {}'.format('Scenario', 'Time (s)', 'Requests', 'Retried',
+                                                            'Bytes', 'kB/s', 'Result'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The pipelines write to the 'data' directory in the current directory
+        cwd = os.getcwd()
+        os.chdir(directory)
+
+        for name in args.scenarios or SCENARIOS:
+            result = run_scenario(name, SCENARIOS[name], args.scale)
+            print('{:12} {:8.2f} {:9} {:8} {:12} {:10.0f}  {}'.format(
+                name, result['time'], result['requests'], result['retried'], result['bytes'],
+                result['bytes'] / result['time'] / 1024, result['error'] or 'OK'))
+
+        os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+    bench_matching.py
+    -----------
+    Measures the time to match two lists of synthetic mod names, where part of the names in the second list are
+    slightly changed versions of names in the first list (removed spaces, different case, plural etc).
+
+    Usage:
+        python3 benchmarks/bench_matching.py [number of names]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer'))
+
+import matching
+
+
+def random_names(count, seed=1):
+    """Returns two lists of names, about half of the names in the second list are variants of the first list."""
+
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(3, 9))).capitalize()
+             for _ in range(count // 5)]
+    names = list(dict.fromkeys(' '.join(rnd.sample(words, rnd.randint(1, 4))) for _ in range(count)))
+
+    variants = [lambda name: name.replace(' ', '', 1),
+                lambda name: name.lower(),
+                lambda name: name + 's',
+                lambda name: name[:-1]]
+
+    other_names = []
+    for name in names:
+        if rnd.random() < 0.5:
+            other_names.append(rnd.choice(variants)(name))
+        else:
+            other_names.append(' '.join(rnd.sample(words, rnd.randint(1, 4))))
+    return names, other_names
+
+def main(count):
+    names, other_names = random_names(count)
+
+    start = time.perf_counter()
+    renamed = matching.match_names(other_names, names)
+    candidates = matching.find_candidates(other_names, names, renamed)
+    elapsed = time.perf_counter() - start
+
+    print('{} x {} names matched in {:.2f} s, {} renamed, {} candidates'.format(
+        len(other_names), len(names), elapsed, len(renamed), len(candidates)))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,72 @@
+"""
+    bench_memory.py
+    -----------
+    Measures the memory used by the mod data of each repository with tracemalloc, on the repository fixtures
+    (see synthetic.py): the peak memory while processing, and the memory still held by the resulting mods.
+
+    The CKAN refresh processes all CKAN data files into the staging table, selects the latest version of each mod
+    and updates the database. Its peak memory should not grow with the number of mod versions.
+
+    Usage:
+        python3 benchmarks/bench_memory.py [--scale N]
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer'))
+
+import bench_stages
+import synthetic
+
+
+def measure(func, *args):
+    """Calls "func" and returns (result, peak memory, memory held by the result) in bytes."""
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak, held
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the memory used by the mod data of each repository.')
+    parser.add_argument('--scale', type=int, default=50, help='size of the data set, times the fixtures')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The CKAN pipeline writes the CKAN archive to the 'data' directory in the current directory
+        cwd = os.getcwd()
+        os.chdir(directory)
+        os.makedirs('data')
+
+        print('Generating data at scale', args.scale, '...', file=sys.stderr)
+        spacedock_pages = synthetic.spacedock_pages(args.scale)
+        curse_pages = synthetic.curse_pages(args.scale)
+        tarball = synthetic.ckan_tarball(os.path.join(directory, 'master.tar.gz'), args.scale)
+        db_file = bench_stages.new_database(directory, 'bench.db')
+
+        benchmarks = [('spacedock_parse', bench_stages.parse_spacedock, (spacedock_pages,)),
+                      ('curse_parse', bench_stages.parse_curse, (curse_pages,)),
+                      ('ckan_refresh', bench_stages.ckan_refresh, (db_file, tarball))]
+
+        print('{:20} {:>8} {:>14} {:>14}'.format('Benchmark', 'Mods', 'Peak (MB)', 'Held (MB)'))
+        for name, func, func_args in benchmarks:
+            with contextlib.redirect_stdout(io.StringIO()):
+                mods, peak, held = measure(func, *func_args)
+            print('{:20} {:8} {:14.2f} {:14.2f}'.format(name, len(mods), peak / 1024 / 1024, held / 1024 / 1024))
+            del mods
+
+        os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
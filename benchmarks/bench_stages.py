@@ -0,0 +1,172 @@
+"""
+    bench_stages.py
+    -----------
+    Benchmarks each processing stage offline with the repository fixtures (see synthetic.py):
+    SpaceDock page parsing, Curse page parsing, the CKAN pipeline on a tarball and version selection,
+    update_db for each repository and update_total_mods.
+    Also compares reading one CKAN data file from the tarball and from the CKAN archive (see ckan_archive.py),
+    and reading all files and only the changed files from a git repository (see ckan_git.py).
+
+    The results are saved in "benchmarks/results" and compared with the previous run at the same scale.
+    Exits with status 1 if a stage is more than harness.REGRESSION_THRESHOLD slower than in the previous run.
+
+    Usage:
+        python3 benchmarks/bench_stages.py [--scale N] [--rounds N] [stage ...]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer'))
+
+import ckan
+import ckan_archive
+import curse
+import harness
+import helpers
+import spacedock
+import synthetic
+
+
+def parse_spacedock(pages):
+    """Parses and normalizes all SpaceDock pages, returns the dict of mods."""
+
+    mods = {}
+    for page, data in enumerate(pages, 1):
+        mods.update(spacedock.normalize_page(spacedock.parse_page((page, data)))[2])
+    return mods
+
+def parse_curse(pages):
+    """Parses all Curse pages, returns the dict of mods."""
+
+    mods = {}
+    for html in pages:
+        mods.update(curse.parse_mods(html))
+    return mods
+
+class LocalCKANPipeline(ckan.CKANPipeline):
+    """CKAN pipeline reading a local tarball or git repository, instead of downloading the CKAN-meta tarball.
+
+    Only the source differs from a refresh, the files are read, parsed, staged and selected by the pipeline.
+    """
+
+    def __init__(self, db_file, tarball=None, git_repo=None):
+        super().__init__(db_file, False)
+        self.tarball = tarball
+        self.git_repo = git_repo
+
+    def source(self):
+        if self.git_repo:
+            return self.read_git(self.git_repo)
+        return self.read_tarball(self.tarball)
+
+def ckan_refresh(db_file, tarball=None, git_repo=None):
+    """Runs the CKAN pipeline on a local tarball or git repository, returns the mods."""
+
+    return LocalCKANPipeline(db_file, tarball, git_repo).run()
+
+def read_tarball_file(tarball, path):
+    """Reads one CKAN data file from the tarball, returns the data."""
+
+    return next(data for file_name, data in ckan.read_ckan_files(tarball) if file_name == path)
+
+def new_file(directory, name):
+    """Removes the file if it exists, returns the file name."""
+
+    file_name = os.path.join(directory, name)
+    if os.path.exists(file_name):
+        os.remove(file_name)
+    return file_name
+
+def new_database(directory, name, tables=None):
+    """Creates an empty database, or a copy of the database in "tables" if given, returns the file name."""
+
+    db_file = new_file(directory, name)
+    if tables:
+        shutil.copyfile(tables, db_file)
+    else:
+        helpers.init_database(db_file)
+    return db_file
+
+def get_benchmarks(scale, directory):
+    """Prepares the data at "scale" and returns a list of (name, func, setup) benchmarks."""
+
+    print('Generating data at scale', scale, '...', file=sys.stderr)
+    spacedock_pages = synthetic.spacedock_pages(scale)
+    curse_pages = synthetic.curse_pages(scale)
+    tarball = synthetic.ckan_tarball(os.path.join(directory, 'master.tar.gz'), scale)
+
+    spacedock_mods = parse_spacedock(spacedock_pages)
+    curse_mods = parse_curse(curse_pages)
+    # Database with all repositories, for update_total_mods and the CKAN version selection
+    all_tables = new_database(directory, 'all.db')
+    ckan_mods = ckan_refresh(all_tables, tarball)
+    helpers.update_db('SpaceDock', spacedock_mods, all_tables)
+    helpers.update_db('Curse', curse_mods, all_tables)
+
+    # CKAN archive, and the last file in the tarball for reading one file
+    archive_file = os.path.join(directory, 'ckan-meta.db')
+    ckan_archive.build(tarball, archive_file)
+    paths = [file_name for file_name, data in ckan.read_ckan_files(tarball)]
+    path = paths[-1]
+
+    # Git repository with the CKAN files, and a database synced to the first commit before a commit with changes
+    repo = synthetic.ckan_git_repo(os.path.join(directory, 'CKAN-meta'), scale)
+    synced = new_database(directory, 'synced.db')
+    ckan_refresh(synced, git_repo=repo)
+    synthetic.ckan_git_commit(repo)
+
+    print('{} SpaceDock pages, {} Curse pages, {} CKAN files'.format(
+        len(spacedock_pages), len(curse_pages), len(paths)),
+        file=sys.stderr)
+
+    return [('spacedock_parse', parse_spacedock, lambda: (spacedock_pages,)),
+            ('curse_parse', parse_curse, lambda: (curse_pages,)),
+            ('ckan_refresh', ckan_refresh, lambda: (new_database(directory, 'bench.db'), tarball)),
+            ('ckan_select', ckan.select_mods, lambda: (new_database(directory, 'bench.db', tables=all_tables),)),
+            ('ckan_archive_build', ckan_archive.build, lambda: (tarball, new_file(directory, 'archive.db'))),
+            ('ckan_read_one_tarball', read_tarball_file, lambda: (tarball, path)),
+            ('ckan_read_one_archive', ckan_archive.read_file, lambda: (path, archive_file)),
+            ('ckan_git_all', ckan_refresh, lambda: (new_database(directory, 'bench.db'), None, repo)),
+            ('ckan_git_changed', ckan_refresh,
+             lambda: (new_database(directory, 'bench.db', tables=synced), None, repo)),
+            ('update_db_spacedock', helpers.update_db,
+             lambda: ('SpaceDock', spacedock_mods, new_database(directory, 'bench.db'))),
+            ('update_db_curse', helpers.update_db,
+             lambda: ('Curse', curse_mods, new_database(directory, 'bench.db'))),
+            ('update_db_ckan', helpers.update_db,
+             lambda: ('CKAN', ckan_mods, new_database(directory, 'bench.db'))),
+            ('update_total_mods', helpers.update_total_mods,
+             lambda: (new_database(directory, 'bench.db', tables=all_tables),))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks each processing stage with the repository fixtures.')
+    parser.add_argument('--scale', type=int, default=10, help='size of the data set, times the fixtures')
+    parser.add_argument('--rounds', type=int, default=5, help='number of rounds for each stage')
+    parser.add_argument('stages', nargs='*', help='stages to run (default all)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The CKAN pipeline writes the CKAN archive to the 'data' directory in the current directory
+        cwd = os.getcwd()
+        os.chdir(directory)
+        os.makedirs('data')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarks = get_benchmarks(args.scale, directory)
+        if args.stages:
+            benchmarks = [benchmark for benchmark in benchmarks if benchmark[0] in args.stages]
+
+        regressions = harness.run('stages-x{}'.format(args.scale), benchmarks, args.rounds)
+        os.chdir(cwd)
+
+    if regressions:
+        sys.exit('Regressions: ' + ', '.join(regressions))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+    bench_startup.py
+    -----------
+    Measures the start of the application: the import time of each module ("python -X importtime") and the wall
+    clock time until the window is shown and until the table has been loaded from a database with the repository
+    fixtures (see synthetic.py).
+
+    Usage:
+        python3 benchmarks/bench_startup.py [--scale N] [--modules N]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ksp-mod-analyzer')
+sys.path.insert(0, APP_DIR)
+
+import helpers
+import synthetic
+from bench_stages import ckan_refresh, parse_curse, parse_spacedock
+
+
+def import_profile(modules):
+    """Prints the "modules" slowest imports of the main module, by cumulative import time."""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                            cwd=APP_DIR, capture_output=True, text=True)
+
+    # Lines are "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'self [us]' not in line:
+            self_time, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((int(cumulative), int(self_time), name.rstrip()))
+
+    print('{:>10} {:>10}  {}'.format('Cumul (ms)', 'Self (ms)', 'Module'))
+    for cumulative, self_time, name in sorted(imports, reverse=True)[:modules]:
+        print('{:10.1f} {:10.1f}  {}'.format(cumulative / 1000, self_time / 1000, name))
+
+def create_database(directory, scale):
+    """Creates 'data/database.db' in "directory" with all repositories at "scale"."""
+
+    db_file = os.path.join(directory, 'data', 'database.db')
+    os.makedirs(os.path.dirname(db_file))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        helpers.init_database(db_file)
+        helpers.update_db('SpaceDock', parse_spacedock(synthetic.spacedock_pages(scale)), db_file)
+        helpers.update_db('Curse', parse_curse(synthetic.curse_pages(scale)), db_file)
+        ckan_refresh(db_file, synthetic.ckan_tarball(os.path.join(directory, 'master.tar.gz'), scale))
+        helpers.update_total_mods(db_file)
+
+def startup_time(directory):
+    """Starts the application with "--startup-profile", prints the wall clock time of each startup step."""
+
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if not env.get('DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(APP_DIR, 'main.py'), '--startup-profile'],
+                               cwd=directory, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    for line in process.stdout:
+        if line.startswith('Startup:'):
+            print('{:8.3f} s  {}'.format(time.perf_counter() - start, line[len('Startup:'):].strip()))
+    process.wait()
+    print('{:8.3f} s  exited'.format(time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the start of the application.')
+    parser.add_argument('--scale', type=int, default=100, help='size of the database, times the fixtures')
+    parser.add_argument('--modules', type=int, default=15, help='number of modules in the import profile')
+    args = parser.parse_args()
+
+    import_profile(args.modules)
+    print()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The CKAN pipeline writes the CKAN archive to the 'data' directory in the current directory
+        cwd = os.getcwd()
+        os.chdir(directory)
+        create_database(directory, args.scale)
+        os.chdir(cwd)
+        startup_time(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+    harness.py
+    -----------
+    Implements a small benchmark harness for the benchmark scripts, in the style of pytest-benchmark:
+    each benchmark runs a number of rounds (with an untimed setup before each round), the min, max, mean, median
+    and standard deviation are reported, and the results are saved as JSON in "benchmarks/results" so a run can be
+    compared with the previous run, offline and without any test framework.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# A benchmark with a median time this much (fraction) higher than in the previous run is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+def bench(name, func, setup=None, rounds=5, quiet=True):
+    """Runs "func" for "rounds" rounds and returns a dict with the statistics (times in seconds).
+
+    "setup" is called before each round (not timed) and returns the arguments for "func" as a tuple.
+    With "quiet", the output printed by "func" is suppressed.
+    """
+
+    times = []
+    for _ in range(rounds):
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            args = setup() if setup else ()
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+
+    return {'name': name,
+            'rounds': rounds,
+            'min': min(times),
+            'max': max(times),
+            'mean': statistics.mean(times),
+            'median': statistics.median(times),
+            'stddev': statistics.stdev(times) if rounds > 1 else 0.0}
+
+def save(results, label, results_dir=RESULTS_DIR):
+    """Saves the results of a run as "<label>-<date and time>.json", returns the file name."""
+
+    os.makedirs(results_dir, exist_ok=True)
+    file_name = os.path.join(results_dir, '{}-{}.json'.format(label, datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(file_name, 'w', encoding='utf-8') as f:
+        json.dump({'label': label,
+                   'time': time.time(),
+                   'python': sys.version.split()[0],
+                   'platform': platform.platform(),
+                   'results': {result['name']: result for result in results}}, f, indent=2)
+    return file_name
+
+def load_previous(label, results_dir=RESULTS_DIR):
+    """Returns the last saved result of each benchmark with this label as {name: result}.
+
+    Runs of only some of the benchmarks are combined, so each benchmark is compared with its own last run.
+    """
+
+    try:
+        file_names = sorted(f for f in os.listdir(results_dir) if f.startswith(label + '-') and f.endswith('.json'))
+    except FileNotFoundError:
+        return {}
+
+    previous = {}
+    for file_name in file_names:
+        with open(os.path.join(results_dir, file_name), encoding='utf-8') as f:
+            previous.update(json.load(f)['results'])
+    return previous
+
+def report(results, previous=None):
+    """Prints the results, compared with the previous run if available. Returns the names of regressions."""
+
+    previous = previous or {}
+    regressions = []
+
+    print('{:36} {:>10} {:>10} {:>10} {:>10} {:>8}'.format('Benchmark', 'Min (ms)', 'Median', 'Mean', 'Stddev',
+                                                          'Change'))
+    for result in results:
+        change = ''
+        before = previous.get(result['name'])
+        if before:
+            ratio = result['median'] / before['median'] - 1
+            change = '{:+.0%}'.format(ratio)
+            if ratio > REGRESSION_THRESHOLD:
+                change += ' REGRESSION'
+                regressions.append(result['name'])
+
+        print('{:36} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:>8}'.format(
+            result['name'], result['min'] * 1000, result['median'] * 1000, result['mean'] * 1000,
+            result['stddev'] * 1000, change))
+
+    return regressions
+
+def run(label, benchmarks, rounds=5):
+    """Runs a list of (name, func, setup) benchmarks, prints and saves the results.
+
+    Returns the names of the benchmarks that regressed compared with the previous run.
+    """
+
+    previous = load_previous(label)
+
+    results = []
+    for name, func, setup in benchmarks:
+        print('Running', name, '...', file=sys.stderr)
+        results.append(bench(name, func, setup, rounds))
+
+    regressions = report(results, previous)
+    print('Results saved to', save(results, label))
+    return regressions
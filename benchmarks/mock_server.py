@@ -0,0 +1,274 @@
+"""
+    mock_server.py
+    -----------
+    Implements a local HTTP server serving the repository fixtures (see synthetic.py) in place of SpaceDock,
+    Curse and the CKAN-meta tarball, for load and latency testing of the fetch layer on one machine.
+
+    Faults can be injected for each request:
+        - latency: fixed delay plus random jitter before responding
+        - bandwidth: max bytes/s for each response body
+        - error rate: fraction of requests answered with an error status (default 503)
+        - throttle rate: fraction of requests answered with 429 and a 'Retry-After' header
+        - max concurrent: requests above this number in flight are answered with 429
+        - drop rate: fraction of tarball downloads where the connection is closed halfway through the data
+
+    The tarball is served with an 'ETag' and supports Range requests (with 'If-Range') and conditional requests
+    (with 'If-None-Match'), like GitHub.
+
+    Paths:
+        /api/browse?page=N           SpaceDock API pages
+        /ksp-mods/kerbal?page=N      Curse listing pages
+        /master.tar.gz               CKAN-meta tarball
+        /stats                       Number of requests, responses by status and bytes sent (JSON)
+
+    Usage:
+        python3 benchmarks/mock_server.py [--port 8080] [--scale 10] [--latency 0.05] [--error-rate 0.05] ...
+
+    The application is then pointed at the server with environment variables:
+        KSP_SPACEDOCK_URL=http://127.0.0.1:8080
+        KSP_CURSE_URL=http://127.0.0.1:8080/ksp-mods/kerbal
+        KSP_CKAN_REPO=http://127.0.0.1:8080/master.tar.gz
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import synthetic
+
+# Size of the chunks written when the bandwidth is limited
+CHUNK_SIZE = 16384
+
+
+class MockRepositoryServer(ThreadingHTTPServer):
+    """HTTP server with the repository data and the fault injection settings."""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), scale=1, latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0,
+                 error_status=503, throttle_rate=0.0, retry_after=1, max_concurrent=None, drop_rate=0.0, seed=1):
+        super().__init__(address, MockRepositoryHandler)
+
+        self.spacedock_pages = synthetic.spacedock_pages(scale)
+        self.curse_pages = synthetic.curse_pages(scale)
+        self.ckan_tarball = synthetic.ckan_tarball_bytes(scale)
+        self.ckan_etag = '"{}"'.format(hashlib.sha1(self.ckan_tarball).hexdigest())
+
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_concurrent = max_concurrent
+        self.drop_rate = drop_rate
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = Counter()
+        self.thread = None
+
+    @property
+    def url(self):
+        """Returns the base URL of the server, e.g. "http://127.0.0.1:8080"."""
+
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def environment(self):
+        """Returns the environment variables pointing the application at this server."""
+
+        return {'KSP_SPACEDOCK_URL': self.url,
+                'KSP_CURSE_URL': self.url + '/ksp-mods/kerbal',
+                'KSP_CKAN_REPO': self.url + '/master.tar.gz'}
+
+    def start(self):
+        """Starts serving in a background thread, returns the base URL."""
+
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        """Stops the server started with "start"."""
+
+        self.shutdown()
+        self.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def fault(self):
+        """Returns the status code of an injected fault for a new request, or None."""
+
+        with self.lock:
+            if self.max_concurrent is not None and self.in_flight > self.max_concurrent:
+                return 429
+
+            draw = self.random.random()
+            if draw < self.throttle_rate:
+                return 429
+            if draw < self.throttle_rate + self.error_rate:
+                return self.error_status
+            return None
+
+    def drop(self):
+        """Checks if the connection should be closed before all data has been sent."""
+
+        with self.lock:
+            return self.random.random() < self.drop_rate
+
+    def handle_error(self, request, client_address):
+        """Counts errors such as connections closed by the client, instead of printing a traceback."""
+
+        self.count('connection_errors')
+
+    def count(self, key, value=1):
+        """Adds to a statistics counter."""
+
+        with self.lock:
+            self.stats[key] += value
+
+
+class MockRepositoryHandler(BaseHTTPRequestHandler):
+    """Request handler, serves the repository data with the faults configured in the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+        try:
+            self.handle_get()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def handle_get(self):
+        server = self.server
+        server.count('requests')
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + server.random.uniform(0, server.jitter))
+
+        url = urlsplit(self.path)
+        if url.path == '/stats':
+            return self.send(200, json.dumps(dict(server.stats)).encode('utf-8'), 'application/json')
+
+        status = server.fault()
+        if status == 429:
+            return self.send(429, b'Too Many Requests', 'text/plain', {'Retry-After': str(server.retry_after)})
+        if status:
+            return self.send(status, b'Server Error', 'text/plain')
+
+        page = int(parse_qs(url.query).get('page', ['1'])[0])
+        if url.path == '/api/browse':
+            self.send_page(server.spacedock_pages, page, 'application/json')
+        elif url.path == '/ksp-mods/kerbal':
+            self.send_page(server.curse_pages, page, 'text/html; charset=utf-8')
+        elif url.path == '/master.tar.gz':
+            self.send_file(server.ckan_tarball, server.ckan_etag, 'application/gzip')
+        else:
+            self.send(404, b'Not Found', 'text/plain')
+
+    def send_page(self, pages, page, content_type):
+        """Sends a page, pages beyond the last page return the last page (like Curse)."""
+
+        self.send(200, pages[max(1, min(page, len(pages))) - 1], content_type)
+
+    def send_file(self, body, etag, content_type):
+        """Sends a file, or the part of it asked for in a 'Range: bytes=N-' header if the 'If-Range' header (if any)
+        matches the ETag, or '304 Not Modified' if the 'If-None-Match' header matches the ETag. Some downloads are
+        cut off halfway, depending on the drop rate.
+        """
+
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        if self.headers.get('If-None-Match') == etag:
+            return self.send(304, b'', content_type, headers)
+
+        status = 200
+        start = 0
+
+        requested = self.headers.get('Range', '')
+        if requested.startswith('bytes=') and self.headers.get('If-Range', etag) == etag:
+            start = int(requested[6:].split('-')[0])
+            if start >= len(body):
+                headers['Content-Range'] = 'bytes */{}'.format(len(body))
+                return self.send(416, b'', content_type, headers)
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body))
+
+        part = body[start:]
+        if self.server.drop():
+            self.server.count('dropped')
+            return self.send(status, part, content_type, headers, cut_off=len(part) // 2)
+        self.send(status, part, content_type, headers)
+
+    def send(self, status, body, content_type, headers=None, cut_off=None):
+        """Sends a response, limited to the configured bandwidth.
+
+        With "cut_off", only that many bytes are sent before the connection is closed.
+        """
+
+        self.server.count('status_{}'.format(status))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        sent = body if cut_off is None else body[:cut_off]
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(sent)
+        else:
+            for start in range(0, len(sent), CHUNK_SIZE):
+                chunk = sent[start:start + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / bandwidth)
+        self.server.count('bytes', len(sent))
+
+        if cut_off is not None:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        """Doesn't log each request."""
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock server for SpaceDock, Curse and CKAN.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scale', type=int, default=10, help='size of the data, times the fixtures')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay before each response (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max random delay added to the latency (s)')
+    parser.add_argument('--bandwidth', type=float, default=None, help='max bytes/s for each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of error responses')
+    parser.add_argument('--error-status', type=int, default=503, help='status code of error responses')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of 429 responses')
+    parser.add_argument('--retry-after', type=int, default=1, help="'Retry-After' of 429 responses (s)")
+    parser.add_argument('--max-concurrent', type=int, default=None, help='429 above this many requests in flight')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of tarball downloads cut off halfway')
+    args = parser.parse_args()
+
+    server = MockRepositoryServer(('127.0.0.1', args.port), args.scale, args.latency, args.jitter, args.bandwidth,
+                                  args.error_rate, args.error_status, args.throttle_rate, args.retry_after,
+                                  args.max_concurrent, args.drop_rate)
+    print('Serving on', server.url)
+    for name, value in server.environment().items():
+        print('    {}={}'.format(name, value))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(dict(server.stats)))
+
+if __name__ == "__main__":
+    main()
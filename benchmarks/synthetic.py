@@ -0,0 +1,177 @@
+"""
+    synthetic.py
+    -----------
+    Loads the repository fixtures in "benchmarks/fixtures" and generates larger data sets from them, for
+    benchmarking the processing of each repository offline:
+        - fixtures/spacedock/page_*.json: SpaceDock API pages (api/browse)
+        - fixtures/curse/page_*.html: Curse mod listing pages
+        - fixtures/ckan/master.tar.gz: CKAN-meta repository tarball, also used for creating a local git repository
+          like a clone of CKAN-meta
+
+    With "scale" > 1 the fixture data is repeated "scale" times, where each copy gets other mod names and ids,
+    so a data set 10-100 times the size of the fixtures has the same structure and the same mix of names.
+"""
+
+import glob
+import io
+import json
+import os
+import re
+import subprocess
+import tarfile
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Added to the ids of each copy of the fixture data
+ID_OFFSET = 1000000
+
+# Author of the commits in the generated git repositories
+GIT_AUTHOR = ['-c', 'user.name=Fixtures', '-c', 'user.email=fixtures@localhost']
+
+RE_CURSE_TITLE = re.compile(rb'(<h4><a href="[^"]*">)([^<]*)(</a>)')
+RE_CURSE_ID = re.compile(rb'(/ksp-mods/kerbal/)(\d+)')
+RE_CURSE_PAGE_LINK = re.compile(rb'(\?page=)(\d+)(" class="b-pagination-item">)(\d+)')
+
+
+def read_files(pattern):
+    """Returns the content of the fixture files matching "pattern", sorted by the page number in the name."""
+
+    file_names = glob.glob(os.path.join(FIXTURES_DIR, pattern))
+    file_names.sort(key=lambda file_name: int(re.findall(r'\d+', os.path.basename(file_name))[0]))
+    return [open(file_name, 'rb').read() for file_name in file_names]
+
+def copy_name(name, copy):
+    """Returns the name of a mod in a copy of the fixture data, the first copy keeps the original names."""
+
+    return name if copy == 0 else '{} Copy{}'.format(name, copy)
+
+def spacedock_pages(scale=1):
+    """Returns a list of SpaceDock API pages (JSON bytes), "scale" times the fixture pages."""
+
+    fixtures = [json.loads(data.decode('utf-8')) for data in read_files('spacedock/page_*.json')]
+    pages = len(fixtures) * scale
+
+    result = []
+    for copy in range(scale):
+        for fixture in fixtures:
+            page = dict(fixture, pages=pages, page=len(result) + 1, total=fixture['total'] * scale)
+            page['result'] = [dict(mod, name=copy_name(mod['name'], copy), id=mod['id'] + copy * ID_OFFSET)
+                              for mod in fixture['result']]
+            result.append(json.dumps(page).encode('utf-8'))
+    return result
+
+def curse_pages(scale=1):
+    """Returns a list of Curse listing pages (HTML bytes), "scale" times the fixture pages.
+
+    The pagination links of all pages are updated to the number of generated pages.
+    """
+
+    fixtures = read_files('curse/page_*.html')
+    pages = len(fixtures) * scale
+
+    result = []
+    for copy in range(scale):
+        for html in fixtures:
+            if copy:
+                html = RE_CURSE_TITLE.sub(lambda m: m.group(1) + copy_name(m.group(2).decode('utf-8'), copy)
+                                          .encode('utf-8') + m.group(3), html)
+                html = RE_CURSE_ID.sub(lambda m: m.group(1) + str(int(m.group(2)) + copy * ID_OFFSET).encode(), html)
+
+            # The highest pagination link points to the last generated page, no link points beyond it
+            last = max((int(link[1]) for link in RE_CURSE_PAGE_LINK.findall(html)), default=0)
+            html = RE_CURSE_PAGE_LINK.sub(lambda m: page_link(m, pages if int(m.group(2)) == last else
+                                                              min(int(m.group(2)), pages)), html)
+            result.append(html)
+    return result
+
+def page_link(match, page):
+    """Returns a Curse pagination link matched by RE_CURSE_PAGE_LINK, changed to link to "page"."""
+
+    page = str(page).encode()
+    return match.group(1) + page + match.group(3) + page
+
+def ckan_files(scale=1):
+    """Returns a list of (file name, data) for the CKAN data files, "scale" times the fixture files."""
+
+    with tarfile.open(os.path.join(FIXTURES_DIR, 'ckan', 'master.tar.gz'), 'r:gz') as tar:
+        fixtures = [(tarinfo.name, tar.extractfile(tarinfo).read()) for tarinfo in tar if tarinfo.isfile()]
+
+    result = []
+    for copy in range(scale):
+        for file_name, data in fixtures:
+            if copy and file_name.endswith('.ckan'):
+                mod = json.loads(data.decode('utf-8'))
+                mod['identifier'] = '{}-Copy{}'.format(mod['identifier'], copy)
+                mod['name'] = copy_name(mod['name'], copy)
+                file_name = '{}/{}/{}-{}.ckan'.format(file_name.split('/')[0], mod['identifier'],
+                                                      mod['identifier'], mod['version'])
+                data = json.dumps(mod, indent=4).encode('utf-8')
+            elif copy:
+                continue
+            result.append((file_name, data))
+    return result
+
+def ckan_tarball_bytes(scale=1):
+    """Returns a CKAN-meta tarball (gzip compressed tar file) with "scale" times the fixture files."""
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, data in ckan_files(scale):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    return buffer.getvalue()
+
+def ckan_tarball(file_name, scale=1):
+    """Writes a CKAN-meta tarball with "scale" times the fixture files to "file_name"."""
+
+    with open(file_name, 'wb') as f:
+        f.write(ckan_tarball_bytes(scale))
+    return file_name
+
+def git(repo, *args):
+    """Runs a git command in a generated repository."""
+
+    subprocess.run(['git', '-C', repo] + GIT_AUTHOR + list(args), check=True, stdout=subprocess.DEVNULL)
+
+def ckan_git_repo(directory, scale=1):
+    """Creates a git repository like a clone of CKAN-meta in "directory", with "scale" times the fixture files in
+    one commit. Returns the directory.
+    """
+
+    for file_name, data in ckan_files(scale):
+        path = os.path.join(directory, file_name.split('/', 1)[-1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    git(directory, 'init', '-q')
+    git(directory, 'add', '-A')
+    git(directory, 'commit', '-q', '-m', 'CKAN-meta fixtures')
+    return directory
+
+def ckan_git_commit(directory, changes=10):
+    """Adds a commit to a repository created by "ckan_git_repo": a new version of "changes" mods and one deleted
+    file. Returns the paths of the added and deleted files.
+    """
+
+    paths = sorted(os.path.relpath(os.path.join(root, name), directory)
+                   for root, dirs, names in os.walk(directory) if '.git' not in root
+                   for name in names if name.endswith('.ckan'))
+
+    added = []
+    for path in paths[:changes]:
+        with open(os.path.join(directory, path), 'rb') as f:
+            mod = json.loads(f.read().decode('utf-8'))
+        mod['version'] = mod['version'] + '.1'
+        new_path = '{}/{}-{}.ckan'.format(os.path.dirname(path), mod['identifier'], mod['version'])
+        with open(os.path.join(directory, new_path), 'wb') as f:
+            f.write(json.dumps(mod, indent=4).encode('utf-8'))
+        added.append(new_path)
+
+    deleted = paths[-1]
+    os.remove(os.path.join(directory, deleted))
+
+    git(directory, 'add', '-A')
+    git(directory, 'commit', '-q', '-m', 'New versions')
+    return added, [deleted]
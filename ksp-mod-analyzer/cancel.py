@@ -0,0 +1,126 @@
+"""
+    cancel.py
+    -----------
+    Implements cancellation of a refresh, also while a thread is blocked in a network call.
+
+    A refresh has a 'CancelToken', which is made active for the threads working on that refresh (the pipeline does
+    this for all its threads, like the 'Metrics' object in metrics.py). The HTTP core (fetch.py) registers each
+    connection sending a request with the active token, and waits between retries with "sleep" of the token.
+    Cancelling the token then shuts down the sockets of its connections, so a thread waiting for a response or
+    reading a download gets an error at once instead of waiting for the data or the timeout, and wakes up threads
+    waiting in "sleep".
+"""
+
+import contextlib
+import socket
+import threading
+import time
+import weakref
+
+
+class Cancelled(Exception):
+    """Raised when a refresh has been cancelled."""
+
+
+class CancelToken:
+    """Cancellation state of one refresh, shared by all its threads."""
+
+    def __init__(self, name=''):
+        self.name = name
+        self._event = threading.Event()
+
+        # Connections with a request running for this refresh, weak references so closed connections are dropped
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancels the refresh, aborts all network calls in progress."""
+
+        self._event.set()
+
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            abort(connection)
+
+    def check(self):
+        """Raises 'Cancelled' if the refresh has been cancelled."""
+
+        if self._event.is_set():
+            raise Cancelled(self.name)
+
+    def sleep(self, delay):
+        """Waits "delay" seconds, raises 'Cancelled' if the refresh is cancelled before or while waiting."""
+
+        if self._event.wait(delay):
+            raise Cancelled(self.name)
+
+    def register(self, connection):
+        """Registers a connection used for a request, aborted if the refresh is cancelled."""
+
+        with self._lock:
+            self._connections.add(connection)
+
+        # Cancelled while registering, the connection may not have been aborted by "cancel"
+        if self._event.is_set():
+            abort(connection)
+
+    def unregister(self, connection):
+        """Removes a connection, e.g. when it's used for a request of another refresh."""
+
+        with self._lock:
+            self._connections.discard(connection)
+
+
+# The active 'CancelToken' of each thread
+_local = threading.local()
+
+
+def current():
+    """Returns the active 'CancelToken' of this thread, or None."""
+
+    return getattr(_local, 'token', None)
+
+@contextlib.contextmanager
+def activate(token):
+    """Makes "token" the active 'CancelToken' of this thread within the "with" block."""
+
+    previous = current()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+def check():
+    """Raises 'Cancelled' if the active token has been cancelled."""
+
+    token = current()
+    if token:
+        token.check()
+
+def sleep(delay):
+    """Waits "delay" seconds, returns early with 'Cancelled' if the active token is cancelled."""
+
+    token = current()
+    if token:
+        token.sleep(delay)
+    else:
+        time.sleep(delay)
+
+def abort(connection):
+    """Shuts down the socket of a connection, a thread blocked reading from or writing to it gets an error."""
+
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Already closed
+        pass
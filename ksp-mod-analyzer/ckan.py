@@ -1,262 +1,322 @@
 """
-    curse.py
+    ckan.py
     -----------
     Implements functions for parsing the CKAN repo.
+
+    The CKAN data files are read from the CKAN-meta tarball, or from a local git clone of CKAN-meta if the
+    environment variable KSP_CKAN_GIT is set to its path (see ckan_git.py).
 """
 
+import contextlib
+import itertools
 import json
-import sys
+import os
 import tarfile
-from collections import defaultdict
 
+import ckan_archive
+import ckan_git
+import database
+import fetch
 import helpers
-import requests
-from PyQt5 import QtCore
+import normalize
+import pipeline
+import records
+
+# Number of mod versions inserted into the staging table at a time
+STAGING_BATCH = 1000
 
-CKAN_REPO = 'https://github.com/KSP-CKAN/CKAN-meta/archive/master.tar.gz'
+# URL of the CKAN-meta tarball, can be changed with an environment variable, e.g. for a local mock server
+CKAN_REPO = os.environ.get('KSP_CKAN_REPO', 'https://github.com/KSP-CKAN/CKAN-meta/archive/master.tar.gz')
 
+# Progress (%) when the CKAN repo has been downloaded, the rest is for processing the files
+DOWNLOAD_PROGRESS = 80
 
-class CKANThread(QtCore.QThread):
-    """QThread for processing."""
+# Path of a local git clone of CKAN-meta, used instead of downloading CKAN_REPO if set
+CKAN_GIT = os.environ.get('KSP_CKAN_GIT')
 
-    # Signal for handling exceptions that may occur in the running thread
-    exception_signal = QtCore.pyqtSignal(str)
 
-    # Finished signal, emitted at the end of the run
-    finished_signal = QtCore.pyqtSignal(str)
+class CKANPipeline(pipeline.Pipeline):
+    """Pipeline for getting all mods from the CKAN repo: fetch (download and unpack) -> parse -> store.
 
-    # Cancelled signal, emitted when the thread is stopped
-    cancelled_signal = QtCore.pyqtSignal(str)
+    The data of each mod version is stored in the 'CKANStaging' table, and the latest version of each mod is
+    selected from that table, so only a batch of mod versions is held in memory.
+    """
 
-    # Signal for updating the progress bar
-    notify_progress_signal = QtCore.pyqtSignal(int)
+    name = 'CKAN'
 
     def __init__(self, db_file, use_cache):
         super().__init__()
         self.db_file = db_file
         self.use_cache = use_cache
-        self.keep_running = False
-
-    def __del__(self):
-        self.wait()
 
-    def stop(self):
-        """Stops the running thread gracefully."""
+        self.stages = [pipeline.Stage('parse', parse_ckan)]
 
-        print('Stopping CKAN thread...')
-        self.keep_running = False
+        # Mod versions not inserted into the staging table yet
+        self.staged = []
 
-        # Wait for the thread to stop
-        self.wait()
-        self.notify_progress_signal.emit(0)
-        self.cancelled_signal.emit('ckan')
-        print('CKAN thread stopped')
+        # Commit read from the git clone of CKAN-meta (or 'ETag' of the tarball) and where from, stored in "finish"
+        self.repo = None
+        self.commit = None
 
-    def run(self):
-        """Main thread processing loop."""
+    def source(self):
+        """Downloads the CKAN repo and yields (file name, data) for each CKAN data file."""
 
-        self.keep_running = True
+        # Check if cached data on disk should be used, the mod versions from the previous run are then still in
+        # the staging table
+        if self.use_cache:
+            return
 
-        try:
-            print('Starting CKAN thread...')
-            # Get data from CKAN repo and update database
-            self.update_ckan()
+        # Read only the changed files from the git clone, if used
+        if CKAN_GIT:
+            yield from self.read_git(CKAN_GIT)
+            return
 
-            # Update database table 'Total'
-            helpers.update_total_mods(self.db_file)
+        # Download the CKAN repo (tar file), unless it's unchanged since the staging table was filled from it
+        if self.download_ckan(CKAN_REPO, ckan_git.get_synced(self.db_file, CKAN_REPO)) is None:
+            self.changed = False
+            return
 
-            # Only emit signals if job was not cancelled (i.e. 'keep_running' is still True)
-            if self.keep_running:
-                self.notify_progress_signal.emit(100)
-                self.finished_signal.emit('ckan')
+        # The 'ETag' of the tar file is stored in "finish", like the commit read from a git clone
+        self.repo = CKAN_REPO
+        self.commit = fetch.get_validator('data/master.tar.gz')
 
-        # Exception handling:
-        # Emits a signal if an exception occurs in the running thread
-        # The main application will then show an error message about the problem
-        # This is needed because a new message box widget cannot be created/displayed in the thread
-        except Exception as e:
-            # Stop the thread
-            self.stop()
-            print('CKAN thread stopped at exception')
+        yield from self.read_tarball('data/master.tar.gz')
 
-            # Get info about the exception
-            (type, value, traceback) = sys.exc_info()
+    def read_tarball(self, file_name):
+        """Yields (file name, data) for each CKAN data file in the CKAN repo file, replacing all staged data."""
 
-            # Generate a detailed error message
-            msg = helpers.exception_message_qthread(type, value, traceback)
+        # The files are also stored in the CKAN archive, for reading single files later on
+        clear_staging(self.db_file)
+        for item in ckan_archive.index_files(read_ckan_files(file_name)):
+            self.check()
+            yield item
 
-            # Emit a signal with the error message to be displayed in a message box in the main UI
-            self.exception_signal.emit(msg)
+    def read_git(self, repo):
+        """Yields (file name, data) for each CKAN data file changed in the git clone since the previous run."""
 
-    def update_ckan(self):
-        """Updates the database with data from CKAN repo."""
+        self.progress(3)
 
-        # Check if cached data on disk should be used
-        if self.use_cache:
-            # Read raw mod list from disk
-            raw_mods = helpers.read_from_disk('data/ckan.data')
+        self.repo = repo
+        self.commit, changed, deleted = ckan_git.plan(repo, self.db_file)
+        self.total = len(changed)
+        self.changed = deleted is None or bool(changed or deleted)
 
+        # Remove the old data of changed and deleted files, or all data if all files are read
+        if deleted is None:
+            clear_staging(self.db_file)
         else:
-            # Download the CKAN repo (tar file)
-            self.download_ckan(CKAN_REPO)
-
-            raw_mods = process_ckan('data/master.tar.gz')
+            remove_staged(self.db_file, [path for path, blob in changed] + deleted)
 
-            # Write raw mods data to file
-            helpers.write_to_disk('data/ckan.data', raw_mods)
+        for item in ckan_archive.index_files(ckan_git.read_files(repo, changed), deleted=deleted):
+            self.check()
+            yield item
 
-        raw_mods_filtered = filter_raw_mods(raw_mods)
+    def store(self, item):
+        """Stores the data for one mod version, in batches of STAGING_BATCH mod versions."""
 
-        mods = {}
+        self.staged.append(item)
+        if len(self.staged) >= STAGING_BATCH:
+            stage_versions(self.db_file, self.staged)
+            self.staged = []
 
-        # Iterate over each mod id
-        for id in sorted(raw_mods_filtered.keys(), key=str.lower):
-            #print('##### ID "{}" #####'.format(id))
+    def finish(self):
+        """Selects the latest version of each mod and updates the database."""
 
-            mod_versions = sorted(raw_mods_filtered[id].keys())
-            highest_mod_version = helpers.get_highest_version(mod_versions)
+        stage_versions(self.db_file, self.staged)
+        self.staged = []
 
-            ksp_version = raw_mods_filtered[id][highest_mod_version][0]
-            mod_name = raw_mods_filtered[id][highest_mod_version][1]
-            source = raw_mods_filtered[id][highest_mod_version][2]
-            forum = raw_mods_filtered[id][highest_mod_version][3]
+        mods = select_mods(self.db_file)
 
-            mods[mod_name] = [ksp_version, source, forum]
+        if not self.changed:
+            print('No changes in CKAN-meta since the previous run')
+            helpers.update_refresh_time('CKAN', self.db_file)
+        else:
+            # Update the database
+            self.changed = helpers.update_db('CKAN', mods, self.db_file)
 
-        #raw_mods[identifier][mod_version] = [ksp_version, mod_name, source, forum, kerbalstuff, spacedock]
+        # The next run reads the files changed after this commit, or downloads the tarball only if changed
+        if self.commit:
+            ckan_git.set_synced(self.db_file, self.repo, self.commit)
+        return mods
 
-        # Update the database
-        helpers.update_db('CKAN', mods, self.db_file)
+    def download_ckan(self, url, validator=None):
+        """Downloads the CKAN repo, resuming an earlier download that failed or was cancelled.
 
-    def download_ckan(self, url):
-        """Downloads the CKAN repo."""
+        Returns None if "validator" is given and the CKAN repo is unchanged on the server (see "fetch.download").
+        """
 
         print('Downloading CKAN repo...')
 
-        # Initial value of 3% to indicate processing has started
-        progress_value = 3
-        self.notify_progress_signal.emit(progress_value)
-
-        r = requests.get(url, stream=True)
-        with open('data/master.tar.gz', 'wb') as f:
-            for chunk in r.iter_content(chunk_size=20000):
-                progress_value += 1
-                # Avoid emitting signal if the run was cancelled
-                if self.keep_running:
-                    self.notify_progress_signal.emit(progress_value)
-                f.write(chunk)
+        # Initial value of 3% to indicate processing has started, up to DOWNLOAD_PROGRESS % when downloaded
+        self.progress(3)
+        last_value = 3
+
+        # Only report progress when the percentage changes
+        def progress(fraction):
+            nonlocal last_value
+            value = int(3 + fraction * (DOWNLOAD_PROGRESS - 3))
+            if value != last_value:
+                last_value = value
+                self.progress(value)
+
+        size = fetch.download(url, 'data/master.tar.gz', progress, self.check, validator)
+        if size is None:
+            print('CKAN repo unchanged')
+        else:
             print('CKAN repo downloaded')
-            print()
+        print()
+        return size
 
-def process_ckan(file_name):
-    """Processes the CKAN repo file and returns a dict of raw mods data."""
+def read_ckan_files(file_name):
+    """Yields (file name, data) for each CKAN data file in the CKAN repo file.
 
-    raw_mods = defaultdict(dict)
+    The file name is the path in the CKAN-meta repo, without the first directory of the tarball, e.g.
+    "Revamp/Revamp-2.0.0.ckan" for "CKAN-meta-master/Revamp/Revamp-2.0.0.ckan".
+    """
 
-    # Open the GZ compressed tar file for reading
-    with tarfile.open(file_name, 'r:gz') as tar:
+    # Open the GZ compressed tar file for reading as a stream, the files are read in order
+    with tarfile.open(file_name, 'r|gz') as tar:
         for tarinfo in tar:
             # Check if it's a regular file
             if tarinfo.isfile():
                 # Only process CKAN data files
-                if tarinfo.name.endswith('.ckan') or tarinfo.name.endswith('.kerbalstuff'):
-                    try:
-                        jsondata = json.loads(str(tar.extractfile(tarinfo).read(), 'utf-8'))
-
-                        if 'identifier' in jsondata:
-                            identifier = jsondata['identifier']
-                        else:
-                            print('Identifier missing for file', tarinfo.name)
-                            continue
-                        if 'version' in jsondata:
-                            mod_version = jsondata['version']
-                        else:
-                            print('Mod version missing for file', tarinfo.name)
-                            continue
-                        if 'name' in jsondata:
-                            mod_name = helpers.clean_item(jsondata['name'])
-                        else:
-                            print('Mod name missing for file', tarinfo.name)
-                            continue
-
-                        # Get supported KSP version
-                        if 'ksp_version' in jsondata:
-                            ksp_version = jsondata['ksp_version']
-                        elif 'ksp_version_max' in jsondata:
-                            ksp_version = jsondata['ksp_version_max']
-                        elif 'ksp_version_min' in jsondata and not 'ksp_version_max' in jsondata:
-                            ksp_version = jsondata['ksp_version_min'] + '+'
-                        else:
-                            ksp_version = 'any'
-
-                        # Get link to KSP forum and/or source code repositories (e.g. GitHub) if available
-                        forum = ''
-                        source = ''
-                        kerbalstuff = ''
-                        spacedock = ''
-                        if 'resources' in jsondata:
-                            if 'homepage' in jsondata['resources']:
-                                forum = jsondata['resources']['homepage']
-                            if 'repository' in jsondata['resources']:
-                                source = jsondata['resources']['repository']
-                            if 'kerbalstuff' in jsondata['resources']:
-                                kerbalstuff = jsondata['resources']['kerbalstuff']
-                            if 'spacedock' in jsondata['resources']:
-                                spacedock = jsondata['resources']['spacedock']
-
-                        # Each mod, identified by 'identifier' may have one or more mod versions
-                        # Data for each mod version is stored in the nested dict 'raw_mods'
-                        raw_mods[identifier][mod_version] = [ksp_version, mod_name, source, forum, kerbalstuff, spacedock]
-
-                    except ValueError as e:
-                        print('Error reading JSON data', e, 'file', tarinfo.name)
+                if ckan_git.is_ckan_file(tarinfo.name):
+                    yield tarinfo.name.split('/', 1)[-1], tar.extractfile(tarinfo).read()
                 else:
                     pass
                     #print('Not a .ckan or .kerbalstuff file', tarinfo.name)
-    return raw_mods
 
-def filter_raw_mods(raw_mods):
-    """For each mod, filter out the mod versions that have the highest KSP version for that mod, simplifying 
-    sorting of mod versions later on.
-    
-    E.g. 
-        Mod version "0.5pre" with KSP version 0.90
-        Mod version "1.0" with KSP version 1.1.3
-        Mod version "1.1" with KSP version 1.2.2
-        Mod version "1.2" with KSP version 1.2.2
-        
-        -> Filtered mod versions: 1.1 and 1.2
-    
-    Data structure for "raw_mods":
-    raw_mods[identifier][mod_version] = [ksp_version, mod_name, source, forum]
+            # Don't keep the list of all files read, which grows with the number of files in the repo
+            tar.members = []
+
+def parse_ckan(item):
+    """Parses a CKAN data file and returns (file name, identifier, mod_version, data), or None if data is missing.
+
+    Data for each mod version is a "records.CKANVersion".
+    """
+
+    file_name, data = item
+
+    try:
+        jsondata = json.loads(str(data, 'utf-8'))
+    except ValueError as e:
+        print('Error reading JSON data', e, 'file', file_name)
+        return None
+
+    if 'identifier' in jsondata:
+        identifier = jsondata['identifier']
+    else:
+        print('Identifier missing for file', file_name)
+        return None
+    if 'version' in jsondata:
+        mod_version = jsondata['version']
+    else:
+        print('Mod version missing for file', file_name)
+        return None
+    if 'name' in jsondata:
+        mod_name = normalize.clean_item(jsondata['name'])
+    else:
+        print('Mod name missing for file', file_name)
+        return None
+
+    # Get supported KSP version
+    if 'ksp_version' in jsondata:
+        ksp_version = jsondata['ksp_version']
+    elif 'ksp_version_max' in jsondata:
+        ksp_version = jsondata['ksp_version_max']
+    elif 'ksp_version_min' in jsondata and not 'ksp_version_max' in jsondata:
+        ksp_version = jsondata['ksp_version_min'] + '+'
+    else:
+        ksp_version = 'any'
+
+    # Get link to KSP forum and/or source code repositories (e.g. GitHub) if available
+    forum = ''
+    source = ''
+    kerbalstuff = ''
+    spacedock = ''
+    if 'resources' in jsondata:
+        if 'homepage' in jsondata['resources']:
+            forum = jsondata['resources']['homepage']
+        if 'repository' in jsondata['resources']:
+            source = jsondata['resources']['repository']
+        if 'kerbalstuff' in jsondata['resources']:
+            kerbalstuff = jsondata['resources']['kerbalstuff']
+        if 'spacedock' in jsondata['resources']:
+            spacedock = jsondata['resources']['spacedock']
+
+    return file_name, identifier, mod_version, records.CKANVersion(ksp_version, mod_name, source, forum, kerbalstuff,
+                                                                   spacedock)
+
+def clear_staging(db_file):
+    """Removes all mod versions from the staging table.
+
+    The staging table then no longer matches a commit of the git clone, so the next run from the git clone
+    reads all files.
     """
 
-    raw_mods_filtered = defaultdict(dict)
-    all_ksp_versions = []
-    all_mod_versions = []
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con:
+            con.execute('DELETE FROM CKANStaging')
+            con.execute('DELETE FROM CKANGitSync')
+
+def remove_staged(db_file, paths):
+    """Removes the mod versions read from the files in "paths" from the staging table."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con:
+            con.executemany('DELETE FROM CKANStaging WHERE Path = ?', ((path,) for path in paths))
+
+def stage_versions(db_file, items):
+    """Inserts a list of (file name, identifier, mod_version, data) into the staging table.
 
-    for id in sorted(raw_mods.keys()):
-        ksp_versions = []
+    Each mod, identified by 'identifier', may have one or more mod versions, a mod version found twice keeps
+    the data found last.
+    """
 
-        # Iterate over all mod versions and store the corresponding KSP version
-        for mod_version in raw_mods[id].keys():
-            ksp_versions.append(raw_mods[id][mod_version][0])
-            all_mod_versions.append(mod_version)
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con:
+            con.executemany('INSERT OR REPLACE INTO CKANStaging (Path, Identifier, Mod_version, KSP_version, Name, '
+                            'Source, Forum, Kerbalstuff, Spacedock) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            ((path, identifier, mod_version) + tuple(data)
+                             for path, identifier, mod_version, data in items))
 
-        # Highest KSP version is the last element in the sorted list
-        highest_ksp_version = sorted(ksp_versions)[-1]
+def select_mods(db_file):
+    """Selects the highest version of each mod in the staging table and returns a dict of mods.
 
-        # Iterate over all mod versions again and store the mod versions that have the highest KSP version
-        for mod_version in raw_mods[id].keys():
-            if raw_mods[id][mod_version][0] == highest_ksp_version:
-                all_ksp_versions.append((raw_mods[id][mod_version][0]))
-                raw_mods_filtered[id][mod_version] = raw_mods[id][mod_version]
+    The mod versions are read in order of the identifier, so only the versions of one mod are held in memory.
+    """
 
-    return raw_mods_filtered
+    selected = []
+    with contextlib.closing(database.connect(db_file)) as con:
+        cur = con.execute('SELECT Identifier, Mod_version, KSP_version, Name, Source, Forum, Kerbalstuff, Spacedock '
+                          'FROM CKANStaging ORDER BY Identifier')
+        for identifier, rows in itertools.groupby(cur, key=lambda row: row[0]):
+            versions = {row[1]: records.CKANVersion(*row[2:]) for row in rows}
+            selected.append((identifier, select_version(versions)))
 
+    # Iterate over each mod id, mods with the same name keep the data of the last mod id
+    mods = {}
+    for id, data in sorted(selected, key=lambda item: item[0].lower()):
+        mods[data.name] = records.CKANMod(data.ksp_version, data.source, data.forum, data.kerbalstuff,
+                                          data.spacedock)
 
+    return mods
 
+def select_version(versions):
+    """Returns the data of the highest version of a mod, "versions" is a dict {mod_version: records.CKANVersion}.
 
+    Only the mod versions that have the highest KSP version for that mod are compared, e.g.
+        Mod version "0.5pre" with KSP version 0.90
+        Mod version "1.0" with KSP version 1.1.3
+        Mod version "1.1" with KSP version 1.2.2
+        Mod version "1.2" with KSP version 1.2.2
 
+        -> Compared mod versions: 1.1 and 1.2, highest mod version 1.2
+    """
 
+    highest_ksp_version = max(data.ksp_version for data in versions.values())
 
+    mod_versions = sorted(mod_version for mod_version, data in versions.items()
+                          if data.ksp_version == highest_ksp_version)
+    return versions[helpers.get_highest_version(mod_versions)]
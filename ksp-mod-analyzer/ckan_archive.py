@@ -0,0 +1,113 @@
+"""
+    ckan_archive.py
+    -----------
+    Implements a random-access store of the CKAN data files, so a single file or all versions of one mod can be
+    read without decompressing the whole CKAN-meta tarball.
+
+    The files are stored while the tarball (or a git clone of CKAN-meta) is read during a CKAN refresh (see
+    "index_files"), each file compressed separately in an SQLite table keyed by its path in the CKAN-meta repo,
+    e.g. "Revamp/Revamp-2.0.0.ckan".
+
+    Usage (e.g. all versions of one mod, or rebuild the store from 'data/master.tar.gz'):
+        python3 ksp-mod-analyzer/ckan_archive.py <identifier>
+        python3 ksp-mod-analyzer/ckan_archive.py --build
+"""
+
+import contextlib
+import sys
+import zlib
+
+import database
+
+# Database file with the CKAN data files, kept apart from the main database as it's much larger
+ARCHIVE_FILE = 'data/ckan-meta.db'
+
+# Number of files inserted at a time
+BATCH_SIZE = 1000
+
+
+def connect(archive_file):
+    """Connects to the archive, creates the 'Files' table if it doesn't exist.
+
+    Like the main database (see database.py) the archive uses write-ahead logging, so reading a mod doesn't wait
+    for a CKAN refresh storing the files.
+    """
+
+    con = database.connect(archive_file)
+    database.enable_wal(con)
+    con.execute('CREATE TABLE IF NOT EXISTS Files (Path TEXT PRIMARY KEY, Identifier TEXT, Data BLOB)')
+    con.execute('CREATE INDEX IF NOT EXISTS Files_Identifier ON Files (Identifier)')
+    return con
+
+def identifier(path):
+    """Returns the mod identifier for a path, i.e. the directory name (files in the root have no identifier)."""
+
+    parts = path.split('/')
+    return parts[-2] if len(parts) > 1 else None
+
+def index_files(items, archive_file=ARCHIVE_FILE, deleted=None):
+    """Stores each (path, data) of "items" in the archive while yielding it unchanged.
+
+    The previous content of the archive is replaced when all items have been read, or if "deleted" is a list of
+    paths, only those files are removed and the other files are kept. If the items are not read to the end (e.g.
+    the refresh was cancelled), the archive is left unchanged.
+    """
+
+    with contextlib.closing(connect(archive_file)) as con:
+        if deleted is None:
+            con.execute('DELETE FROM Files')
+        else:
+            con.executemany('DELETE FROM Files WHERE Path = ?', ((path,) for path in deleted))
+
+        batch = []
+        for path, data in items:
+            batch.append((path, identifier(path), zlib.compress(data)))
+            if len(batch) >= BATCH_SIZE:
+                con.executemany('INSERT OR REPLACE INTO Files (Path, Identifier, Data) VALUES (?, ?, ?)', batch)
+                batch = []
+            yield path, data
+
+        con.executemany('INSERT OR REPLACE INTO Files (Path, Identifier, Data) VALUES (?, ?, ?)', batch)
+        con.commit()
+
+def build(tarball, archive_file=ARCHIVE_FILE):
+    """Stores all CKAN data files of a CKAN-meta tarball in the archive, returns the number of files."""
+
+    # Imported here, as ckan.py also imports this module
+    import ckan
+
+    return sum(1 for _ in index_files(ckan.read_ckan_files(tarball), archive_file))
+
+def read_file(path, archive_file=ARCHIVE_FILE):
+    """Returns the data of one file, e.g. "Revamp/Revamp-2.0.0.ckan", or None if not found."""
+
+    with contextlib.closing(connect(archive_file)) as con:
+        row = con.execute('SELECT Data FROM Files WHERE Path = ?', (path,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+def read_mod(mod_identifier, archive_file=ARCHIVE_FILE):
+    """Returns a list of (path, data) with the files of all versions of a mod."""
+
+    return list(read_mods([mod_identifier], archive_file))
+
+def read_mods(identifiers, archive_file=ARCHIVE_FILE):
+    """Yields (path, data) for the files of all versions of the mods in "identifiers", e.g. for re-parsing only
+    some mods with "ckan.parse_ckan".
+    """
+
+    with contextlib.closing(connect(archive_file)) as con:
+        for mod_identifier in identifiers:
+            cur = con.execute('SELECT Path, Data FROM Files WHERE Identifier = ? ORDER BY Path', (mod_identifier,))
+            for path, data in cur:
+                yield path, zlib.decompress(data)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit('Usage: ckan_archive.py <identifier> | --build')
+
+    if sys.argv[1] == '--build':
+        print(build('data/master.tar.gz'), 'files stored in', ARCHIVE_FILE)
+    else:
+        import ckan
+        for path, data in read_mods([sys.argv[1]]):
+            print(path, ckan.parse_ckan((path, data)))
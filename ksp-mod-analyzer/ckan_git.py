@@ -0,0 +1,151 @@
+"""
+    ckan_git.py
+    -----------
+    Implements reading the CKAN data files from a local git clone of the CKAN-meta repository, as an alternative
+    to downloading the whole CKAN-meta tarball for each refresh.
+
+    The commit processed last is stored in the database. On the next refresh only the files changed between that
+    commit and HEAD are read, the data of deleted and changed files is removed from the staging table first.
+    The first refresh (or when the last commit is no longer in the clone) reads all files.
+
+    The clone is not updated here, e.g. run "git pull" in the clone before refreshing.
+
+    Usage (e.g. a clone in ~/CKAN-meta):
+        git clone https://github.com/KSP-CKAN/CKAN-meta.git ~/CKAN-meta
+        KSP_CKAN_GIT=~/CKAN-meta python3 ksp-mod-analyzer/main.py
+"""
+
+import contextlib
+import subprocess
+import threading
+
+import database
+
+
+def run_git(repo, *args):
+    """Runs a git command in the repository, returns the output (bytes)."""
+
+    return subprocess.run(['git', '-C', repo] + list(args), check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE).stdout
+
+def is_ckan_file(path):
+    """Checks if a path is a CKAN data file."""
+
+    return path.endswith('.ckan') or path.endswith('.kerbalstuff')
+
+def head(repo):
+    """Returns the commit id of HEAD."""
+
+    return run_git(repo, 'rev-parse', 'HEAD').decode('utf-8').strip()
+
+def list_files(repo, commit):
+    """Returns a list of (path, blob id) for all CKAN data files in a commit."""
+
+    # Output is "<mode> blob <id>\t<path>\0" for each file
+    entries = run_git(repo, 'ls-tree', '-r', '-z', commit).decode('utf-8').split('\0')
+    files = [(entry.split('\t', 1)[1], entry.split()[2]) for entry in entries if entry]
+    return [(path, blob) for path, blob in files if is_ckan_file(path)]
+
+def changed_files(repo, old, new):
+    """Returns (changed, deleted) for the CKAN data files between two commits, or None if the old commit is not in
+    the repository (e.g. after a history rewrite).
+
+    "changed" is a list of (path, blob id) for added and changed files, "deleted" a list of paths.
+    """
+
+    try:
+        output = run_git(repo, 'diff', '--raw', '-z', '--no-abbrev', '--no-renames', old, new)
+    except subprocess.CalledProcessError:
+        return None
+
+    # Output is ":<old mode> <new mode> <old id> <new id> <status>\0<path>\0" for each file, a rename is
+    # reported as a deleted and an added file
+    fields = output.decode('utf-8').split('\0')
+    changed = []
+    deleted = []
+    for info, path in zip(fields[0::2], fields[1::2]):
+        if is_ckan_file(path):
+            blob, status = info.split()[3:5]
+            if status == 'D':
+                deleted.append(path)
+            else:
+                changed.append((path, blob))
+    return changed, deleted
+
+def read_files(repo, files):
+    """Yields (path, data) for a list of (path, blob id), read with a single "git cat-file" process.
+
+    The files are requested by blob id, as looking up each path in the commit is much slower.
+    """
+
+    with subprocess.Popen(['git', '-C', repo, 'cat-file', '--batch'], stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE) as process:
+        # Write all requests from a separate thread, so the responses are read without waiting for each file
+        writer = threading.Thread(target=write_requests, args=(process.stdin, files), daemon=True)
+        writer.start()
+
+        try:
+            for path, blob in files:
+                # Header is "<id> blob <size>", or "<name> missing"
+                header = process.stdout.readline().split()
+                if header[-1] == b'missing':
+                    print('File missing in CKAN-meta', path)
+                    continue
+
+                data = process.stdout.read(int(header[2]))
+                process.stdout.read(1)
+                yield path, data
+        finally:
+            # Stop git if not all files were read, e.g. when the refresh was cancelled
+            if process.poll() is None:
+                process.kill()
+            writer.join()
+
+def write_requests(stdin, files):
+    """Writes a "git cat-file --batch" request for each (path, blob id)."""
+
+    try:
+        for path, blob in files:
+            stdin.write(blob.encode('ascii') + b'\n')
+        stdin.close()
+    except (BrokenPipeError, ValueError):
+        # The process was stopped before all requests were written
+        pass
+
+def get_synced(db_file, repo):
+    """Returns the commit processed last for the repository, or None.
+
+    For the CKAN-meta tarball (see ckan.py) "repo" is its URL and the "commit" is the 'ETag' of the tarball.
+    """
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        row = con.execute('SELECT Head FROM CKANGitSync WHERE Repo = ?', (repo,)).fetchone()
+        return row[0] if row else None
+
+def set_synced(db_file, repo, commit):
+    """Stores the commit processed last for the repository, only one repository is synced at a time."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con:
+            con.execute('DELETE FROM CKANGitSync')
+            con.execute('INSERT INTO CKANGitSync (Repo, Head) VALUES (?, ?)', (repo, commit))
+
+def plan(repo, db_file):
+    """Finds the files to read for syncing the repository, returns (commit, changed, deleted).
+
+    "changed" is a list of (path, blob id) of the files to read, "deleted" is a list of paths, or None if all files
+    have to be read, i.e. the staging table has to be cleared.
+    """
+
+    commit = head(repo)
+
+    synced = get_synced(db_file, repo)
+    files = changed_files(repo, synced, commit) if synced else None
+    if files is None:
+        print('Reading all files in CKAN-meta at', commit)
+        return commit, list_files(repo, commit), None
+
+    changed, deleted = files
+    print('CKAN-meta {} -> {}: {} changed, {} deleted files'.format(synced[:8], commit[:8], len(changed),
+                                                                   len(deleted)))
+    return commit, changed, deleted
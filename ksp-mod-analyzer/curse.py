@@ -4,183 +4,330 @@
     Implements functions for parsing the Curse website.
 """
 
+import hashlib
+import json
+import os
 import re
-import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import cancel
+import fetch
 import helpers
-import requests
-from PyQt5 import QtCore
-from bs4 import BeautifulSoup
+import metrics
+import normalize
+import pipeline
+import records
+from bs4 import BeautifulSoup, SoupStrainer
 
+# Use lxml for parsing if installed (optional), it's much faster than BeautifulSoup with 'html.parser'
+try:
+    import lxml.etree
+    import lxml.html
+    BACKEND = 'lxml'
+    PARSER = 'lxml'
+except ImportError:
+    BACKEND = 'bs4'
+    PARSER = 'html.parser'
 
-class CurseThread(QtCore.QThread):
-    """QThread for processing."""
+# First page of the Curse mod listing, can be changed with an environment variable, e.g. for a local mock server
+CURSE_URL = os.environ.get('KSP_CURSE_URL', 'https://mods.curse.com/ksp-mods/kerbal')
 
-    # Signal for handling exceptions that may occur in the running thread
-    exception_signal = QtCore.pyqtSignal(str)
+# Number of pages downloaded concurrently (limited by the max connections per host in the HTTP core)
+FETCH_WORKERS = fetch.MAX_CONNECTIONS_PER_HOST
 
-    # Finished signal, emitted at the end of the run
-    finished_signal = QtCore.pyqtSignal(str)
+# Number of threads parsing downloaded pages, separate from the downloading threads
+PARSE_WORKERS = 2
 
-    # Cancelled signal, emitted when the thread is stopped
-    cancelled_signal = QtCore.pyqtSignal(str)
+# Number of consecutive unchanged pages (compared to the previous run) after which the rest of the pages are
+# assumed to be unchanged as well, and taken from the previous run instead of being downloaded
+STABLE_PAGES = 2
 
-    # Signal for updating the progress bar
-    notify_progress_signal = QtCore.pyqtSignal(int)
+# Max age (seconds) of the pages taken from a previous run, when the oldest page is older all pages are downloaded.
+# Twice the default refresh interval of Curse (see orchestrator.py), so at least every other refresh downloads all
+# pages and changes after the first pages are found within a day
+REFRESH_AFTER = 24 * 3600
+
+# Only build the parts of the HTML tree that are used: the mod listing, and the pagination links on the first page
+MODS_ONLY = SoupStrainer('ul', class_='group')
+MODS_AND_PAGINATION = SoupStrainer(['ul', 'a'])
+
+# Max number of pages to look for when the number of pages can't be found in the pagination links
+MAX_PAGES = 1000
+
+# Regexps used when parsing the pages
+RE_PAGE_LINK = re.compile(r'/ksp-mods/kerbal\?(?:.*&)?page=(\d+)')
+RE_SUPPORTS = re.compile(r'Supports')
+RE_PRERELEASE = re.compile(r'prerelease')
+
+# XPath for finding the mod listing when using the lxml backend, i.e. all <ul class="group">
+XPATH_GROUPS = '//ul[contains(concat(" ", normalize-space(@class), " "), " group ")]'
+
+class CursePipeline(pipeline.Pipeline):
+    """Pipeline for getting all mods from Curse: fetch -> parse -> store.
+
+    Pages are downloaded and parsed concurrently, but merged into the dict of mods in page order.
+
+    A fingerprint of each page is stored in the database. When a number of consecutive pages are unchanged since
+    the previous run, the remaining pages are taken from the database instead of being downloaded, unless they were
+    downloaded more than REFRESH_AFTER seconds ago.
+    """
+
+    name = 'Curse'
+
+    # Store pages in page order, a mod name appearing on several pages keeps the data from the last page
+    ordered = True
 
     def __init__(self, db_file, use_cache):
         super().__init__()
         self.db_file = db_file
         self.use_cache = use_cache
-        self.keep_running = False
-        self.session = requests.session()  # Keep the session, improves performance
 
-    def __del__(self):
-        self.wait()
+        self.stages = [pipeline.Stage('fetch', self.fetch_page, workers=FETCH_WORKERS),
+                       pipeline.Stage('parse', parse_page, workers=PARSE_WORKERS)]
 
-    def stop(self):
-        """Stops the running thread gracefully."""
+        # Dict to hold all mod data
+        self.mods = {}
 
-        print('Stopping Curse thread...')
-        self.keep_running = False
+        # Fingerprint and mods for each page, from the previous run and from this run
+        self.previous_pages = {}
+        self.pages = {}
 
-        # Wait for the thread to stop
-        self.wait()
-        self.cancelled_signal.emit('curse')
-        print('Curse thread stopped')
+        # Time each page was downloaded, pages taken from the previous run keep the time of their download
+        self.previous_fetched = {}
+        self.fetched = {}
+        self.reused = set()
+        self.start_time = time.time()
 
-    def run(self):
-        """Main thread processing loop."""
+        # Number of consecutive unchanged pages, and the first page to take from the previous run (when known).
+        # Pages are only taken from the previous run if they are recent enough
+        self.unchanged = 0
+        self.stable_from = None
+        self.reuse = False
 
-        self.keep_running = True
+    def source(self):
+        """Yields (page, data) for all pages.
 
-        try:
-            print('Starting Curse thread...')
-            # Get data from Curse and update database
-            self.update_curse()
+        "data" is None for pages to download, or a dict of mods for pages already parsed or taken from the
+        previous run.
+        """
 
-            # Update database table 'Total'
-            helpers.update_total_mods(self.db_file)
+        # Check if cached data on disk should be used, the mods are then read in "finish"
+        if self.use_cache:
+            return
+
+        # Set initial value (3%) for progress bar to indicate processing has started
+        self.progress(3)
+        self.start_time = time.time()
+
+        # Get the first Curse page and prepare for HTML parsing (BeautifulSoup object)
+        soup_first_page = make_soup(self.get_page(CURSE_URL), parse_only=MODS_AND_PAGINATION)
+
+        mods_first_page = get_curse_mods(soup_first_page)
+        if not mods_first_page:
+            raise Exception('Error parsing Curse, no mods found.')
+
+        # Find how many sub-pages there are, if not found in the pagination links, download pages until an empty
+        # page is found (the downloaded pages are kept, so they don't have to be downloaded again)
+        probed_pages = {}
+        pages = find_max_page(soup_first_page)
+        if not pages:
+            print('No pagination found on Curse, probing for the number of pages...')
+            pages, probed_pages = probe_page_count(self.probe_mods)
+
+        print('Total sub-pages on Curse', pages)
+        self.total = pages
+
+        # Pages from the previous run can only be reused if the number of pages is the same
+        self.previous_pages, self.previous_fetched = helpers.get_curse_pages(self.db_file)
+        if len(self.previous_pages) != self.total:
+            self.previous_pages = {}
+
+        # Download all pages if the pages from the previous run are too old, they are still compared to find changes
+        self.reuse = bool(self.previous_pages) and \
+            self.start_time - min(self.previous_fetched.values()) < REFRESH_AFTER
+        if self.previous_pages and not self.reuse:
+            print('Curse pages from the previous run are too old, downloading all pages')
+
+        # Check the first pages one by one, if they are unchanged the remaining pages are not downloaded
+        first_pages = [(1, mods_first_page)]
+        while (len(first_pages) < min(STABLE_PAGES, self.total)
+               and self.is_unchanged(*first_pages[-1])):
+            self.check()
+            page = len(first_pages) + 1
+            first_pages.append((page, probed_pages.get(page) or self.get_mods(page)))
+
+        if self.reuse and len(first_pages) == STABLE_PAGES and self.is_unchanged(*first_pages[-1]):
+            self.stable_from = STABLE_PAGES + 1
+
+        yield from first_pages
+
+        # Download the remaining pages, until enough consecutive unchanged pages have been found
+        for page in range(len(first_pages) + 1, self.total + 1):
+            if self.stable_from and page >= self.stable_from:
+                self.reused.add(page)
+                yield page, self.previous_pages[page][1]
+            else:
+                yield page, probed_pages.get(page)
 
-            # Only emit finished signal if job was not cancelled (i.e. 'keep_running' is still True)
-            if self.keep_running:
-                self.finished_signal.emit('curse')
+    def fetch_page(self, item):
+        """Gets a page from Curse, unless already fetched."""
 
-        # Exception handling:
-        # Emits a signal if an exception occurs in the running thread
-        # The main application will then show an error message about the problem
-        # This is needed because a new message box widget cannot be created/displayed in the thread
-        except Exception as e:
-            # Stop the thread
-            self.stop()
-            print('Curse thread stopped at exception')
+        page, data = item
+        if data is None:
+            data = self.get_page(get_url(page))
+        return page, data
 
-            # Get info about the exception
-            (type, value, traceback) = sys.exc_info()
+    def is_unchanged(self, page, mods):
+        """Checks if the mods on a page are the same as in the previous run."""
 
-            # Generate a detailed error message
-            msg = helpers.exception_message_qthread(type, value, traceback)
+        previous = self.previous_pages.get(page)
+        return previous is not None and previous[0] == fingerprint(mods)
 
-            # Emit a signal with the error message to be displayed in a message box in the main UI
-            self.exception_signal.emit(msg)
+    def store(self, item):
+        """Updates the dict with the mods from one page."""
 
-    def update_curse(self):
-        """Updates the database with data from Curse."""
+        page, mods = item
+        self.mods.update(mods)
+        self.pages[page] = (fingerprint(mods), mods)
+        self.fetched[page] = self.previous_fetched[page] if page in self.reused else self.start_time
+
+        # Count consecutive unchanged pages, when enough are found the remaining pages are not downloaded
+        if self.is_unchanged(page, mods):
+            self.unchanged += 1
+            if self.reuse and self.unchanged >= STABLE_PAGES and not self.stable_from:
+                print('Curse pages unchanged from page', page - self.unchanged + 1)
+                self.stable_from = page + 1
+        else:
+            self.unchanged = 0
+
+    def finish(self):
+        """Writes the mod data to disk and updates the database."""
 
-        # Check if cached data on disk should be used
         if self.use_cache:
             # Read mod list from disk
-            mods = helpers.read_from_disk('data/curse.data')
-
-            # Update database
-            helpers.update_db('Curse', mods, self.db_file)
+            self.mods = helpers.read_from_disk('data/curse.data')
         else:
-            # Empty dict to hold all mod data
-            mods = {}
+            # Store the fingerprints and download times for the next run, also if unchanged for the download times
+            helpers.update_curse_pages(self.pages, self.fetched, self.db_file)
 
-            # Set initial value (3%) for progress bar to indicate processing has started
-            self.notify_progress_signal.emit(3)
+            self.changed = self.pages != self.previous_pages
+            if not self.changed:
+                print('No changes on Curse since the previous run')
+                helpers.update_refresh_time('Curse', self.db_file)
+                return self.mods
 
-            # Define the initial URL for getting the mods from the first page
-            curse_init_url = 'https://mods.curse.com/ksp-mods/kerbal'
+            # Write data to file
+            helpers.write_to_disk('data/curse.data', self.mods)
 
-            # Get the first Curse page and prepare for HTML parsing (BeautifulSoup object)
-            soup_first_page = self.get_page(curse_init_url)
+        # Update database
+        self.changed = helpers.update_db('Curse', self.mods, self.db_file)
+        return self.mods
 
-            # Get the mods from the first page and update the dict
-            mods_first_page = get_curse_mods(soup_first_page)
-            mods.update(mods_first_page)
+    def get_mods(self, page):
+        """Downloads and parses a page, returns a dict of mods."""
 
-            # Find how many sub-pages there are
-            pages = find_max_page(soup_first_page)
+        self.check()
+        return parse_mods(self.get_page(get_url(page)))
 
-            # Calculate the progress bar interval based on number of pages
-            progress_bar_interval = 100 / int(pages)
+    def probe_mods(self, page):
+        """Same as "get_mods", for the threads probing the number of pages, which are not pipeline threads.
 
-            # Verify parsing of number of pages on Curse
-            if pages:
-                print('Total sub-pages on Curse', pages)
-            else:
-                raise Exception('Error parsing Curse, no pages found.')
+        The metrics and cancel token of the pipeline are made active, so the requests are measured and aborted
+        when the refresh is cancelled.
+        """
+
+        with metrics.activate(self.metrics), cancel.activate(self.cancel_token):
+            return self.get_mods(page)
 
-            # Define the URL for the next page (starting from page 2) and get the remaining mods
-            for page in range(2, int(pages) + 1):
-                if self.keep_running:
-                    # Create a new URL to fetch data from the next page
-                    # E.g. "https://mods.curse.com/ksp-mods/kerbal?page=2"
-                    new_curse_url = curse_init_url + "?page=" + str(page)
+    def get_page(self, url):
+        """Gets a web page using the shared HTTP session and returns the HTML code."""
 
-                    # Get data from the page
-                    new_soup = self.get_page(new_curse_url)
+        response = fetch.get(url)
+        return response.content
 
-                    # Another check is needed in case the thread was stopped while the HTTP request was running
-                    if self.keep_running:
-                        # Update progress bar
-                        self.notify_progress_signal.emit(progress_bar_interval * page)
 
-                    # Get the mods from the current page
-                    mods_new_page = get_curse_mods(new_soup)
+def get_url(page):
+    """Returns the URL for a page, e.g. "https://mods.curse.com/ksp-mods/kerbal?page=2"."""
 
-                    # Update dict with mods from the current page
-                    mods.update(mods_new_page)
+    return CURSE_URL + "?page=" + str(page)
 
-            # Write data to file
-            helpers.write_to_disk('data/curse.data', mods)
+def fingerprint(mods):
+    """Returns a fingerprint of the mods on a page."""
 
-            # Update database
-            helpers.update_db('Curse', mods, self.db_file)
+    return hashlib.sha1(json.dumps([(mod_name, mod.to_list()) for mod_name, mod in mods.items()])
+                        .encode('utf-8')).hexdigest()
 
-    def get_page(self, url):
-        """Gets a web page using the session object and return a soup object."""
+def make_soup(html, parse_only=MODS_ONLY, parser=None):
+    """Creates a BeautifulSoup object from the HTML page.
 
-        try:
-            response = self.session.get(url)
-        except:
-            # Raise any exception to be handled by the QThread
-            raise
+    By default only the mod listing is parsed, using the fastest parser available.
+    """
 
-        # Create a BeautifulSoup object from the HTML page
-        soup = BeautifulSoup(response.content, 'html.parser')
-        return soup
+    return BeautifulSoup(html, parser or PARSER, parse_only=parse_only)
 
+def parse_page(item):
+    """Parses a page and returns a dict of mods."""
 
-def find_max_page(soup):
-    """Finds the number of sub-pages in the HTML code, it's a two digit number... E.g. "1 2 3 4 5 ... 37"""
+    page, data = item
+    if isinstance(data, dict):
+        return page, data
+    return page, parse_mods(data)
+
+def parse_mods(html, backend=None):
+    """Parses the HTML page and returns a dict of mods, using the fastest parser backend available by default.
 
-    # Using a regexp, find HREF's with two digits, e.g. <a href="/ksp-mods/kerbal?page=37" class="b-pagination-item">
-    tags = soup.find_all('a', href=re.compile('^/ksp-mods/kerbal\?page\=[0-9][0-9]'))
+    All backends return the same result as "get_curse_mods", also for an empty page (e.g. after the last page).
+    """
 
-    # Regexp to search for a two digit number (e.g. "37")
-    p = re.compile('[0-9][0-9]')
+    if (backend or BACKEND) == 'lxml':
+        # lxml raises an error for a document without any elements, BeautifulSoup returns an empty tree
+        try:
+            tree = lxml.html.fromstring(html)
+        except lxml.etree.ParserError:
+            return {}
+        return get_curse_mods_lxml(tree)
+    return get_curse_mods(make_soup(html))
+
+def find_max_page(soup):
+    """Finds the number of sub-pages from the pagination links in the HTML code. E.g. "1 2 3 4 5 ... 37"
+
+    Returns 0 if no pagination links are found.
+    """
 
-    # If a match on a two digit number is found, return the number, else 'False' will be returned
-    pages = False
-    for item in tags:
-        match = p.search(str(item))
-        if match:
-            pages = match.group()
+    # Find all links to a sub-page, e.g. <a href="/ksp-mods/kerbal?page=37" class="b-pagination-item">
+    # and return the highest page number
+    pages = 0
+    for tag in soup.find_all('a', href=RE_PAGE_LINK):
+        match = RE_PAGE_LINK.search(tag['href'])
+        pages = max(pages, int(match.group(1)))
     return pages
 
+def probe_page_count(get_mods, workers=FETCH_WORKERS):
+    """Finds the number of pages by getting pages concurrently, starting from page 2, until an empty page is found.
+
+    "get_mods(page)" returns the dict of mods on a page. A page with the same mods as the page before is also
+    treated as the end, as some sites return the last page for all page numbers after it.
+
+    Returns (pages, {page: mods}) with the mods for all pages found, to avoid getting them again.
+    """
+
+    found = {}
+    previous = None
+    first_page = 2
+
+    with ThreadPoolExecutor(workers) as executor:
+        while first_page <= MAX_PAGES:
+            batch = range(first_page, min(first_page + workers, MAX_PAGES + 1))
+            for page, mods in zip(batch, executor.map(get_mods, batch)):
+                if not mods or mods == previous:
+                    return page - 1, found
+                found[page] = mods
+                previous = mods
+            first_page += workers
+
+    raise Exception('Error parsing Curse, more than ' + str(MAX_PAGES) + ' pages found.')
+
 def get_curse_mods(soup):
     """Parses the BeautifulSoup object and returns a dict of mods."""
 
@@ -196,21 +343,52 @@ def get_curse_mods(soup):
         for litag in ultag.find_all('li'):
             mod_tag = litag.find('h4')
             if mod_tag:
-                mod_name = helpers.clean_item(mod_tag.get_text())
+                mod_name = normalize.clean_item(mod_tag.get_text())
                 mod_url = 'https://mods.curse.com' + mod_tag.a.get('href')
 
-            ksp_version_tag = litag.find_all(text=re.compile(r'Supports'))
+            ksp_version_tag = litag.find_all(string=RE_SUPPORTS)
             if ksp_version_tag:
                 ksp_version = ksp_version_tag[0][10:]
 
         # Channge "prerelase" to "pre" to save space
-        ksp_version = re.sub(r'prerelease', 'pre', ksp_version)
+        ksp_version = RE_PRERELEASE.sub('pre', ksp_version)
 
         # Update values after all LI tags have been analyzed
 
         mod_link = '<a href="' + mod_url + '">' + ksp_version + '</a>'
-        mods[mod_name] = [ksp_version, mod_link]
+        mods[mod_name] = records.CurseMod(ksp_version, mod_link)
 
 
     return mods
 
+def get_curse_mods_lxml(tree):
+    """Parses the lxml tree and returns a dict of mods, same as "get_curse_mods" for a BeautifulSoup object."""
+
+    # Empty dict to hold the mod data
+    mods = {}
+    mod_name = ''
+    mod_url = ''
+    ksp_version = ''
+
+    # One UL tag per mod
+    for ultag in tree.xpath(XPATH_GROUPS):
+        # Eight LI tags with data for each mod
+        for litag in ultag.iter('li'):
+            mod_tag = litag.find('.//h4')
+            if mod_tag is not None:
+                mod_name = normalize.clean_item(mod_tag.text_content())
+                mod_url = 'https://mods.curse.com' + mod_tag.find('.//a').get('href')
+
+            # First text containing "Supports", e.g. "Supports: 1.2.2"
+            for text in litag.itertext():
+                if RE_SUPPORTS.search(text):
+                    ksp_version = text[10:]
+                    break
+
+        # Channge "prerelase" to "pre" to save space
+        ksp_version = RE_PRERELEASE.sub('pre', ksp_version)
+
+        mod_link = '<a href="' + mod_url + '">' + ksp_version + '</a>'
+        mods[mod_name] = records.CurseMod(ksp_version, mod_link)
+
+    return mods
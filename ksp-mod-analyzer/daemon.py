@@ -0,0 +1,259 @@
+"""
+    daemon.py
+    -----------
+    Implements a daemon mode, owning the database: the repositories are refreshed on a schedule (each repository
+    when it's due, see orchestrator.py), and the views of the merged mod data (see views.py) are served over a local
+    read-only HTTP JSON API, so one refresh serves many clients instead of each running the UI and fetching from
+    SpaceDock, Curse and GitHub.
+
+    API (GET only):
+        /views                  List of the views, with the URL of each view
+        /views/<view>           One page of a view, e.g. "/views/mods-only-on-curse?q=kerbal&sort=Mod&order=desc"
+                                Parameters: q (text in the mod name), sort (column), order (asc or desc),
+                                page (from 1) and page_size (max views.MAX_PAGE_SIZE)
+        /status                 Refresh statistics and schedule of each repository
+
+    View responses are cached until the data changes and have an 'ETag' header, which changes with the data.
+    A request with a matching 'If-None-Match' header gets '304 Not Modified' without a database query.
+
+    Usage (serves http://127.0.0.1:8090, the default refresh interval depends on the repository):
+        python3 ksp-mod-analyzer/daemon.py [--host HOST] [--port PORT] [--interval HOURS] [--no-refresh]
+"""
+
+import argparse
+import collections
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import headless
+import helpers
+import orchestrator
+import views
+
+# Default address of the API, only reachable from this computer
+HOST = '127.0.0.1'
+PORT = 8090
+
+# Default number of rows on a page
+PAGE_SIZE = 100
+
+# Max number of cached responses
+CACHE_SIZE = 256
+
+
+class ResponseCache:
+    """Cache of encoded responses, cleared when the data has changed.
+
+    The ETag of all responses is the generation of the cache, i.e. the time it was last cleared.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.etag = None
+        self.clear()
+
+    def clear(self):
+        """Removes all responses, called when the data has changed."""
+
+        with self.lock:
+            self.entries.clear()
+            self.etag = '"{:x}"'.format(time.time_ns())
+
+    def get(self, key):
+        """Returns a cached response, or None."""
+
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body, etag):
+        """Stores a response, unless the cache was cleared since "etag" was read (the data may be outdated)."""
+
+        with self.lock:
+            if etag != self.etag:
+                return
+            self.entries[key] = body
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class DaemonServer(ThreadingHTTPServer):
+    """HTTP server with the API, refreshing the database on a schedule in a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address=(HOST, PORT), db_file=headless.DB_FILE, intervals=None):
+        super().__init__(address, DaemonHandler)
+        self.db_file = db_file
+        self.cache = ResponseCache()
+
+        os.makedirs(headless.DATA_DIR, exist_ok=True)
+        helpers.init_database(db_file)
+
+        # Repositories being refreshed, and the error of the previous refresh of each repository, shown by "/status"
+        self.refreshing = set()
+        self.errors = {}
+
+        self.orchestrator = orchestrator.Orchestrator(db_file, intervals)
+        self.orchestrator.subscribe(self.refresh_event)
+        self.refresh_thread = None
+
+    def start_refresh(self):
+        """Starts refreshing the repositories in a background thread, each when it's due."""
+
+        self.refresh_thread = threading.Thread(target=self.orchestrator.run_schedule, daemon=True)
+        self.refresh_thread.start()
+
+    def refresh_event(self, kind, name, value):
+        """Keeps track of the refresh, clears the response cache when the 'Total' table has been updated."""
+
+        if kind == 'started':
+            self.refreshing.add(name)
+        elif kind in ('finished', 'cancelled', 'error'):
+            self.refreshing.discard(name)
+            self.errors[name] = '{}: {}'.format(type(value).__name__, value) if kind == 'error' else None
+        elif kind == 'total':
+            self.cache.clear()
+
+    def stop(self):
+        """Stops serving and refreshing, a refresh in progress is cancelled but not waited for."""
+
+        self.orchestrator.stop()
+        self.shutdown()
+        self.server_close()
+
+    def status(self):
+        """Returns the refresh statistics and schedule of each repository."""
+
+        stats = helpers.get_refresh_stats(self.db_file)
+
+        repositories = {}
+        for name, table in headless.TABLES.items():
+            mods, updated, duration, downloaded = stats.get(table, (None, None, None, None))
+            repositories[table] = {'mods': mods,
+                                   'updated': updated,
+                                   'duration': duration,
+                                   'bytes': downloaded,
+                                   'refreshing': name in self.refreshing,
+                                   'next_refresh': self.orchestrator.next_refresh(name),
+                                   'last_error': self.errors.get(name)}
+        return {'repositories': repositories}
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    """Request handler of the API."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path).rstrip('/')
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if path == '/views':
+            self.send_json(200, [{'name': view, 'url': '/views/' + views.slug(view)} for view in views.VIEWS])
+        elif path.startswith('/views/'):
+            self.send_view(path[len('/views/'):], params)
+        elif path == '/status':
+            self.send_json(200, self.server.status())
+        else:
+            self.send_json(404, {'error': 'Not found, see /views and /status'})
+
+    def send_view(self, name, params):
+        """Sends one page of a view, from the cache if possible."""
+
+        view = views.find_view(name)
+        if view is None:
+            return self.send_json(404, {'error': 'Unknown view "{}", see /views'.format(name)})
+
+        try:
+            text = params.get('q', '')
+            order = params.get('order', 'asc')
+            page = int(params.get('page', 1))
+            page_size = int(params.get('page_size', PAGE_SIZE))
+            if order not in ('asc', 'desc'):
+                raise ValueError('Invalid order "{}", valid values are: asc, desc'.format(order))
+            sort = views.validate(view, params.get('sort'), page, page_size)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+
+        # Nothing has changed since the client got the response
+        cache = self.server.cache
+        etag = cache.etag
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(304, None, etag)
+
+        key = (view, text, sort, order, page, page_size)
+        body = cache.get(key)
+        if body is None:
+            columns, rows, total = views.query(self.server.db_file, view, text, sort, order == 'desc', page, page_size)
+
+            body = encode({'view': view,
+                           'columns': columns,
+                           'rows': [dict(zip(columns, row)) for row in rows],
+                           'total': total,
+                           'page': page,
+                           'page_size': page_size,
+                           'pages': (total + page_size - 1) // page_size})
+            cache.put(key, body, etag)
+
+        self.send_body(200, body, etag)
+
+    def send_json(self, status, data):
+        """Sends a response that is not cached."""
+
+        self.send_body(status, encode(data))
+
+    def send_body(self, status, body, etag=None):
+        """Sends an encoded JSON response, clients must revalidate cached responses with the ETag."""
+
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Doesn't log each request."""
+
+
+def encode(data):
+    """Encodes a response as JSON."""
+
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def main():
+    parser = argparse.ArgumentParser(description='Refreshes the repositories on a schedule and serves the views '
+                                                 'over a local HTTP JSON API.')
+    parser.add_argument('--host', default=HOST, help='address to listen on (default only this computer)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--interval', type=float, help='time between refreshes of each repository (hours)')
+    parser.add_argument('--no-refresh', action='store_true', help='only serve the data in the database')
+    args = parser.parse_args()
+
+    intervals = {name: args.interval * 3600 for name in headless.PIPELINES} if args.interval else None
+    server = DaemonServer((args.host, args.port), intervals=intervals)
+    if not args.no_refresh:
+        server.start_refresh()
+
+    print('Serving http://{}:{}/views'.format(args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
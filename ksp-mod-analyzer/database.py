@@ -0,0 +1,27 @@
+"""
+    database.py
+    -----------
+    Implements the connections to the SQLite database, shared by all modules writing to it.
+
+    The repositories are refreshed concurrently (see orchestrator.py), and the UI and the daemon read while a
+    refresh writes, so the database uses write-ahead logging (WAL): readers don't block the writer and the writer
+    doesn't block readers. Writers still take turns, a connection waits up to TIMEOUT seconds for another writer to
+    commit (e.g. "update_db" storing the snapshot and report of a repository) instead of failing at once with
+    "database is locked".
+"""
+
+import sqlite3
+
+# Max time (seconds) to wait for another connection to finish writing
+TIMEOUT = 60
+
+
+def connect(db_file, timeout=TIMEOUT):
+    """Returns a connection to the database, waiting up to "timeout" seconds when the database is locked."""
+
+    return sqlite3.connect(db_file, timeout=timeout)
+
+def enable_wal(con):
+    """Switches the database to write-ahead logging, stored in the database file so it's only needed once."""
+
+    con.execute('PRAGMA journal_mode=WAL')
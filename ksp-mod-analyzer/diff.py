@@ -0,0 +1,184 @@
+"""
+    diff.py
+    -----------
+    Implements the change report of a refresh: new mods, removed mods, version bumps and link changes
+    between the previous and the new rows of the SpaceDock, Curse or CKAN table.
+
+    The rows are joined on the normalized mod name (see matching.match_key) with dicts, so the report is computed
+    in linear time, and a mod that is only renamed slightly (e.g. "KerbalEngineer" -> "Kerbal Engineer") is reported
+    as changed and not as removed and new.
+
+    Usage (shows the report of the last refresh):
+        python3 ksp-mod-analyzer/diff.py [SpaceDock|Curse|CKAN]
+"""
+
+import contextlib
+import json
+import re
+import sys
+import time
+from datetime import datetime
+
+import database
+import matching
+
+# Columns after 'Mod' for each table, in the order returned by snapshots.get_rows
+COLUMNS = {'SpaceDock': ('KSP_version', 'Source', 'Forum', 'Mod_Id', 'URL'),
+           'Curse': ('KSP_version', 'Source', 'Forum', 'URL'),
+           'CKAN': ('KSP_version', 'Source', 'Forum', 'Kerbalstuff', 'Spacedock', 'Spacedock_Id')}
+
+# Column with the supported KSP version, and columns with links
+VERSION_COLUMN = 'KSP_version'
+LINK_COLUMNS = ('Source', 'Forum', 'URL', 'Kerbalstuff', 'Spacedock')
+
+# Target of a link stored as HTML, e.g. the Curse and SpaceDock 'URL' column: '<a href="...">1.2.2</a>'
+RE_HREF = re.compile(r'<a href="([^"]*)"')
+
+# Max number of mods per category printed by "format_report"
+MAX_PRINTED = 20
+
+
+def init_reports(cur):
+    """Creates the 'Reports' table if it doesn't exist."""
+
+    cur.execute('CREATE TABLE IF NOT EXISTS Reports '
+                '(Id INTEGER PRIMARY KEY, Source TEXT, Time REAL, Report TEXT)')
+    cur.execute('CREATE INDEX IF NOT EXISTS Reports_Source ON Reports (Source)')
+
+def join_rows(old_rows, new_rows):
+    """Joins the old and new rows on the mod name, returns (new mods, removed mods, [(old name, new name)]).
+
+    Names are first joined as they are, the remaining names are joined on the normalized name.
+    """
+
+    joined = [(mod, mod) for mod in new_rows if mod in old_rows]
+    new_mods = [mod for mod in new_rows if mod not in old_rows]
+    removed_mods = [mod for mod in old_rows if mod not in new_rows]
+
+    # Normalized name of the removed mods, names normalized to the same key are not joined
+    keys = {}
+    for mod in removed_mods:
+        key = matching.match_key(mod)
+        keys[key] = None if key in keys else mod
+
+    renamed = {}
+    for mod in new_mods:
+        old_mod = keys.pop(matching.match_key(mod), None)
+        if old_mod is not None:
+            renamed[mod] = old_mod
+            joined.append((old_mod, mod))
+
+    renamed_old = set(renamed.values())
+    return ([mod for mod in new_mods if mod not in renamed],
+            [mod for mod in removed_mods if mod not in renamed_old],
+            joined)
+
+def link_target(value):
+    """Returns the target of a link stored as HTML, without the link text (the supported KSP version, already
+    compared as a version bump), or the value itself for a plain URL.
+    """
+
+    match = RE_HREF.match(value or '')
+    return match.group(1) if match else value
+
+def diff_rows(table, old_rows, new_rows):
+    """Compares the rows of a table before and after a refresh, "old_rows" and "new_rows" are
+    dicts {mod name: [other columns]} (see snapshots.get_rows).
+
+    Returns a report dict with:
+        - 'new': sorted list of new mods
+        - 'removed': sorted list of removed mods
+        - 'renamed': list of [old name, new name]
+        - 'versions': list of [mod, old version, new version]
+        - 'links': list of [mod, column, old link, new link]
+    """
+
+    columns = COLUMNS[table]
+    version = columns.index(VERSION_COLUMN)
+    links = [(i, column) for i, column in enumerate(columns) if column in LINK_COLUMNS]
+
+    new_mods, removed_mods, joined = join_rows(old_rows, new_rows)
+
+    report = {'new': sorted(new_mods, key=str.lower),
+              'removed': sorted(removed_mods, key=str.lower),
+              'renamed': [],
+              'versions': [],
+              'links': []}
+
+    for old_mod, mod in sorted(joined, key=lambda names: names[1].lower()):
+        old_row = old_rows[old_mod]
+        new_row = new_rows[mod]
+
+        if old_mod != mod:
+            report['renamed'].append([old_mod, mod])
+
+        if old_row[version] != new_row[version]:
+            report['versions'].append([mod, old_row[version], new_row[version]])
+
+        for i, column in links:
+            old_link = link_target(old_row[i])
+            new_link = link_target(new_row[i])
+            if old_link != new_link:
+                report['links'].append([mod, column, old_link, new_link])
+
+    return report
+
+def record(cur, table, report, timestamp=None):
+    """Stores the report of a refresh."""
+
+    init_reports(cur)
+    if timestamp is None:
+        timestamp = time.time()
+    cur.execute('INSERT INTO Reports (Source, Time, Report) VALUES (?, ?, ?)',
+                (table, timestamp, json.dumps(report)))
+
+def get_report(db_file, table):
+    """Returns (time, report) of the last refresh of a table, or None if there is no report."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        cur = con.cursor()
+        init_reports(cur)
+        cur.execute('SELECT Time, Report FROM Reports WHERE Source = ? ORDER BY Id DESC LIMIT 1', (table,))
+        row = cur.fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+def summary(table, report):
+    """Returns a one line summary of a report, e.g. "CKAN: 3 new, 1 removed, 0 renamed, 12 version bumps, 2 link changes"."""
+
+    return '{}: {} new, {} removed, {} renamed, {} version bumps, {} link changes'.format(
+        table, len(report['new']), len(report['removed']), len(report['renamed']),
+        len(report['versions']), len(report['links']))
+
+def format_report(table, report, max_printed=MAX_PRINTED):
+    """Returns a report as text, with at most "max_printed" mods per category."""
+
+    lines = [summary(table, report)]
+    categories = [('New mods', report['new'], '{}'),
+                  ('Removed mods', report['removed'], '{}'),
+                  ('Renamed mods', report['renamed'], '{} -> {}'),
+                  ('Version bumps', report['versions'], '{}: {} -> {}'),
+                  ('Link changes', report['links'], '{} ({}): {} -> {}')]
+
+    for title, items, line_format in categories:
+        if not items:
+            continue
+        lines.append(title + ':')
+        for item in items[:max_printed]:
+            lines.append('    ' + (line_format.format(*item) if isinstance(item, list) else line_format.format(item)))
+        if len(items) > max_printed:
+            lines.append('    ... and {} more'.format(len(items) - max_printed))
+
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    tables = sys.argv[1:] or list(COLUMNS.keys())
+    for table in tables:
+        if table not in COLUMNS:
+            sys.exit('Usage: diff.py [' + '|'.join(COLUMNS.keys()) + ']')
+
+        result = get_report('data/database.db', table)
+        if result is None:
+            print(table + ': no refresh report')
+        else:
+            print(datetime.fromtimestamp(result[0]).strftime('%Y-%m-%d %H:%M'), format_report(table, result[1]))
+        print()
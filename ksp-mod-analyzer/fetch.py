@@ -0,0 +1,426 @@
+"""
+    fetch.py
+    -----------
+    Implements the HTTP core shared by SpaceDock, Curse and CKAN processing.
+
+    All requests go through one requests.Session with a connection pool per host, so connections are kept alive
+    and reused between pages and repositories instead of a new TCP/TLS handshake for each request.
+    The number of concurrent requests to each host is limited, independent of how many threads are fetching,
+    and the request rate is limited by an adaptive rate limiter (see ratelimit.py).
+
+    Large files are downloaded with "download", into a '.part' file that is resumed with an HTTP Range request
+    after a failed or cancelled download, and downloaded again only if changed on the server when asked for.
+
+    Requests have a connect and read timeout, and can be cancelled with the active cancel token of the thread (see
+    cancel.py): each connection is registered with the token when sending a request, so cancelling aborts waiting
+    for a response or reading a download, and the waits for the rate limiter and between retries are interrupted.
+"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import cancel
+import metrics
+import ratelimit
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# Max number of concurrent requests to the same host
+MAX_CONNECTIONS_PER_HOST = 4
+
+# Number of hosts to keep connection pools for
+POOL_CONNECTIONS = 10
+
+# Size of the chunks read when downloading a file (bytes), adjusted so reading a chunk takes about CHUNK_TIME
+CHUNK_SIZE = 65536
+MIN_CHUNK_SIZE = 16384
+MAX_CHUNK_SIZE = 4194304
+CHUNK_TIME = 0.25
+
+# Errors while connecting or reading a download, after which the download is resumed
+READ_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+               urllib3.exceptions.HTTPError, ConnectionError)
+
+# Default timeouts (seconds) for connecting and for waiting for data from the server
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+
+class CancellableHTTPConnection(urllib3.connection.HTTPConnection):
+    """HTTP connection registered with the active cancel token when sending a request."""
+
+    def request(self, *args, **kwargs):
+        register_connection(self)
+        super().request(*args, **kwargs)
+
+
+class CancellableHTTPSConnection(urllib3.connection.HTTPSConnection):
+    """HTTPS connection registered with the active cancel token when sending a request."""
+
+    def request(self, *args, **kwargs):
+        register_connection(self)
+        super().request(*args, **kwargs)
+
+
+class CancellableHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = CancellableHTTPConnection
+
+
+class CancellableHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = CancellableHTTPSConnection
+
+
+class CancellableAdapter(HTTPAdapter):
+    """Transport adapter using connections that can be aborted by cancelling the refresh."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CancellableHTTPConnectionPool,
+                                                   'https': CancellableHTTPSConnectionPool}
+
+
+class Fetcher:
+    """HTTP client with a shared connection pool, a concurrency limit and a rate limit per host."""
+
+    def __init__(self, max_connections_per_host=MAX_CONNECTIONS_PER_HOST):
+        self.max_connections_per_host = max_connections_per_host
+        self.rate_limiter = ratelimit.RateLimiter()
+
+        # Keep the connections in the pool alive, one pool per host
+        adapter = CancellableAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=max_connections_per_host)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # One semaphore per host, created on first request
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def host_limit(self, url):
+        """Returns the semaphore limiting the number of concurrent requests to the host in "url"."""
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return self._host_limits[host]
+
+    def get(self, url, raise_for_status=True, **kwargs):
+        """Sends a GET request, waits if there are already too many requests running to the same host.
+
+        Requests failing with a connection error, 429 or 503 are retried with a delay, given by the 'Retry-After'
+        header if available. Raises 'cancel.Cancelled' if the active cancel token is cancelled, also while waiting.
+        Other error statuses raise 'requests.HTTPError', unless "raise_for_status" is False (e.g. for "download",
+        which handles '304 Not Modified' and '416 Range Not Satisfiable' itself).
+
+        A streamed response ("stream=True") counts as a request to the host until it's closed by the caller.
+        """
+
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        stream = kwargs.get('stream')
+
+        for attempt in range(ratelimit.MAX_RETRIES + 1):
+            last_attempt = attempt == ratelimit.MAX_RETRIES
+
+            # Wait for the rate limiter
+            cancel.check()
+            with metrics.stage('rate_limit'):
+                self.rate_limiter.acquire(url, sleep=cancel.sleep)
+
+            start = time.monotonic()
+            host_limit = self.host_limit(url)
+            host_limit.acquire()
+            response = None
+            try:
+                with metrics.stage('http', requests=1) as counts:
+                    response = self.session.get(url, **kwargs)
+
+                    # Streamed responses are counted by the caller while reading, and keep the host slot until closed
+                    if stream:
+                        release_on_close(response, host_limit)
+                    else:
+                        counts['bytes'] = len(response.content)
+            except (requests.ConnectionError, requests.Timeout):
+                # The connection was aborted by cancelling
+                cancel.check()
+                if last_attempt:
+                    raise
+                self.rate_limiter.update(url, 503, time.monotonic() - start)
+                delay = ratelimit.backoff_delay(attempt)
+            else:
+                # The content may be incomplete if the connection was aborted while reading it
+                try:
+                    cancel.check()
+                except cancel.Cancelled:
+                    response.close()
+                    raise
+                self.rate_limiter.update(url, response.status_code, time.monotonic() - start)
+                if response.status_code not in ratelimit.THROTTLE_STATUS:
+                    if raise_for_status:
+                        raise_error(response)
+                    return response
+
+                # Throttled, wait as long as the server asks for (if reasonable) before retrying
+                delay = ratelimit.retry_after(response)
+                if delay is None:
+                    delay = ratelimit.backoff_delay(attempt)
+                if last_attempt or delay > ratelimit.BACKOFF_MAX:
+                    raise_error(response)
+                response.close()
+            finally:
+                if not stream or response is None:
+                    host_limit.release()
+
+            print('Retrying {} in {:.1f} s'.format(url, delay))
+            cancel.sleep(delay)
+
+
+# Fetcher shared by all repositories, created on first use
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """Returns the shared fetcher."""
+
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+        return _fetcher
+
+def get(url, **kwargs):
+    """Sends a GET request using the shared fetcher."""
+
+    return get_fetcher().get(url, **kwargs)
+
+def release_on_close(response, semaphore):
+    """Releases "semaphore" when "response" is closed, only the first time if closed more than once."""
+
+    close = response.close
+    released = threading.Event()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                semaphore.release()
+
+    response.close = close_and_release
+
+def raise_error(response):
+    """Raises 'requests.HTTPError' for an error status, after closing the response (e.g. a streamed response)."""
+
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
+        raise
+
+def register_connection(connection):
+    """Registers a connection with the active cancel token, and removes it from the token of an earlier request
+    (connections are reused by all refreshes).
+    """
+
+    token = cancel.current()
+    previous = getattr(connection, 'cancel_token', None)
+    if previous is not None and previous is not token:
+        previous.unregister(connection)
+
+    connection.cancel_token = token
+    if token is not None:
+        token.register(connection)
+
+def download(url, file_name, progress=None, check=None, validator=None):
+    """Downloads "url" to "file_name", returns the size of the file.
+
+    The data is written to "<file_name>.part", which is renamed to "file_name" when complete, so an earlier
+    complete file is kept until the new one has been downloaded. If the connection is lost, the download is resumed
+    from the end of the '.part' file with a Range request, also in a later call after a failure or cancellation.
+    The 'ETag' (or 'Last-Modified') header of the first response is sent as 'If-Range', so a file that has changed
+    on the server is downloaded again from the start instead of being appended to the old data.
+
+    A download that is interrupted again and again is resumed as long as each attempt gets some data, and given
+    up after ratelimit.MAX_RETRIES attempts in a row without any data.
+
+    "progress" is called with the downloaded fraction (0-1) when the size is known from 'Content-Length', and
+    "check" is called for each chunk, e.g. for raising an exception if the download is cancelled.
+
+    With "validator", the 'ETag' (or 'Last-Modified') of "file_name" when it was downloaded (see "get_validator"),
+    the file is only downloaded if it has changed on the server since then, None is returned if not.
+    """
+
+    part_file = file_name + '.part'
+    info_file = part_file + '.json'
+
+    failures = 0
+    while True:
+        info = read_part_info(info_file, url, part_file)
+        offset = os.path.getsize(part_file) if info else 0
+
+        # Ask for the rest of the file only, if it's still the same file on the server
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = info['validator']
+        elif validator and os.path.exists(file_name):
+            # Conditional request, the server answers '304 Not Modified' if the file is unchanged
+            headers['If-None-Match' if is_etag(validator) else 'If-Modified-Since'] = validator
+
+        response = get(url, raise_for_status=False, stream=True, headers=headers)
+        try:
+            if response.status_code == 304:
+                return None
+
+            if offset and response.status_code == 416 and offset == info.get('length'):
+                # Nothing left to download
+                break
+
+            if offset and response.status_code in (206, 416) and range_start(response) != offset:
+                # Not the requested range, start over
+                print('Download of {} can\'t be resumed, starting over'.format(url))
+                os.remove(part_file)
+                failures += 1
+                continue
+
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                print('Resuming download of {} at {} bytes'.format(url, offset))
+            else:
+                # Complete file (Range not supported, or the file has changed), start over
+                offset = 0
+                info = {'url': url,
+                        'validator': response.headers.get('ETag') or response.headers.get('Last-Modified'),
+                        'length': content_length(response)}
+                with open(info_file, 'w') as f:
+                    json.dump(info, f)
+
+            read_response(response, part_file, offset, info.get('length'), progress, check)
+            break
+        except READ_ERRORS + (requests.HTTPError,) as e:
+            # The connection was aborted by cancelling
+            cancel.check()
+
+            # Client errors (e.g. '404 Not Found') are permanent and not retried, server errors may be temporary
+            if isinstance(e, requests.HTTPError) and e.response.status_code < 500:
+                raise
+
+            # Count the attempts in a row without any data
+            if os.path.exists(part_file) and os.path.getsize(part_file) > offset:
+                failures = 0
+            else:
+                failures += 1
+            if failures > ratelimit.MAX_RETRIES:
+                raise
+            delay = ratelimit.backoff_delay(failures)
+            print('Download of {} interrupted ({}), resuming in {:.1f} s'.format(url, e, delay))
+            cancel.sleep(delay)
+        finally:
+            response.close()
+
+    # Integrity check, the file must have the size given by the server. A short read has been resumed above, so the
+    # data of a complete transfer doesn't match the file on the server and is removed
+    size = os.path.getsize(part_file)
+    length = info.get('length')
+    if length is not None and size != length:
+        os.remove(part_file)
+        raise IOError('Download of {} failed, {} of {} bytes downloaded'.format(url, size, length))
+
+    # Keep the information of the complete file, for a conditional request in the next download
+    os.replace(part_file, file_name)
+    os.replace(info_file, file_name + '.json')
+    return size
+
+def get_validator(file_name):
+    """Returns the 'ETag' (or 'Last-Modified') of a file downloaded with "download", or None if not known."""
+
+    try:
+        with open(file_name + '.json') as f:
+            return json.load(f).get('validator')
+    except (OSError, ValueError):
+        return None
+
+def is_etag(validator):
+    """Checks if a validator is an 'ETag' (quoted, may be weak), and not a 'Last-Modified' date."""
+
+    return validator.startswith('"') or validator.startswith('W/')
+
+def read_part_info(info_file, url, part_file):
+    """Returns the information stored for a partly downloaded file, or None if it can't be resumed."""
+
+    try:
+        with open(info_file) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Only resume the same URL, from a server that identifies the file version
+    if info.get('url') != url or not info.get('validator') or not os.path.exists(part_file):
+        return None
+    return info
+
+def range_start(response):
+    """Returns the first byte of a partial response, from the 'Content-Range' header, e.g. "bytes 100-199/200"."""
+
+    try:
+        return int(response.headers['Content-Range'].split()[1].split('-')[0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+def content_length(response):
+    """Returns the size of the complete file, or None if not known."""
+
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+def read_response(response, part_file, offset, length, progress=None, check=None):
+    """Writes a streamed response to the '.part' file from "offset", returns the number of bytes read.
+
+    Raises 'ConnectionError' (one of READ_ERRORS) if the data ends before "length", e.g. a connection closed without
+    an error, the data read is kept for resuming the download.
+
+    The chunk size is adjusted to the speed of the connection: larger chunks on a fast connection (fewer calls),
+    smaller chunks on a slow connection (frequent progress updates and cancellation checks).
+    """
+
+    chunk_size = CHUNK_SIZE
+    read = 0
+    with open(part_file, 'r+b' if offset else 'wb') as f, metrics.stage('download') as counts:
+        f.seek(offset)
+        f.truncate()
+        counts['bytes'] = 0
+
+        while True:
+            if check:
+                check()
+
+            start = time.monotonic()
+            chunk = response.raw.read(chunk_size)
+            if not chunk:
+                # An aborted connection also looks like the end of the data
+                cancel.check()
+                break
+            f.write(chunk)
+            read += len(chunk)
+            counts['bytes'] += len(chunk)
+
+            if progress and length:
+                progress((offset + read) / length)
+
+            # Double or halve the chunk size
+            elapsed = time.monotonic() - start
+            if elapsed < CHUNK_TIME / 2 and len(chunk) == chunk_size:
+                chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+            elif elapsed > CHUNK_TIME * 2:
+                chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+
+    if length is not None and offset + read < length:
+        raise ConnectionError('Connection closed after {} of {} bytes'.format(offset + read, length))
+    return read
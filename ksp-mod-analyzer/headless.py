@@ -0,0 +1,86 @@
+"""
+    headless.py
+    -----------
+    Runs the SpaceDock, Curse and CKAN pipelines without the UI, e.g. for benchmarking or scheduled updates.
+
+    Usage:
+        python3 ksp-mod-analyzer/headless.py [spacedock] [curse] [ckan]
+
+    All repositories are updated if none is given.
+"""
+
+import os
+import sys
+import time
+
+import ckan
+import curse
+import diff
+import helpers
+import metrics
+import spacedock
+
+DATA_DIR = 'data'
+DB_FILE = 'data/database.db'
+
+# Pipeline class for each repository
+PIPELINES = {'spacedock': spacedock.SpacedockPipeline,
+             'curse': curse.CursePipeline,
+             'ckan': ckan.CKANPipeline}
+
+# Database table for each repository
+TABLES = {'spacedock': 'SpaceDock',
+          'curse': 'Curse',
+          'ckan': 'CKAN'}
+
+
+def print_event(kind, value):
+    """Prints pipeline events to stdout."""
+
+    if kind == 'progress':
+        print('Progress: {}%'.format(value))
+    elif kind == 'error':
+        print('Error:', value)
+    else:
+        print('Pipeline', kind)
+
+def update(names, db_file=DB_FILE, use_cache=False):
+    """Updates the database with data from the repositories in "names"."""
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    helpers.init_database(db_file)
+
+    changed = []
+    for name in names:
+        pipeline = PIPELINES[name](db_file, use_cache)
+        pipeline.subscribe(print_event)
+
+        started = time.time()
+        start = time.perf_counter()
+        pipeline.run()
+        print('Updated {} in {:.1f} s'.format(pipeline.name, time.perf_counter() - start))
+        if pipeline.changed:
+            changed.append(name)
+        pipeline.metrics.write()
+        print(metrics.format_summary(pipeline.metrics.to_dict()))
+
+        # Print what changed since the previous refresh (no report if the pipeline found no changes)
+        result = diff.get_report(db_file, TABLES[name])
+        if result and result[0] >= started:
+            print(diff.format_report(TABLES[name], result[1]))
+
+    # Update database table 'Total' once for all repositories, if any of them has changed
+    if not changed:
+        print('No changes, table Total not updated')
+        return
+    total_metrics = metrics.Metrics('Total')
+    with metrics.activate(total_metrics):
+        helpers.update_total_mods(db_file)
+    total_metrics.write()
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(PIPELINES.keys())
+    for name in names:
+        if name not in PIPELINES:
+            sys.exit('Unknown repository "' + name + '", valid names are: ' + ', '.join(PIPELINES.keys()))
+    update(names)
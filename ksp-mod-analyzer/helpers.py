@@ -8,18 +8,29 @@
 
 import contextlib
 import io
+import json
 import os
 import pickle
 import re
-import sqlite3
 import sys
+import time
 import traceback
 from datetime import datetime
 
+import database
+import diff
+import matching
+import metrics
+import records
+import snapshots
 from PyQt5 import QtCore, QtWidgets, QtGui
-from natsort import natsorted
 
 
+# Data file written by each repository, used for the refresh statistics of databases created by earlier versions
+DATA_FILES = {'SpaceDock': 'data/spacedock.data',
+              'Curse': 'data/curse.data',
+              'CKAN': 'data/master.tar.gz'}
+
 def get_highest_version(mod_versions):
     """Get the highest mod version in the mod_versions list."""
 
@@ -61,6 +72,8 @@ def get_highest_version(mod_versions):
         if not epochs:
             clean_mod_versions.append(rest)
 
+    # Imported here as it's only needed when processing CKAN, not at application start
+    from natsort import natsorted
     highest_mod_version = natsorted(clean_mod_versions)[-1]
 
     if epochs:
@@ -71,9 +84,13 @@ def get_highest_version(mod_versions):
 def init_database(db_file):
     """Initializes the SQLite database and creates tables if they don't exist."""
 
-    with contextlib.closing(sqlite3.connect(db_file, timeout=1)) as con:
+    with contextlib.closing(database.connect(db_file)) as con:
         print("Initializing database...")
         print()
+
+        # The repositories are written concurrently while the UI reads, see database.py
+        database.enable_wal(con)
+
         with con as cur:
             # Create tables
             cur.execute('CREATE TABLE IF NOT EXISTS SpaceDock '
@@ -83,167 +100,267 @@ def init_database(db_file):
                         '(Id INTEGER PRIMARY KEY, Mod TEXT, KSP_version TEXT, Source TEXT, Forum TEXT, URL TEXT)')
 
             cur.execute('CREATE TABLE IF NOT EXISTS CKAN '
-                        '(Id INTEGER PRIMARY KEY, Mod TEXT, KSP_version TEXT, Source TEXT, Forum TEXT, Kerbalstuff TEXT, Spacedock TEXT)')
+                        '(Id INTEGER PRIMARY KEY, Mod TEXT, KSP_version TEXT, Source TEXT, Forum TEXT, Kerbalstuff TEXT, Spacedock TEXT, '
+                        'Spacedock_Id INTEGER)')
 
             cur.execute('CREATE TABLE IF NOT EXISTS Total '
                         '(Id INTEGER PRIMARY KEY, Mod TEXT, SpaceDock TEXT, Curse TEXT, CKAN TEXT, Source TEXT, Forum TEXT)')
 
+            # Add columns missing in databases created by earlier versions
+            add_column(cur, 'CKAN', 'Spacedock_Id', 'INTEGER')
+
+            # Indexes for joining CKAN and SpaceDock mods on the SpaceDock id
+            cur.execute('CREATE INDEX IF NOT EXISTS SpaceDock_Mod_Id ON SpaceDock (Mod_Id)')
+            cur.execute('CREATE INDEX IF NOT EXISTS CKAN_Spacedock_Id ON CKAN (Spacedock_Id)')
+
+            # Fingerprint and mods (JSON) for each page on Curse from the previous run
+            cur.execute('CREATE TABLE IF NOT EXISTS CursePages '
+                        '(Page INTEGER PRIMARY KEY, Fingerprint TEXT, Mods TEXT, Fetched REAL)')
+            add_column(cur, 'CursePages', 'Fetched', 'REAL')
+
+            # Data of all versions of each CKAN mod, the latest version of each mod is selected from this table
+            cur.execute('CREATE TABLE IF NOT EXISTS CKANStaging '
+                        '(Identifier TEXT, Mod_version TEXT, KSP_version TEXT, Name TEXT, Source TEXT, Forum TEXT, '
+                        'Kerbalstuff TEXT, Spacedock TEXT, Path TEXT, PRIMARY KEY (Identifier, Mod_version))')
+            add_column(cur, 'CKANStaging', 'Path', 'TEXT')
+            cur.execute('CREATE INDEX IF NOT EXISTS CKANStaging_Path ON CKANStaging (Path)')
+
+            # Commit of the git clone of CKAN-meta read last, if used instead of the tarball (see ckan_git.py)
+            cur.execute('CREATE TABLE IF NOT EXISTS CKANGitSync (Repo TEXT PRIMARY KEY, Head TEXT)')
+
+            # History of the tables and the change report of each refresh
+            snapshots.init_snapshots(cur)
+            diff.init_reports(cur)
+
+            # Similar mod names found when updating 'Total', not merged but listed for review
+            matching.init_candidates(cur)
+
+            # Statistics of the last refresh of each repository, for the 'Status' group box
+            cur.execute('CREATE TABLE IF NOT EXISTS RefreshStats '
+                        '(Source TEXT PRIMARY KEY, Mods INTEGER, Total_Mods INTEGER, Time REAL, Duration REAL, '
+                        'Bytes INTEGER)')
+            if cur.execute('SELECT COUNT(*) FROM RefreshStats').fetchone()[0] == 0:
+                add_refresh_stats_from_files(cur)
+
+def add_refresh_stats_from_files(cur):
+    """Adds refresh statistics for repositories updated before the statistics were stored in the database,
+    using the modification time of the data files and the mods in 'Total'.
+    """
+
+    for table, file_name in DATA_FILES.items():
+        if os.path.isfile(file_name):
+            total_mods = cur.execute('SELECT COUNT(Mod) FROM Total WHERE ' + table + ' IS NOT NULL').fetchone()[0]
+            mods = cur.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0]
+            cur.execute('INSERT INTO RefreshStats (Source, Mods, Total_Mods, Time) VALUES (?, ?, ?, ?)',
+                        (table, mods, total_mods, os.path.getmtime(file_name)))
+
+def add_column(cur, table, column, column_type):
+    """Adds a column to a table, if it doesn't exist."""
+
+    columns = [row[1] for row in cur.execute('PRAGMA table_info(' + table + ')')]
+    if column not in columns:
+        cur.execute('ALTER TABLE ' + table + ' ADD COLUMN ' + column + ' ' + column_type)
+
 def update_total_mods(db_file):
     """Updates the 'Total' table with data from 'SpaceDock', 'Curse' and 'CKAN' tables."""
 
-    con = sqlite3.connect(db_file, timeout=1)
-    with con:
+    con = database.connect(db_file)
+    with metrics.stage('total_merge') as counts, con:
         cur = con.cursor()
+        old_rows = snapshots.get_rows(cur, 'Total')
         cur.execute('DELETE FROM Total')
 
-        # Get a list of all SpaceDock mods
-        cur.execute('SELECT Mod, KSP_version, Source, Forum, URL FROM SpaceDock')
-        spacedock = {i[0]: [i[1], i[2], i[3], i[4]] for i in cur.fetchall()}
+        # Get all SpaceDock mods, as {mod: (source, forum, url)}
+        cur.execute('SELECT Mod, Source, Forum, URL FROM SpaceDock')
+        spacedock = {i[0]: i[1:] for i in cur}
 
-        # Get a list of all Curse mods
-        cur.execute('SELECT Mod, KSP_version, Source, Forum, URL FROM Curse')
-        curse = {i[0]: [i[1], i[2], i[3], i[4]] for i in cur.fetchall()}
+        # Get all Curse mods, as {mod: url}
+        cur.execute('SELECT Mod, URL FROM Curse')
+        curse = {i[0]: i[1] for i in cur}
 
-        # Get a list of all CKAN mods
+        # Get all CKAN mods, as {mod: (ksp_version, source, forum)}
         cur.execute('SELECT Mod, KSP_version, Source, Forum FROM CKAN')
-        ckan = {i[0]: [i[1], i[2], i[3]] for i in cur.fetchall()}
+        ckan = {i[0]: i[1:] for i in cur}
 
-        # Get a sorted list of all unique mods (duplicates removed by the set)
+        # Match CKAN mod names to SpaceDock names, joining on the SpaceDock id of CKAN mods where available
+        cur.execute('SELECT CKAN.Mod, SpaceDock.Mod '
+                    'FROM CKAN JOIN SpaceDock ON SpaceDock.Mod_Id = CKAN.Spacedock_Id '
+                    'WHERE CKAN.Spacedock_Id IS NOT NULL')
+        ckan_hard_keys = {i[0]: i[1] for i in cur.fetchall()}
+        ckan = match_mods(cur, 'CKAN', ckan, spacedock.keys(), ckan_hard_keys)
+
+        # Match Curse mod names to SpaceDock and CKAN names
+        curse = match_mods(cur, 'Curse', curse, list(spacedock.keys()) + list(ckan.keys()))
 
+        # Get a sorted list of all unique mods (duplicates removed by the set)
         total_mods = sorted(set(list(spacedock.keys()) + list(curse.keys()) + list(ckan.keys())), key=str.lower)
         print("### Total mods", len(total_mods))
 
-        # Initlialize 'Total' table with all available mods
+        # Create the 'Total' rows with status of mod availability in SpaceDock, Curse and CKAN repositories,
+        # as tuples (mod, spacedock, curse, ckan, source, forum)
+        rows = []
         for mod in total_mods:
-            cur.execute('INSERT INTO Total (Mod) '
-                        'VALUES (:mod)',
-                        {'mod': mod})
+            spacedock_url = curse_url = ckan_version = source = forum = None
 
-        # Update 'Total' table with status of mod availability in SpaceDock, Curse and CKAN repositories
-        for mod in total_mods:
-            if mod in spacedock.keys():
-                cur.execute('UPDATE Total '
-                            'SET Spacedock =:version_link, Source =:source, Forum =:forum '
-                            'WHERE Mod =:mod',
-                            {'mod': mod,
-                             'version_link': spacedock[mod][3],
-                             'source': spacedock[mod][1],
-                             'forum': spacedock[mod][2]})
-            if mod in curse.keys():
-                cur.execute('UPDATE Total '
-                            'SET Curse =:version_link '
-                            'WHERE Mod =:mod',
-                            {'mod': mod,
-                             'version_link': curse[mod][3]})
-
-        # Update with CKAN last, as "Source" and "Forum" are likely more recently updated than SpaceDock data
-        for mod in total_mods:
-            if mod in ckan.keys():
-                cur.execute('UPDATE Total '
-                            'SET CKAN =:version_no_link, Source=:source, Forum =:forum '
-                            'WHERE Mod =:mod',
-                            {'mod': mod,
-                             'version_no_link': ckan[mod][0],
-                             'source': ckan[mod][1],
-                             'forum': ckan[mod][2]})
+            if mod in spacedock:
+                source, forum, spacedock_url = spacedock[mod]
+
+            if mod in curse:
+                curse_url = curse[mod]
+
+            # Update with CKAN last, as "Source" and "Forum" are likely more recently updated than SpaceDock data
+            if mod in ckan:
+                ckan_version, source, forum = ckan[mod]
+
+            rows.append((mod, spacedock_url, curse_url, ckan_version, source, forum))
+
+        cur.executemany('INSERT INTO Total (Mod, SpaceDock, Curse, CKAN, Source, Forum) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        rows)
+        counts['rows'] = len(rows)
+
+        # Number of mods in 'Total' for each repository, shown in the 'Status' group box
+        for table, column in (('SpaceDock', 1), ('Curse', 2), ('CKAN', 3)):
+            cur.execute('UPDATE RefreshStats SET Total_Mods = ? WHERE Source = ?',
+                        (sum(1 for row in rows if row[column] is not None), table))
+
+        # Store the changes in the history
+        snapshots.record(cur, 'Total', old_rows, snapshots.get_rows(cur, 'Total'))
+
+def match_mods(cur, table, mods, canonical_names, hard_keys=None):
+    """Renames the mods of a repository matching "canonical_names" on a hard key or the match key, and stores
+    similar names that are not renamed in the 'MatchCandidates' table for review (see matching.py).
+    """
+
+    renamed = matching.match_names(mods.keys(), canonical_names, hard_keys)
+
+    candidates = matching.find_candidates(mods.keys(), canonical_names, renamed)
+    matching.record_candidates(cur, table, candidates)
+    if candidates:
+        print('{}: {} similar mod names not matched, see matching.py, e.g. {}'.format(
+            table, len(candidates), [candidate[:2] for candidate in candidates[:3]]))
+
+    return rename_mods(mods, renamed)
+
+def rename_mods(mods, renamed):
+    """Renames mods in a dict of mods, "renamed" is a dict {old name: new name}."""
+
+    if renamed:
+        print('Matched {} mod names, e.g. {}'.format(len(renamed), list(renamed.items())[:3]))
+    return {renamed.get(mod_name, mod_name): data for mod_name, data in mods.items()}
 
 def update_db(table, mods, db_file):
-    """Updates the database with mod data for SpaceDock, Curse or CKAN."""
+    """Updates the database with mod data for SpaceDock, Curse or CKAN, returns True if any mod data has changed."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+         with metrics.stage('db_write', rows=len(mods)), con:
+            cur = con.cursor()
+            old_rows = snapshots.get_rows(cur, table)
 
-    with contextlib.closing(sqlite3.connect(db_file, timeout=1)) as con:
-         with con as cur:
             if table == 'Curse':
                 print("Updating Curse database...")
                 cur.execute('DELETE FROM Curse')
-                for mod_name in sorted(mods.keys(), key=str.lower):
-                    cur.execute('INSERT INTO Curse (Mod, KSP_version, URL) '
-                                'VALUES (:mod, :version, :url)',
-                                {'mod': mod_name,
-                                 'version': mods[mod_name][0],
-                                 'url':mods[mod_name][1]})
+                cur.executemany('INSERT INTO Curse (Mod, KSP_version, URL) '
+                                'VALUES (?, ?, ?)',
+                                ((mod_name, mod.ksp_version, mod.url)
+                                 for mod_name, mod in sorted(mods.items(), key=lambda item: item[0].lower())))
 
             if table == 'SpaceDock':
                 print("Updating SpaceDock database...")
                 cur.execute('DELETE FROM SpaceDock')
-                for mod_name in sorted(mods.keys(), key=str.lower):
-                    cur.execute('INSERT INTO SpaceDock (Mod, KSP_version, Source, Forum, Mod_Id, URL) '
-                                'VALUES (:mod, :version, :source, :forum, :mod_id, :url)',
-                                {'mod': mod_name,
-                                 'version': mods[mod_name][0],
-                                 'source': mods[mod_name][1],
-                                 'forum': mods[mod_name][2],
-                                 'mod_id': mods[mod_name][3],
-                                 'url': mods[mod_name][4]})
+                cur.executemany('INSERT INTO SpaceDock (Mod, KSP_version, Source, Forum, Mod_Id, URL) '
+                                'VALUES (?, ?, ?, ?, ?, ?)',
+                                ((mod_name, mod.ksp_version, mod.source, mod.forum, mod.id, mod.url)
+                                 for mod_name, mod in sorted(mods.items(), key=lambda item: item[0].lower())))
 
             if table == 'CKAN':
-                # raw_mods[identifier][mod_version] = [ksp_version, mod_name, source, forum, kerbalstuff, spacedock]
                 print("Updating CKAN database...")
                 cur.execute('DELETE FROM CKAN')
-                for mod_name in sorted(mods.keys(), key=str.lower):
-                    cur.execute('INSERT INTO CKAN (Mod, KSP_version, Source, Forum) '
-                                'VALUES (:mod, :version, :source, :forum)',
-                                {'mod': mod_name,
-                                 'version': mods[mod_name][0],
-                                 'source': mods[mod_name][1],
-                                 'forum': mods[mod_name][2]})
-
-def get_records(table, db_file):
-    """Gets the number of rows in a table."""
-
-    con = sqlite3.connect(db_file, timeout=1)
-    with con:
-        cur = con.cursor()
-        if table == 'SpaceDock':
-            cur.execute('SELECT COUNT(Mod) FROM Total WHERE SpaceDock IS NOT NULL')
-            rows = cur.fetchone()[0]
-        elif table == 'Curse':
-            cur.execute('SELECT COUNT(Mod) FROM Total WHERE Curse IS NOT NULL')
-            rows = cur.fetchone()[0]
-        elif table == 'CKAN':
-            cur.execute('SELECT COUNT(Mod) FROM Total WHERE CKAN IS NOT NULL')
-            rows = cur.fetchone()[0]
-        else:
-            return 0
-
-        return rows
-
-def get_file_modification_time(file_name):
-    """Gets the 'last modification' date and time for a file."""
-
-    try:
-        mtime = os.path.getmtime(file_name)
-    except OSError:
-        return False
-
-    # Get the date in a human readable form from the timestamp
-    last_modified_date = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
-    return last_modified_date
-
-def clean_item(item):
-    """Cleans an item (string):
-       - Remove leading and trailing whitespace
-       - Remove leading version info, e.g. [x.y.z], [1.2], (0.90)
+                cur.executemany('INSERT INTO CKAN (Mod, KSP_version, Source, Forum, Kerbalstuff, Spacedock, '
+                                'Spacedock_Id) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                ((mod_name, mod.ksp_version, mod.source, mod.forum, mod.kerbalstuff, mod.spacedock,
+                                  matching.spacedock_id(mod.spacedock))
+                                 for mod_name, mod in sorted(mods.items(), key=lambda item: item[0].lower())))
+
+            # Store the changes in the history, and the change report of this refresh
+            new_rows = snapshots.get_rows(cur, table)
+            snapshots.record(cur, table, old_rows, new_rows)
+
+            report = diff.diff_rows(table, old_rows, new_rows)
+            diff.record(cur, table, report)
+            print(diff.summary(table, report))
+
+            update_refresh_stats(cur, table, len(mods))
+            return new_rows != old_rows
+
+def update_refresh_time(table, db_file):
+    """Stores the time, duration and bytes downloaded of a refresh that found no changes, the number of mods and
+    the data are kept from the previous refresh.
+    """
+
+    refresh = metrics.current()
+    duration = refresh.elapsed() if refresh else None
+    downloaded = refresh.total('bytes') if refresh else None
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con:
+            con.execute('UPDATE RefreshStats SET Time = ?, Duration = ?, Bytes = ? WHERE Source = ?',
+                        (time.time(), duration, downloaded, table))
+
+def update_refresh_stats(cur, table, mods):
+    """Stores the statistics of a refresh: number of mods, time, and the duration and bytes downloaded
+    as measured by the active metrics of the refresh (see metrics.py), if any.
     """
 
-    # Strip leading and trailing whitespace
-    cleaned_item = item.strip()
+    refresh = metrics.current()
+    duration = refresh.elapsed() if refresh else None
+    downloaded = refresh.total('bytes') if refresh else None
+
+    # Keep 'Total_Mods', updated by "update_total_mods"
+    cur.execute('UPDATE RefreshStats SET Mods = ?, Time = ?, Duration = ?, Bytes = ? WHERE Source = ?',
+                (mods, time.time(), duration, downloaded, table))
+    if cur.rowcount == 0:
+        cur.execute('INSERT INTO RefreshStats (Source, Mods, Time, Duration, Bytes) VALUES (?, ?, ?, ?, ?)',
+                    (table, mods, time.time(), duration, downloaded))
+
+def get_refresh_stats(db_file):
+    """Gets the statistics of the last refresh of each repository, as {source: (total mods, time, duration, bytes)}."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        cur = con.execute('SELECT Source, Total_Mods, Time, Duration, Bytes FROM RefreshStats')
+        return {row[0]: row[1:] for row in cur.fetchall()}
 
-    # Regexp for removing all info enclosed in [] at the start of the string, e.g. [1.0.5], [1.x] etc
-    regexp = re.compile(r'^\[.*?\]')
-    cleaned_item = re.sub(regexp, '', cleaned_item)
+def get_curse_pages(db_file):
+    """Gets the fingerprint and mods for each Curse page from the previous run, and the time each page was downloaded.
 
-    # Regexp for removing all info enclosed in () at the start of the string, e.g. (0.90) etc
-    regexp = re.compile(r'^\(.*?\)')
-    cleaned_item = re.sub(regexp, '', cleaned_item)
+    Returns ({page: (fingerprint, mods)}, {page: fetched}), the time is 0 if not known.
+    """
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        rows = con.execute('SELECT Page, Fingerprint, Mods, Fetched FROM CursePages').fetchall()
+    pages = {page: (fingerprint, {mod_name: records.CurseMod(*mod) for mod_name, mod in json.loads(mods).items()})
+             for page, fingerprint, mods, fetched in rows}
+    return pages, {page: fetched or 0 for page, fingerprint, mods, fetched in rows}
 
-    # Regexp for removing all single and double quotes
-    regexp = re.compile(r'[\'\"]')
-    cleaned_item = re.sub(regexp, '', cleaned_item)
+def update_curse_pages(pages, fetched, db_file):
+    """Stores the fingerprint and mods for each Curse page, "pages" is a dict {page: (fingerprint, mods)}, and the
+    time each page was downloaded, "fetched" is a dict {page: fetched}.
+    """
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con as cur:
+            cur.execute('DELETE FROM CursePages')
+            cur.executemany('INSERT INTO CursePages (Page, Fingerprint, Mods, Fetched) '
+                            'VALUES (?, ?, ?, ?)',
+                            [(page, fingerprint, json.dumps({mod_name: mod.to_list() for mod_name, mod in mods.items()}),
+                              fetched.get(page))
+                             for page, (fingerprint, mods) in pages.items()])
 
-    # Strip leading and trailing whitespace again (after regexp cleaning)
-    cleaned_item = cleaned_item.strip()
+def format_time(timestamp):
+    """Returns a timestamp (seconds since the epoch) as a date and time in a human readable form."""
 
-    return cleaned_item
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
 def excepthook(excType, excValue, tracebackobj):
     """Rewritten "excepthook", to display a message box with details about the unhandled exception.
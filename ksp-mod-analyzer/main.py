@@ -2,28 +2,56 @@
     main.py
     --------------
     This is the main module of KSP Mod Analyzer. Implements the UI and business logic.
+
+    For a fast start, the window is shown before the database is opened and the network and parsing modules
+    (ckan, curse, spacedock) are only imported when a repository is updated for the first time.
+    Run with "--startup-profile" to print the time to show the window and to load the data, then exit.
 """
 
+import time
+
+# Start of the application, taken before the other modules are imported, for the startup profile
+START_TIME = time.perf_counter()
+
 import csv
 import os
 import sys
 import webbrowser
 
-import ckan
-import curse
+import database
+import diff
 import helpers
+import metrics
 import mvc
 import settings
-import spacedock
-from PyQt5 import QtCore, QtWidgets, QtSql
+import views
+import worker
+from PyQt5 import QtCore, QtGui, QtWidgets, QtSql
 from ui.mainwindow import Ui_MainWindow
 
 PROGRAM_VERSION = '1.1.1'
 DATA_DIR = 'data'
 
+# Database table for each repository
+TABLES = {'spacedock': 'SpaceDock',
+          'curse': 'Curse',
+          'ckan': 'CKAN'}
+
+# Number of refreshes shown in the 'Refresh timing' panel
+METRICS_SHOWN = 3
+
+# Number of QSqlQueryModel.fetchMore() calls (256 records each) between UI updates when loading the table
+FETCH_BATCHES = 20
+
+# Print the startup time and exit when the data has been loaded
+STARTUP_PROFILE = '--startup-profile' in sys.argv
+
 # DISK_CACHE = True disables web parsing and reads data from a previous run from disk (for debugging)
 DISK_CACHE = False
 
+# Max time (ms) to wait for the running threads to exit when closing the application
+CLOSE_TIMEOUT = 2000
+
 class KspModAnalyzer(QtWidgets.QMainWindow):
     """Creates the UI, based on PyQt5.
 
@@ -56,6 +84,7 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         # Define QSqlDatabase
         self.qt_db = QtSql.QSqlDatabase.addDatabase('QSQLITE')
         self.qt_db.setDatabaseName(self.db_file)
+        self.qt_db.setConnectOptions('QSQLITE_BUSY_TIMEOUT={}'.format(database.TIMEOUT * 1000))
 
         # Define custom delegate
         delegate = mvc.CustomDelegate()
@@ -81,27 +110,58 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         # Read saved UI configuration
         settings.read_settings(self.config, self.ui)
 
-        # Initialize database
-        helpers.init_database(self.db_file)
-
         # QThreads for fetching data from SpaceDock, Curse and CKAN
-        self.spacedock_thread = spacedock.SpacedockThread(db_file=self.db_file, use_cache=DISK_CACHE)
-        self.curse_thread = curse.CurseThread(db_file=self.db_file, use_cache=DISK_CACHE)
-        self.ckan_thread = ckan.CKANThread(db_file=self.db_file, use_cache=DISK_CACHE)
-
-        # Timers for cool down period to avoid sending to many requests to SpaceDock / Curse
-        self.spacedock_timer = QtCore.QTimer()
-        self.spacedock_cooldown = 60000
-        self.curse_timer = QtCore.QTimer()
-        self.curse_cooldown = 60000
+        self.spacedock_thread = worker.PipelineThread('spacedock', 'spacedock.SpacedockPipeline',
+                                                      db_file=self.db_file, use_cache=DISK_CACHE)
+        self.curse_thread = worker.PipelineThread('curse', 'curse.CursePipeline',
+                                                  db_file=self.db_file, use_cache=DISK_CACHE)
+        self.ckan_thread = worker.PipelineThread('ckan', 'ckan.CKANPipeline',
+                                                 db_file=self.db_file, use_cache=DISK_CACHE)
+        self.threads = {'spacedock': self.spacedock_thread,
+                        'curse': self.curse_thread,
+                        'ckan': self.ckan_thread}
+
+        # QThread refreshing all repositories together ("Update all" button)
+        self.update_all_thread = worker.OrchestratorThread(db_file=self.db_file, use_cache=DISK_CACHE)
+
+        # Repositories being updated, 'all' when updating all repositories together
+        self.updating = set()
+
+        # Timer for loading the records of the table in batches
+        self.fetch_timer = QtCore.QTimer()
+        self.fetch_timer.setSingleShot(True)
+        self.fetch_timer.timeout.connect(self.fetch_records)
 
         # Connect signals and slots and initialize UI values
         self.setup_ui_logic()
 
+        # The update buttons are enabled when the database has been initialized
+        for button in (self.ui.pushButtonSpacedock, self.ui.pushButtonCurse, self.ui.pushButtonCKAN,
+                       self.pushButtonUpdateAll):
+            button.setEnabled(False)
+
+        # Initialize the database and load the data when the window has been shown
+        QtCore.QTimer.singleShot(0, self.load_data)
+
+    def load_data(self):
+        """Initializes the database and loads the data, called when the window has been shown."""
+
+        if STARTUP_PROFILE:
+            print('Startup: window shown after {:.3f} s'.format(time.perf_counter() - START_TIME))
+
+        # Initialize database
+        helpers.init_database(self.db_file)
+
+        for button in (self.ui.pushButtonSpacedock, self.ui.pushButtonCurse, self.ui.pushButtonCKAN,
+                       self.pushButtonUpdateAll):
+            button.setEnabled(True)
+
+        # Update data model for the QTableView
+        self.update_db_model(self.ui.comboBoxSelectData.currentText())
+
         # Update 'Status' group box
         self.update_status()
 
-
     def setup_ui_logic(self):
         """Defines QT signal and slot connections and initializes UI values."""
 
@@ -117,6 +177,22 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         # Connect mouse hover over link event for updating status bar with URL
         self.ui.tableView.mouse_hover.connect(self.statusBar.showMessage)
 
+        # Add a panel showing where the last refreshes spent their time (not in "mainwindow.ui", created here)
+        self.metrics_text = QtWidgets.QPlainTextEdit()
+        self.metrics_text.setReadOnly(True)
+        self.metrics_text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.metrics_dock = QtWidgets.QDockWidget('Refresh timing', self)
+        self.metrics_dock.setObjectName('metricsDock')
+        self.metrics_dock.setWidget(self.metrics_text)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.metrics_dock)
+        self.update_metrics_panel()
+
+        # Add a button updating all repositories together (not in "mainwindow.ui", created here)
+        self.pushButtonUpdateAll = QtWidgets.QPushButton('Update all', self.ui.groupBoxUpdate)
+        self.pushButtonUpdateAll.setMinimumSize(QtCore.QSize(110, 0))
+        self.ui.gridLayout.addWidget(self.pushButtonUpdateAll, 3, 0, 1, 1)
+        self.pushButtonUpdateAll.clicked.connect(self.update_all)
+
         # Enable sorting indicator on columns
         self.ui.tableView.horizontalHeader().setSortIndicatorShown(True)
 
@@ -156,8 +232,10 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         self.curse_thread.notify_progress_signal.connect(lambda i: self.ui.progressBarCurse.setValue(i))
         self.ckan_thread.notify_progress_signal.connect(lambda i: self.ui.progressBarCKAN.setValue(i))
 
-        # Update data model for the QTableView
-        self.update_db_model(self.ui.comboBoxSelectData.currentText())
+        # Connect the signals of the thread updating all repositories
+        self.update_all_thread.exception_signal.connect(self.thread_exception_handling)
+        self.update_all_thread.finished_signal.connect(self.finished_update_all)
+        self.update_all_thread.notify_progress_signal.connect(lambda name, i: self.progress_bar(name).setValue(i))
 
     def export_csv(self):
         """Exports the current view to a CSV file."""
@@ -167,6 +245,10 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
                                                             QtCore.QDir.homePath() + "/" + suggested_filename + ".csv",
                                                             "CSV Files (*.csv)")
         if filename:
+            # Make sure all records have been loaded
+            while self.model.canFetchMore():
+                self.model.fetchMore()
+
             # Get rows and columns from data model
             rows = self.model.rowCount()
             columns = self.model.columnCount()
@@ -195,6 +277,8 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         self.ui.pushButtonSpacedock.clicked.connect(self.spacedock_thread.stop)
         self.ui.pushButtonSpacedock.setText('Cancel')
 
+        self.updating.add('spacedock')
+        self.update_buttons()
         self.spacedock_thread.start()
 
     def update_curse(self):
@@ -205,6 +289,8 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         self.ui.pushButtonCurse.clicked.connect(self.curse_thread.stop)
         self.ui.pushButtonCurse.setText('Cancel')
 
+        self.updating.add('curse')
+        self.update_buttons()
         self.curse_thread.start()
 
     def update_ckan(self):
@@ -215,37 +301,116 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         self.ui.pushButtonCKAN.clicked.connect(self.ckan_thread.stop)
         self.ui.pushButtonCKAN.setText('Cancel')
 
+        self.updating.add('ckan')
+        self.update_buttons()
         self.ckan_thread.start()
 
+    def update_all(self):
+        """Updates the UI and starts updating all repositories together."""
+
+        # Change functionality of "Update all" button to "Cancel"
+        self.pushButtonUpdateAll.disconnect()
+        self.pushButtonUpdateAll.clicked.connect(self.update_all_thread.stop)
+        self.pushButtonUpdateAll.setText('Cancel')
+
+        for name in TABLES:
+            self.progress_bar(name).setValue(0)
+
+        self.updating.add('all')
+        self.update_buttons()
+        self.update_all_thread.start()
+
+    def update_buttons(self):
+        """Enables the "Update all" button only when no single repository is being updated, and the button of each
+        repository only when not updating all repositories.
+        """
+
+        self.pushButtonUpdateAll.setEnabled(self.updating <= {'all'})
+        for button in (self.ui.pushButtonSpacedock, self.ui.pushButtonCurse, self.ui.pushButtonCKAN):
+            button.setEnabled('all' not in self.updating)
+
+    def progress_bar(self, name):
+        """Returns the progress bar of a repository."""
+
+        return {'spacedock': self.ui.progressBarSpacedock,
+                'curse': self.ui.progressBarCurse,
+                'ckan': self.ui.progressBarCKAN}[name]
+
     def finished_processing(self, sender):
         """Updates the UI and database model after threads have completed the run."""
 
-        # Update the data view
-        self.update_db_model(self.ui.comboBoxSelectData.currentText())
+        # Update the data view, measured as part of the refresh
+        with metrics.activate(self.threads[sender].pipeline.metrics):
+            with metrics.stage('model_reload'):
+                self.update_db_model(self.ui.comboBoxSelectData.currentText())
+
+        # Store the measurements of the refresh and show them
+        self.threads[sender].pipeline.metrics.write()
+        self.update_metrics_panel()
 
         # Update button functionality
         if sender == 'spacedock':
             self.ui.pushButtonSpacedock.disconnect()
             self.ui.pushButtonSpacedock.clicked.connect(self.update_spacedock)
             self.ui.pushButtonSpacedock.setText('Update SpaceDock')
-            self.ui.pushButtonSpacedock.setEnabled(False)
-            self.spacedock_timer.singleShot(self.spacedock_cooldown, lambda: self.ui.pushButtonSpacedock.setEnabled(True))
 
         if sender == 'curse':
             self.ui.pushButtonCurse.disconnect()
             self.ui.pushButtonCurse.clicked.connect(self.update_curse)
             self.ui.pushButtonCurse.setText('Update Curse')
-            self.ui.pushButtonCurse.setEnabled(False)
-            self.curse_timer.singleShot(self.spacedock_cooldown, lambda : self.ui.pushButtonCurse.setEnabled(True))
 
         if sender == 'ckan':
             self.ui.pushButtonCKAN.disconnect()
             self.ui.pushButtonCKAN.clicked.connect(self.update_ckan)
             self.ui.pushButtonCKAN.setText('Update CKAN')
 
+        self.updating.discard(sender)
+        self.update_buttons()
+
+        # Update 'Status' group box
+        self.update_status()
+
+        # Show what changed since the previous refresh, the full report is shown as a tooltip
+        result = diff.get_report(self.db_file, TABLES[sender])
+        if result:
+            self.statusBar.showMessage(diff.summary(TABLES[sender], result[1]))
+            self.statusBar.setToolTip(diff.format_report(TABLES[sender], result[1]))
+
+    def finished_update_all(self, results):
+        """Updates the UI and database model after all repositories have been updated (or cancelled)."""
+
+        # Update the data view once, if anything has changed, measured like the reload after a single repository
+        if 'changed' in results.values():
+            reload_metrics = metrics.Metrics('Update all')
+            with metrics.activate(reload_metrics), metrics.stage('model_reload'):
+                self.update_db_model(self.ui.comboBoxSelectData.currentText())
+            reload_metrics.write()
+
+        self.update_metrics_panel()
+
+        for name, result in results.items():
+            self.progress_bar(name).setValue(100 if result in ('changed', 'unchanged') else 0)
+
+        # Restore the "Update all" button
+        self.pushButtonUpdateAll.disconnect()
+        self.pushButtonUpdateAll.clicked.connect(self.update_all)
+        self.pushButtonUpdateAll.setText('Update all')
+
+        self.updating.discard('all')
+        self.update_buttons()
+
         # Update 'Status' group box
         self.update_status()
 
+        # Show the result of each repository, and what changed as a tooltip
+        self.statusBar.showMessage(', '.join('{}: {}'.format(TABLES[name], result) for name, result in results.items()))
+        reports = []
+        for name, result in results.items():
+            report = diff.get_report(self.db_file, TABLES[name])
+            if result == 'changed' and report:
+                reports.append(diff.format_report(TABLES[name], report[1]))
+        self.statusBar.setToolTip('\n\n'.join(reports))
+
     def cancelled_processing(self, sender):
         """Updates the UI after a cancellation."""
 
@@ -267,12 +432,22 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
             self.ui.pushButtonCKAN.clicked.connect(self.update_ckan)
             self.ui.pushButtonCKAN.setText('Update CKAN')
 
+        self.updating.discard(sender)
+        self.update_buttons()
+
         # Update 'Status' group box
         self.update_status()
 
         # Reset combo box in 'Data' view
         self.ui.comboBoxSelectData.setCurrentIndex(0)
 
+    def update_metrics_panel(self):
+        """Shows the time spent in each stage of the last refreshes in the 'Refresh timing' panel."""
+
+        entries = metrics.read(limit=METRICS_SHOWN)
+        text = '\n\n'.join(metrics.format_summary(entry) for entry in reversed(entries))
+        self.metrics_text.setPlainText(text or 'No refreshes yet')
+
     def update_db_model(self, query_type):
         """Updates the DB query used by the QTableView.
 
@@ -282,39 +457,17 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
             - After data collection from SpaceDock and/or Curse
         """
 
+        # Stop loading the records of the previous query, it's replaced
+        self.fetch_timer.stop()
+
         # Open the database
         # TODO: Investigate if a context manager can be used for QtSQL databases
         if not self.qt_db.open():
             raise Exception('Could not open QT database.')
 
-        # Define SQL queries
-        if query_type == 'All mods':
-            sql = 'SELECT Mod, Spacedock, Curse, CKAN, Source, Forum ' \
-                  'FROM Total'
-        elif query_type == 'All mods on SpaceDock':
-            sql = 'SELECT Mod, SpaceDock, Source, Forum ' \
-                  'FROM Total ' \
-                  'WHERE SpaceDock IS NOT NULL'
-        elif query_type == 'All mods on Curse':
-            sql = 'SELECT Mod, Curse, Source, Forum ' \
-                  'FROM Total ' \
-                  'WHERE Curse IS NOT NULL'
-        elif query_type == 'All mods on CKAN':
-            sql = 'SELECT Mod, CKAN, Source, Forum ' \
-                  'FROM Total ' \
-                  'WHERE CKAN IS NOT NULL'
-        elif query_type == 'Mods only on SpaceDock':
-            sql = 'SELECT Mod, SpaceDock, Source, Forum ' \
-                  'FROM Total ' \
-                  'WHERE Spacedock IS NOT NULL AND Curse IS NULL AND CKAN IS NULL'
-        elif query_type == 'Mods only on Curse':
-            sql = 'SELECT Mod, Curse, Source, Forum ' \
-                  'FROM Total ' \
-                  'WHERE Curse IS NOT NULL AND Spacedock IS NULL AND CKAN IS NULL'
-        elif query_type == 'Mods only on CKAN':
-            sql = 'SELECT Mod, CKAN, Source, Forum ' \
-                  'FROM Total ' \
-                  'WHERE CKAN IS NOT NULL AND Curse IS NULL AND Spacedock IS NULL'
+        # Get the SQL query of the view
+        if query_type in views.VIEWS:
+            sql = views.VIEWS[query_type]
         else:
             self.qt_db.close()
             raise Exception('Invalid query type: "' + query_type + '" for QTableView')
@@ -335,48 +488,60 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         # Disable strtch in last column
         self.ui.tableView.horizontalHeader().setStretchLastSection(False)
 
-        # Fetch all available records
-        while self.model.canFetchMore():
+        # Fetch the records in batches, so the window stays responsive while loading large tables
+        self.fetch_records()
+
+    def fetch_records(self):
+        """Fetches the next batch of records for the table, the database is closed when all records are fetched."""
+
+        for _ in range(FETCH_BATCHES):
+            if not self.model.canFetchMore():
+                break
             self.model.fetchMore()
 
         # Update number of mods displayed
         self.ui.labelNumberOfRecords.setText(str(self.model.rowCount()) + ' mods found')
 
-        # Close database
+        if self.model.canFetchMore():
+            self.fetch_timer.start(0)
+            return
+
+        # All records are fetched and kept by the model, SQLite has ended the read of the query at the last record.
+        # Close the database, so nothing is left open while a refresh writes to it. While fetching, the open read
+        # doesn't block the writers, as the database uses write-ahead logging (see database.py).
         self.qt_db.close()
 
+        if STARTUP_PROFILE:
+            print('Startup: {} records loaded after {:.3f} s'.format(self.model.rowCount(),
+                                                                     time.perf_counter() - START_TIME))
+            QtWidgets.QApplication.quit()
+
     def update_status(self):
         """Updates the data in 'Status' group box."""
 
-        # Check if SpaceDock data file exists and update UI accordingly
-        if os.path.isfile('data/spacedock.data'):
-            spacedock_records = helpers.get_records('SpaceDock', self.db_file)
-            spacedock_last_date = helpers.get_file_modification_time('data/spacedock.data')
-            self.ui.labelSpacedockMods.setText('<font color="Blue">' + str(spacedock_records))
-            self.ui.labelLastUpdateSpacedock.setText('<font color="Blue">' + str(spacedock_last_date))
-        else:
-            self.ui.labelSpacedockMods.setText('<font color="Red">---')
-            self.ui.labelLastUpdateSpacedock.setText('<font color="Red">---')
-
-        # Check if Curse data file exists and update UI accordingly
-        if os.path.isfile('data/curse.data'):
-            curse_records = helpers.get_records('Curse', self.db_file)
-            curse_last_date = helpers.get_file_modification_time('data/curse.data')
-            self.ui.labelCurseMods.setText('<font color="Blue">' + str(curse_records))
-            self.ui.labelLastUpdateCurse.setText('<font color="Blue">' + str(curse_last_date))
-        else:
-            self.ui.labelCurseMods.setText('<font color="Red">---')
-            self.ui.labelLastUpdateCurse.setText('<font color="Red">---')
-
-        # Check if CKAN data file exists and update UI accordingly
-        if os.path.isfile('data/master.tar.gz'):
-            ckan_records = helpers.get_records('CKAN', self.db_file)
-            ckan_last_date = helpers.get_file_modification_time('data/master.tar.gz')
-            self.ui.labelCKANMods.setText('<font color="Blue">' + str(ckan_records))
-            self.ui.labelLastUpdateCKAN.setText('<font color="Blue">' + str(ckan_last_date))
-        else:
-            self.ui.labelCKANMods.setText('<font color="Red">---')
-            self.ui.labelLastUpdateCKAN.setText('<font color="Red">---')
+        # Statistics of the last refresh of each repository, in one query
+        stats = helpers.get_refresh_stats(self.db_file)
+
+        for table, label_mods, label_date in (('SpaceDock', self.ui.labelSpacedockMods,
+                                               self.ui.labelLastUpdateSpacedock),
+                                              ('Curse', self.ui.labelCurseMods, self.ui.labelLastUpdateCurse),
+                                              ('CKAN', self.ui.labelCKANMods, self.ui.labelLastUpdateCKAN)):
+            if table in stats:
+                total_mods, last_time, duration, downloaded = stats[table]
+                label_mods.setText('<font color="Blue">' + str(total_mods or 0))
+                label_date.setText('<font color="Blue">' + helpers.format_time(last_time))
+
+                # Duration and download size of the refresh, if measured
+                tooltip = []
+                if duration is not None:
+                    tooltip.append('Updated in {:.1f} s'.format(duration))
+                if downloaded:
+                    tooltip.append('{:.1f} MB downloaded'.format(downloaded / 1024 / 1024))
+                label_date.setToolTip(', '.join(tooltip))
+            else:
+                label_mods.setText('<font color="Red">---')
+                label_date.setText('<font color="Red">---')
+                label_date.setToolTip('')
 
 
     def closeEvent(self, event):
@@ -384,18 +549,17 @@ class KspModAnalyzer(QtWidgets.QMainWindow):
         Called when closing the application window.
         """
 
-        # Stop the running threads
-        if self.spacedock_thread.isRunning():
-            print("Stopping SpaceDock thread...")
-            self.spacedock_thread.stop()
+        # Stop the running threads, all at once, then wait for them to exit
+        running = [thread for thread in list(self.threads.values()) + [self.update_all_thread] if thread.isRunning()]
+        for thread in running:
+            thread.stop()
+        for thread in running:
+            if not thread.wait(CLOSE_TIMEOUT):
+                print('Thread', thread.name, 'did not stop in time')
 
-        if self.curse_thread.isRunning():
-            print("Stopping Curse thread...")
-            self.curse_thread.stop()
-
-        if self.ckan_thread.isRunning():
-            print("Stopping CKAN thread...")
-            self.ckan_thread.stop()
+        # Stop loading the records
+        self.fetch_timer.stop()
+        self.qt_db.close()
 
         # Save UI settings
         settings.save_settings(self.config, self.ui)
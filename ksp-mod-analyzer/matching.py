@@ -0,0 +1,264 @@
+"""
+    matching.py
+    -----------
+    Implements matching of mod names between SpaceDock, Curse and CKAN, where the same mod may have slightly
+    different names, e.g. "Kerbal Engineer Redux" and "KerbalEngineer Redux".
+
+    Names are only renamed automatically on hard keys (e.g. the SpaceDock id of a CKAN mod) and on the same match key
+    (lower case letters and digits only). Similar names that are not the same, e.g. "Toolbar Controller" and
+    "ToolbarControl", are distinct mods as often as they are the same mod, so these are not renamed but stored as
+    candidates in the 'MatchCandidates' table for review.
+
+    Comparing every name with every other name to find the candidates is too slow for large repositories, so the
+    names are first put in blocks and only names in the same block are compared: names with similar character
+    trigrams end up in the same block (MinHash with LSH banding), these are then scored. Candidates where one name
+    has a whole word or number more or less than the other (e.g. "Universal Storage" and "Universal Storage II")
+    are different mods and are rejected.
+
+    Usage (shows the candidates of the last update of 'Total'):
+        python3 ksp-mod-analyzer/matching.py
+"""
+
+import contextlib
+import difflib
+import re
+import zlib
+from collections import defaultdict
+
+import database
+
+# Number of MinHash bands and rows per band, candidates must have all rows equal in at least one band.
+# Names with a trigram similarity (Jaccard) above approximately (1 / BANDS) ** (1 / ROWS) end up in the same block.
+BANDS = 6
+ROWS = 3
+
+# Min similarity (0-1) of the match keys for two names to be reported as a candidate
+MIN_SIMILARITY = 0.9
+
+# Blocks larger than this are skipped when finding candidates (common trigrams, not useful for matching)
+MAX_BLOCK_SIZE = 100
+
+# Random coefficients for the MinHash permutations, fixed so the result is the same for each run
+_PRIME = (1 << 31) - 1
+_COEFFICIENTS = [(1103515245 * (i + 1) % _PRIME, 12345 * (i + 7) % _PRIME) for i in range(BANDS * ROWS)]
+
+RE_NON_ALNUM = re.compile(r'[\W_]+')
+RE_DIGITS = re.compile(r'\d+')
+RE_TOKEN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+RE_ROMAN = re.compile(r'^[ivxl]+$')
+RE_SPACEDOCK_ID = re.compile(r'spacedock\.info/mod/(\d+)')
+
+
+def match_key(name):
+    """Returns the key used for matching, e.g. "Kerbal Engineer Redux" -> "kerbalengineerredux"."""
+
+    return RE_NON_ALNUM.sub('', name.lower())
+
+def tokens(name):
+    """Returns the words and numbers in a name, e.g. "KerbalEngineer Redux 2" -> ["kerbal", "engineer", "redux", "2"].
+
+    Words in CamelCase are split, so names with and without spaces between the words have the same words.
+    """
+
+    return [token.lower() for token in RE_TOKEN.findall(name)]
+
+def numerals(words):
+    """Returns the numbers in a list of words, also Roman numerals, e.g. ["storage", "ii", "2"] -> ["ii", "2"]."""
+
+    return [word for word in words if word.isdigit() or RE_ROMAN.match(word)]
+
+def same_words(name, other_name):
+    """Returns False if one name has a whole word or number more or less than the other name, or other numbers."""
+
+    words = tokens(name)
+    other_words = tokens(other_name)
+    return len(words) == len(other_words) and numerals(words) == numerals(other_words)
+
+def spacedock_id(url):
+    """Returns the SpaceDock mod id from a SpaceDock URL, e.g. "https://spacedock.info/mod/123/Name" -> 123.
+
+    Returns None if it's not a link to a SpaceDock mod.
+    """
+
+    match = RE_SPACEDOCK_ID.search(url or '')
+    return int(match.group(1)) if match else None
+
+
+class MatchIndex:
+    """Index of canonical mod names, for finding the best matching canonical name for other names.
+
+    The LSH blocks are only built when first needed for finding similar names ("candidate"), matching on the match
+    key ("match") doesn't need them.
+    """
+
+    def __init__(self, names):
+        # Canonical name for each match key, and the match key for each name
+        self.names_by_key = {}
+        self.keys = {}
+
+        # LSH blocks, (band, band hash) -> list of match keys, built on first use
+        self._blocks = None
+
+        # Cache of the hash values for each trigram
+        self._trigram_hashes = {}
+
+        for name in names:
+            key = match_key(name)
+            self.keys[name] = key
+            if key and key not in self.names_by_key:
+                self.names_by_key[key] = name
+
+    @property
+    def blocks(self):
+        """LSH blocks of the match keys of the canonical names, built on first use."""
+
+        if self._blocks is None:
+            self._blocks = defaultdict(list)
+            for key in self.names_by_key:
+                for band in self.bands(key):
+                    self._blocks[band].append(key)
+        return self._blocks
+
+    def trigram_hashes(self, trigram):
+        """Returns the hash value of a trigram for each MinHash permutation."""
+
+        hashes = self._trigram_hashes.get(trigram)
+        if hashes is None:
+            h = zlib.crc32(trigram.encode('utf-8'))
+            hashes = tuple((a * h + b) % _PRIME for a, b in _COEFFICIENTS)
+            self._trigram_hashes[trigram] = hashes
+        return hashes
+
+    def bands(self, key):
+        """Returns the LSH band keys for a match key."""
+
+        trigrams = {key[i:i + 3] for i in range(max(1, len(key) - 2))}
+
+        # MinHash signature, the min hash value of all trigrams for each permutation
+        signature = [min(column) for column in zip(*(self.trigram_hashes(trigram) for trigram in trigrams))]
+
+        return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+    def candidates(self, key):
+        """Returns the match keys in the same blocks as "key"."""
+
+        candidates = set()
+        for band in self.bands(key):
+            block = self.blocks.get(band, ())
+            if len(block) <= MAX_BLOCK_SIZE:
+                candidates.update(block)
+        return candidates
+
+    def match(self, name):
+        """Returns the canonical name with the same match key, or None if there is none."""
+
+        return self.names_by_key.get(match_key(name))
+
+    def candidate(self, name):
+        """Returns (canonical name, score) of the most similar canonical name, or None if there is none.
+
+        The numbers and the number of words in the names must be the same, e.g. "Mod Pack 10" is not the same mod as
+        "Mod Pack 11", and "Universal Storage" is not the same mod as "Universal Storage II".
+        """
+
+        key = match_key(name)
+        if not key:
+            return None
+
+        digits = RE_DIGITS.findall(key)
+        best = None
+        best_score = MIN_SIMILARITY
+        matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+        for candidate in self.candidates(key):
+            if candidate == key or RE_DIGITS.findall(candidate) != digits:
+                continue
+
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_score or matcher.quick_ratio() < best_score:
+                continue
+
+            score = matcher.ratio()
+            if score >= best_score and same_words(name, self.names_by_key[candidate]):
+                best = (self.names_by_key[candidate], score)
+                best_score = score
+
+        return best
+
+def match_names(names, canonical_names, hard_keys=None):
+    """Matches "names" to "canonical_names", returns a dict {name: canonical name} for the names to rename.
+
+    "hard_keys" is an optional dict {name: canonical name} from e.g. ids, used before matching on the match key.
+    Names that exist in "canonical_names" are never renamed, and each canonical name is used for at most one name.
+    Similar names are not renamed, see "find_candidates".
+    """
+
+    hard_keys = hard_keys or {}
+    canonical_names = set(canonical_names)
+    index = MatchIndex(sorted(canonical_names))
+
+    # Canonical names already used, by an identical name or by an earlier match
+    taken = canonical_names.intersection(names)
+
+    renamed = {}
+    for name in sorted(names):
+        if name in canonical_names:
+            continue
+
+        canonical_name = hard_keys.get(name)
+        if canonical_name not in canonical_names:
+            canonical_name = index.match(name)
+
+        if canonical_name and canonical_name not in taken:
+            taken.add(canonical_name)
+            renamed[name] = canonical_name
+
+    return renamed
+
+def find_candidates(names, canonical_names, renamed=None):
+    """Finds similar canonical names for the names not in "canonical_names" and not in "renamed" (the result of
+    "match_names"), returns a list of (name, canonical name, score), sorted by name.
+    """
+
+    renamed = renamed or {}
+    canonical_names = set(canonical_names)
+    index = MatchIndex(sorted(canonical_names - set(renamed.values())))
+
+    candidates = []
+    for name in sorted(names):
+        if name in canonical_names or name in renamed:
+            continue
+
+        candidate = index.candidate(name)
+        if candidate:
+            candidates.append((name, candidate[0], round(candidate[1], 3)))
+
+    return candidates
+
+def init_candidates(cur):
+    """Creates the 'MatchCandidates' table if it doesn't exist."""
+
+    cur.execute('CREATE TABLE IF NOT EXISTS MatchCandidates '
+                '(Source TEXT, Mod TEXT, Candidate TEXT, Score REAL)')
+
+def record_candidates(cur, source, candidates):
+    """Stores the candidates of the names of a repository ("source"), replacing those of the previous update."""
+
+    init_candidates(cur)
+    cur.execute('DELETE FROM MatchCandidates WHERE Source = ?', (source,))
+    cur.executemany('INSERT INTO MatchCandidates (Source, Mod, Candidate, Score) VALUES (?, ?, ?, ?)',
+                    [(source,) + tuple(candidate) for candidate in candidates])
+
+def get_candidates(db_file):
+    """Returns the candidates of the last update of 'Total', as a list of (source, name, canonical name, score)."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        cur = con.cursor()
+        init_candidates(cur)
+        cur.execute('SELECT Source, Mod, Candidate, Score FROM MatchCandidates ORDER BY Source, Mod')
+        return cur.fetchall()
+
+if __name__ == "__main__":
+    rows = get_candidates('data/database.db')
+    print('{} similar mod names, not merged in Total:'.format(len(rows)))
+    for source, name, candidate, score in rows:
+        print('    {}: "{}" ~ "{}" ({:.2f})'.format(source, name, candidate, score))
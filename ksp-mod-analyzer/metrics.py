@@ -0,0 +1,178 @@
+"""
+    metrics.py
+    -----------
+    Implements timing instrumentation of a refresh: wall clock and CPU time, bytes, rows and items (pages, files)
+    for each stage, e.g. HTTP fetch, decode, parse, normalize, DB write, Total merge and model reload.
+
+    A refresh collects its measurements in a 'Metrics' object, which is made active for the threads working on that
+    refresh (the pipeline does this for all its threads). Code anywhere in the refresh then records measurements with
+    "stage" without having a reference to the object; nothing is recorded when no object is active.
+    When the refresh is done the measurements are appended as one JSON line to METRICS_FILE.
+
+    Usage (shows the last refreshes):
+        python3 ksp-mod-analyzer/metrics.py [number of refreshes]
+"""
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+METRICS_FILE = 'data/metrics.jsonl'
+
+# Counters that are shown in the summary, in this order
+COUNTERS = ('items', 'bytes', 'rows', 'requests')
+
+# The active 'Metrics' object of each thread
+_local = threading.local()
+
+
+class Metrics:
+    """Measurements of one refresh, for each stage the number of calls, wall clock and CPU time and counters."""
+
+    def __init__(self, source):
+        self.source = source
+        self.time = time.time()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, wall=0.0, cpu=0.0, calls=1, parent=None, **counts):
+        """Adds a measurement to a stage, called from any thread.
+
+        "parent" is the stage the measurement was taken in, if any, e.g. 'http' in the 'fetch' stage of a pipeline.
+        """
+
+        with self._lock:
+            values = self.stages.get(stage)
+            if values is None:
+                values = self.stages[stage] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0}
+            if parent is not None:
+                values.setdefault('parent', parent)
+            values['calls'] += calls
+            values['wall'] += wall
+            values['cpu'] += cpu
+            for name, value in counts.items():
+                values[name] = values.get(name, 0) + value
+
+    def elapsed(self):
+        """Returns the wall clock time since the start of the refresh."""
+
+        return time.perf_counter() - self.start
+
+    def total(self, counter):
+        """Returns the sum of a counter over all stages, e.g. total('bytes')."""
+
+        with self._lock:
+            return sum(values.get(counter, 0) for values in self.stages.values())
+
+    def to_dict(self):
+        """Returns the measurements as a dict, e.g. for writing to the metrics file."""
+
+        with self._lock:
+            return {'source': self.source,
+                    'time': self.time,
+                    'wall': self.elapsed(),
+                    'stages': {stage: dict(values) for stage, values in self.stages.items()}}
+
+    def write(self, file_name=METRICS_FILE):
+        """Appends the measurements as a JSON line to the metrics file."""
+
+        os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+        with open(file_name, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.to_dict()) + '\n')
+
+
+def current():
+    """Returns the active 'Metrics' object of this thread, or None."""
+
+    return getattr(_local, 'metrics', None)
+
+@contextlib.contextmanager
+def activate(metrics):
+    """Makes "metrics" the active 'Metrics' object of this thread within the "with" block."""
+
+    previous = current()
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _local.metrics = previous
+
+@contextlib.contextmanager
+def stage(name, **counts):
+    """Measures the wall clock and CPU time of the "with" block as stage "name".
+
+    Yields a dict of counters that the block can update, e.g. counts['bytes'] = len(data).
+    A stage measured within another stage of the same thread is recorded with that stage as its parent.
+    """
+
+    counts = dict(counts)
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+
+    # Stages running in this thread, the innermost last
+    running = getattr(_local, 'stages', None)
+    if running is None:
+        running = _local.stages = []
+    running.append(name)
+    try:
+        yield counts
+    finally:
+        running.pop()
+        metrics = current()
+        if metrics is not None:
+            metrics.add(name, time.perf_counter() - start_wall, time.thread_time() - start_cpu,
+                        parent=running[-1] if running else None, **counts)
+
+def read(file_name=METRICS_FILE, limit=None):
+    """Returns the last "limit" (all if None) refreshes from the metrics file, oldest first."""
+
+    try:
+        with open(file_name, encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+
+    if limit is not None:
+        lines = lines[-limit:]
+    return [json.loads(line) for line in lines if line.strip()]
+
+def format_summary(entry):
+    """Returns a table with the time spent in each stage of a refresh, as read from the metrics file.
+
+    The time of a stage with several workers is the sum over all workers, so it can be more than the refresh.
+    Stages measured within another stage (e.g. 'http' within 'fetch') are listed indented below it, without a share
+    of the refresh, as their time is already part of the time of that stage.
+    """
+
+    lines = ['{} {} ({:.1f} s)'.format(datetime.fromtimestamp(entry['time']).strftime('%Y-%m-%d %H:%M'),
+                                       entry['source'], entry['wall']),
+             '    {:12} {:>6} {:>9} {:>9} {:>6}  {}'.format('Stage', 'Calls', 'Wall (s)', 'CPU (s)', '%', 'Counters')]
+
+    # Child stages of each stage, a stage whose parent wasn't recorded is listed as a top level stage
+    stages = entry['stages']
+    children = defaultdict(list)
+    for name, values in stages.items():
+        children[values.get('parent') if values.get('parent') in stages else None].append(name)
+
+    def add_lines(parent, depth):
+        for name in sorted(children[parent], key=lambda stage: -stages[stage]['wall']):
+            values = stages[name]
+            share = '{:6.0f}'.format(100 * values['wall'] / entry['wall'] if entry['wall'] else 0) if not depth else ''
+            counters = ', '.join('{} {}'.format(values[counter], counter) for counter in COUNTERS if counter in values)
+            lines.append('    {:12} {:6} {:9.2f} {:9.2f} {:>6}  {}'.format(
+                '  ' * depth + name, values['calls'], values['wall'], values['cpu'], share, counters))
+            add_lines(name, depth + 1)
+
+    add_lines(None, 0)
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    for entry in read(limit=int(sys.argv[1]) if len(sys.argv) > 1 else 3):
+        print(format_summary(entry))
+        print()
@@ -165,8 +165,8 @@ class CustomProxy(QtCore.QSortFilterProxyModel):
         l = left.data()
         r = right.data()
 
-        m_left = re.search(self.regexp, l)
-        m_right = re.search(self.regexp, r)
+        m_left = self.regexp.search(l)
+        m_right = self.regexp.search(r)
 
         if m_left and m_right:
            lvalue = m_left.group(1)
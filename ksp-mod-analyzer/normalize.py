@@ -0,0 +1,44 @@
+"""
+    normalize.py
+    -----------
+    Implements normalization of mod names from SpaceDock, Curse and CKAN.
+
+    The same names are cleaned many times during a refresh (e.g. once for each version of a CKAN mod),
+    so the regexp is compiled once and the results are cached.
+"""
+
+import functools
+import re
+
+# Max number of cleaned names to keep in the cache
+CACHE_SIZE = 65536
+
+# One regexp doing all cleaning in a single pass:
+#   - Info enclosed in [] at the start of the string, e.g. [1.0.5], [1.x] etc, optionally followed by
+#     info enclosed in () e.g. (0.90)
+#   - Info enclosed in () at the start of the string
+#   - All single and double quotes
+RE_CLEAN = re.compile(r'^(?:\[.*?\](?:\(.*?\))?|\(.*?\))|[\'"]')
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def clean_item(item):
+    """Cleans an item (string):
+       - Remove leading and trailing whitespace
+       - Remove leading version info, e.g. [x.y.z], [1.2], (0.90)
+       - Remove all single and double quotes
+    """
+
+    return RE_CLEAN.sub('', item.strip()).strip()
+
+def clean_items(items):
+    """Cleans a list of items, returns a list of cleaned items in the same order.
+
+    Repeated items are only cleaned once.
+    """
+
+    cleaned = {}
+    for item in items:
+        if item not in cleaned:
+            cleaned[item] = clean_item(item)
+    return [cleaned[item] for item in items]
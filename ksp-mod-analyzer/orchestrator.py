@@ -0,0 +1,209 @@
+"""
+    orchestrator.py
+    -----------
+    Implements refreshing the repositories together, on demand (e.g. the "Update all" button) or on a schedule
+    (e.g. the daemon, see daemon.py).
+
+    The pipelines of the repositories run concurrently, and the 'Total' table is updated once when all of them are
+    done, instead of once for each repository. Repositories where nothing has changed since the previous refresh
+    (e.g. the CKAN-meta tarball answered '304 Not Modified', or all Curse pages were unchanged) don't cause an
+    update of 'Total', and when nothing has changed at all 'Total' is not updated.
+
+    On a schedule, each repository has its own refresh interval, counted from its previous refresh, so the
+    repositories are refreshed at different times and those due at the same time are refreshed together.
+
+    Usage (refreshes the repositories that are due, or the given repositories, or keeps refreshing on a schedule):
+        python3 ksp-mod-analyzer/orchestrator.py [--all | --schedule | spacedock curse ckan]
+"""
+
+import os
+import sys
+import threading
+import time
+
+import headless
+import helpers
+import metrics
+import pipeline
+
+# Default time between refreshes of each repository (seconds)
+INTERVALS = {'spacedock': 6 * 3600,
+             'curse': 12 * 3600,
+             'ckan': 3 * 3600}
+
+
+class Orchestrator:
+    """Refreshes the repositories concurrently, with a single update of the 'Total' table.
+
+    Events are sent to subscribed observers as callback(kind, name, value), "name" is the repository:
+        - 'started', name, None: The pipeline of a repository has started
+        - 'progress', name, value: Progress (0-100) of a repository
+        - 'finished', name, changed: A repository is done, "changed" is False if nothing has changed
+        - 'cancelled', name, None: A repository was cancelled
+        - 'error', name, exception: A repository failed
+        - 'total', None, names: The 'Total' table was updated with the changes in the repositories in "names"
+    """
+
+    def __init__(self, db_file, intervals=None, use_cache=False):
+        self.db_file = db_file
+        self.intervals = dict(INTERVALS, **(intervals or {}))
+        self.use_cache = use_cache
+
+        # Time of the previous refresh of each repository (also a failed one), from the database at start
+        self.last_refresh = {}
+        stats = helpers.get_refresh_stats(db_file)
+        for name, table in headless.TABLES.items():
+            if table in stats and stats[table][1]:
+                self.last_refresh[name] = stats[table][1]
+
+        # Pipelines of the running refresh, by repository
+        self.pipelines = {}
+
+        self._observers = []
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Registers an observer, called as callback(kind, name, value) for each event."""
+
+        self._observers.append(callback)
+
+    def notify(self, kind, name=None, value=None):
+        """Sends an event to all observers."""
+
+        for callback in self._observers:
+            callback(kind, name, value)
+
+    def next_refresh(self, name):
+        """Returns the time when a repository is due for a refresh."""
+
+        return self.last_refresh.get(name, 0) + self.intervals[name]
+
+    def due(self, now=None):
+        """Returns the names of the repositories due for a refresh."""
+
+        now = time.time() if now is None else now
+        return [name for name in headless.PIPELINES if self.next_refresh(name) <= now]
+
+    def refresh(self, names=None):
+        """Refreshes the repositories in "names" (default all) concurrently, then updates the 'Total' table once if
+        anything has changed. Returns a dict {name: result}, the result is 'changed', 'unchanged', 'cancelled' or
+        the exception raised by the pipeline.
+        """
+
+        names = list(headless.PIPELINES) if names is None else names
+        results = {}
+
+        threads = []
+        with self._lock:
+            for name in names:
+                instance = headless.PIPELINES[name](self.db_file, self.use_cache)
+                instance.subscribe(self.forward_event(name))
+                self.pipelines[name] = instance
+                threads.append(threading.Thread(target=self.run_pipeline, args=(name, instance, results),
+                                                daemon=True))
+
+            # Stopped before the refresh started
+            if self._stopped.is_set():
+                for instance in self.pipelines.values():
+                    instance.stop()
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with self._lock:
+            self.pipelines = {}
+
+        # Update 'Total' once for all repositories with changes
+        changed = [name for name in names if results[name] == 'changed']
+        if changed:
+            total_metrics = metrics.Metrics('Total')
+            with metrics.activate(total_metrics):
+                helpers.update_total_mods(self.db_file)
+            total_metrics.write()
+            self.notify('total', None, changed)
+        else:
+            print('No changes, table Total not updated')
+
+        return {name: results[name] for name in names}
+
+    def run_pipeline(self, name, instance, results):
+        """Thread target, runs the pipeline of one repository and stores the result."""
+
+        self.notify('started', name)
+        try:
+            instance.run()
+            results[name] = 'changed' if instance.changed else 'unchanged'
+            self.notify('finished', name, instance.changed)
+        except pipeline.Cancelled:
+            results[name] = 'cancelled'
+            self.notify('cancelled', name)
+        except Exception as e:
+            results[name] = e
+            self.notify('error', name, e)
+        finally:
+            self.last_refresh[name] = time.time()
+            instance.metrics.write()
+
+    def forward_event(self, name):
+        """Returns an observer of the pipeline of a repository, forwarding its progress."""
+
+        def forward(kind, value):
+            if kind == 'progress':
+                self.notify('progress', name, value)
+        return forward
+
+    def stop(self):
+        """Stops the running refresh and the schedule, does not wait for them."""
+
+        with self._lock:
+            self._stopped.set()
+            for instance in self.pipelines.values():
+                instance.stop()
+
+    def run_schedule(self, callback=None):
+        """Refreshes the repositories when they are due until stopped, "callback" is called with the results of
+        each refresh.
+        """
+
+        while not self._stopped.is_set():
+            names = self.due()
+            if names:
+                results = self.refresh(names)
+                if callback:
+                    callback(results)
+                continue
+
+            # Wait until the next repository is due
+            delay = min(self.next_refresh(name) for name in headless.PIPELINES) - time.time()
+            self._stopped.wait(max(0, delay))
+
+
+def print_event(kind, name, value):
+    """Prints orchestrator events to stdout, except progress."""
+
+    if kind != 'progress':
+        print('Refresh', kind, name or '', '' if value is None else value)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    for name in args:
+        if name not in headless.PIPELINES and name not in ('--all', '--schedule'):
+            sys.exit('Unknown repository "' + name + '", valid names are: ' + ', '.join(headless.PIPELINES.keys()))
+
+    os.makedirs(headless.DATA_DIR, exist_ok=True)
+    helpers.init_database(headless.DB_FILE)
+
+    orchestrator = Orchestrator(headless.DB_FILE)
+    orchestrator.subscribe(print_event)
+
+    if '--schedule' in args:
+        try:
+            orchestrator.run_schedule()
+        except KeyboardInterrupt:
+            orchestrator.stop()
+    else:
+        names = list(headless.PIPELINES) if '--all' in args else [name for name in args if name in headless.PIPELINES]
+        print(orchestrator.refresh(names or orchestrator.due()))
@@ -0,0 +1,318 @@
+"""
+    pipeline.py
+    -----------
+    Implements a pipeline engine for fetching and processing mod data, independent of QT.
+
+    A pipeline consists of a source (e.g. the list of pages to fetch), a number of stages (e.g. fetch, parse
+    and normalize) and a final store step. Each stage runs in one or more threads and the stages are connected by
+    bounded queues, so network I/O and parsing overlap while memory usage is kept bounded (a stage blocks when the
+    queue to the next stage is full).
+
+    Progress is reported as events to subscribed observers, e.g. the QThread updating the progress bars in the UI,
+    or a simple print function when running headless.
+
+    The time spent in the source and each stage is recorded in "self.metrics" (see metrics.py), and "stop" cancels
+    "self.cancel_token" (see cancel.py), which also aborts the network calls in progress in any of the threads.
+"""
+
+import queue
+import threading
+
+import cancel
+import metrics
+
+# Default max number of items waiting in the queue between two stages
+QUEUE_SIZE = 8
+
+# How often (in seconds) a blocked stage checks if the pipeline has been stopped
+POLL_INTERVAL = 0.1
+
+# Put on a queue by a stage when there are no more items
+_DONE = object()
+
+# Passed on instead of an item that was dropped by a stage, needed to keep track of the item order
+_SKIP = object()
+
+# Raised when the pipeline has been stopped
+Cancelled = cancel.Cancelled
+
+
+class Stage:
+    """A processing stage in the pipeline.
+
+    "func" is called with each item from the previous stage and returns the item for the next stage.
+    If "func" returns None, the item is dropped.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class Pipeline:
+    """Base class for all pipelines.
+
+    Subclasses define the stages in "self.stages" and implement:
+        - source(): Generator yielding the items to process
+        - store(item): Called for each processed item (in the calling thread of "run")
+        - finish(): Called when all items have been stored, the return value is returned by "run"
+
+    Subclasses set "self.changed" to False if the run found no changes since the previous run, e.g. the orchestrator
+    then doesn't update the 'Total' table (see orchestrator.py).
+    """
+
+    # Name of the pipeline, used in log messages
+    name = 'Pipeline'
+
+    # If True, items are passed to "store" in the same order as yielded by "source"
+    ordered = False
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.stages = []
+        self.queue_size = queue_size
+
+        # Total number of items, set by the source if known, used for calculating progress
+        self.total = 0
+
+        # Number of items stored
+        self.done = 0
+
+        # Set to False if nothing has changed since the previous run
+        self.changed = True
+
+        # Measurements of the current run, active in all threads of the pipeline
+        self.metrics = metrics.Metrics(self.name)
+
+        # Cancelled by "stop", active in all threads of the pipeline
+        self.cancel_token = cancel.CancelToken(self.name)
+        self._started = False
+
+        self._observers = []
+        self._error = None
+        self._lock = threading.Lock()
+
+    def source(self):
+        """Yields the items to process, must be implemented by the subclass."""
+
+        raise NotImplementedError
+
+    def store(self, item):
+        """Stores a processed item, must be implemented by the subclass."""
+
+        raise NotImplementedError
+
+    def finish(self):
+        """Called after all items have been stored."""
+
+        return None
+
+    def subscribe(self, callback):
+        """Registers an observer, called as callback(kind, value) for each event."""
+
+        self._observers.append(callback)
+
+    def notify(self, kind, value=None):
+        """Sends an event to all observers."""
+
+        for callback in self._observers:
+            callback(kind, value)
+
+    def progress(self, value):
+        """Reports progress (0-100)."""
+
+        self.notify('progress', int(value))
+
+    def stop(self):
+        """Stops the pipeline, all stages will exit as soon as possible, does not wait for them."""
+
+        self.cancel_token.cancel()
+
+    @property
+    def running(self):
+        return not self.cancel_token.cancelled
+
+    def check(self):
+        """Raises 'Cancelled' if the pipeline has been stopped, called by long running stages."""
+
+        self.cancel_token.check()
+
+    def run(self):
+        """Runs the pipeline until all items have been processed.
+
+        Raises 'Cancelled' if the pipeline was stopped, or the first exception raised by any of the stages.
+        """
+
+        # Each run has its own token, a pipeline stopped before its first run is cancelled at once
+        if self._started:
+            self.cancel_token = cancel.CancelToken(self.name)
+        self._started = True
+        self._error = None
+        self.total = 0
+        self.done = 0
+        self.changed = True
+        self.metrics = metrics.Metrics(self.name)
+
+        # One queue between the source and the first stage, and one after each stage
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._run_stage,
+                                                args=(stage, queues[i], queues[i + 1], remaining),
+                                                daemon=True))
+
+        self.notify('started')
+        for thread in threads:
+            thread.start()
+
+        with metrics.activate(self.metrics), cancel.activate(self.cancel_token):
+            try:
+                self._run_store(queues[-1])
+            except Cancelled:
+                pass
+            except Exception as e:
+                self._set_error(e)
+            finally:
+                # Make sure all threads exit, e.g. if the store step failed
+                if self._error:
+                    self.stop()
+                for thread in threads:
+                    thread.join()
+
+            if self._error:
+                self.notify('error', self._error)
+                raise self._error
+
+            if not self.running:
+                self.notify('cancelled')
+                raise Cancelled(self.name)
+
+            with metrics.stage('finish'):
+                result = self.finish()
+
+        self.notify('finished')
+        return result
+
+    def _set_error(self, error):
+        """Stores the first exception raised in any stage and stops the pipeline.
+
+        Errors after the pipeline has been stopped are ignored, e.g. a network call failing when it's aborted.
+        """
+
+        with self._lock:
+            if self._error is None and self.running:
+                self._error = error
+        self.stop()
+
+    def _put(self, q, item):
+        """Puts an item on the queue, waits while the queue is full unless the pipeline is stopped."""
+
+        while True:
+            self.check()
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        """Gets an item from the queue, waits while the queue is empty unless the pipeline is stopped."""
+
+        while True:
+            self.check()
+            try:
+                return q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+    def _run_source(self, q_out):
+        """Thread target for the source, each item is tagged with a sequence number."""
+
+        try:
+            with metrics.activate(self.metrics), cancel.activate(self.cancel_token):
+                items = iter(self.source())
+                seq = 0
+                while True:
+                    # Only the time spent in the source is measured, not the time waiting for the next stage
+                    with metrics.stage('source') as counts:
+                        item = next(items, _DONE)
+                        counts['items'] = 0 if item is _DONE else 1
+                    if item is _DONE:
+                        break
+                    self._put(q_out, (seq, item))
+                    seq += 1
+            self._put(q_out, _DONE)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self._set_error(e)
+
+    def _run_stage(self, stage, q_in, q_out, remaining):
+        """Thread target for a stage worker."""
+
+        try:
+            with metrics.activate(self.metrics), cancel.activate(self.cancel_token):
+                self._process(stage, q_in, q_out, remaining)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self._set_error(e)
+
+    def _process(self, stage, q_in, q_out, remaining):
+        """Processes items until the previous stage is done."""
+
+        while True:
+            msg = self._get(q_in)
+
+            if msg is _DONE:
+                # Put the marker back for the other workers of this stage,
+                # the last worker to finish passes it on to the next stage
+                self._put(q_in, _DONE)
+                with self._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._put(q_out, _DONE)
+                return
+
+            seq, item = msg
+            if item is not _SKIP:
+                with metrics.stage(stage.name, items=1):
+                    item = stage.func(item)
+                if item is None:
+                    item = _SKIP
+            self._put(q_out, (seq, item))
+
+    def _run_store(self, q_in):
+        """Passes all items from the last stage to "store", in source order if "ordered" is set."""
+
+        pending = {}
+        next_seq = 0
+
+        while True:
+            msg = self._get(q_in)
+            if msg is _DONE:
+                break
+
+            if not self.ordered:
+                self._store(msg[1])
+                continue
+
+            # Keep items that arrive too early until all previous items have been stored
+            pending[msg[0]] = msg[1]
+            while next_seq in pending:
+                self._store(pending.pop(next_seq))
+                next_seq += 1
+
+    def _store(self, item):
+        """Stores one item and updates progress."""
+
+        if item is not _SKIP:
+            self.store(item)
+
+        self.done += 1
+        if self.total:
+            self.progress(min(100, 100 * self.done / self.total))
@@ -0,0 +1,134 @@
+"""
+    ratelimit.py
+    -----------
+    Implements an adaptive rate limiter per host, used by the HTTP core (fetch.py) to avoid sending too many
+    requests to SpaceDock, Curse and GitHub.
+
+    Each host has a token bucket. The request rate is increased step by step while the host responds quickly, and
+    decreased when the response time goes up or the host answers with 429 (Too Many Requests) or 503 (Service
+    Unavailable). Failed requests are retried after the time given by the 'Retry-After' header, or else with an
+    exponential backoff with random jitter.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Initial and allowed range of requests per second to each host
+INITIAL_RATE = 4.0
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+
+# Max number of requests that can be sent at once after an idle period
+BURST = 4
+
+# Responses slower than this (seconds) decrease the rate
+TARGET_LATENCY = 2.0
+
+# Rate adjustments (additive increase, multiplicative decrease)
+RATE_INCREASE = 0.5
+SLOW_DECREASE = 0.8
+THROTTLED_DECREASE = 0.5
+
+# HTTP status codes telling us to slow down
+THROTTLE_STATUS = (429, 503)
+
+# Retries and backoff (seconds)
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    """Token bucket allowing "rate" requests per second, with bursts up to "capacity" requests."""
+
+    def __init__(self, rate=INITIAL_RATE, capacity=BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns how long (seconds) the caller must wait before using it."""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            # The bucket may go negative, later callers then wait longer
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, sleep=time.sleep):
+        """Waits until a request may be sent."""
+
+        delay = self.reserve()
+        if delay > 0:
+            sleep(delay)
+
+
+class RateLimiter:
+    """Adaptive rate limiter with one token bucket per host."""
+
+    def __init__(self, initial_rate=INITIAL_RATE):
+        self.initial_rate = initial_rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        """Returns the token bucket for the host in "url"."""
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.initial_rate)
+            return self._buckets[host]
+
+    def acquire(self, url, sleep=time.sleep):
+        """Waits until a request to the host in "url" may be sent."""
+
+        self.bucket(url).acquire(sleep)
+
+    def update(self, url, status_code, latency):
+        """Adjusts the rate for the host in "url" based on the response status and latency."""
+
+        bucket = self.bucket(url)
+        with bucket.lock:
+            if status_code in THROTTLE_STATUS:
+                bucket.rate = max(MIN_RATE, bucket.rate * THROTTLED_DECREASE)
+            elif latency > TARGET_LATENCY:
+                bucket.rate = max(MIN_RATE, bucket.rate * SLOW_DECREASE)
+            else:
+                bucket.rate = min(MAX_RATE, bucket.rate + RATE_INCREASE)
+
+
+def retry_after(response):
+    """Returns the number of seconds to wait according to the 'Retry-After' header, or None if not available.
+
+    The header is either a number of seconds or an HTTP date.
+    """
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+def backoff_delay(attempt):
+    """Returns the delay (seconds) before retry number "attempt" (starting at 0), exponential with full jitter."""
+
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
@@ -0,0 +1,94 @@
+"""
+    records.py
+    -----------
+    Implements the record types for the mod data of each repository, as passed between the pipeline stages and
+    stored by "helpers.update_db".
+
+    The records use __slots__, so a record is a small fixed size object without a __dict__. KSP versions, which
+    have few distinct values shared by thousands of mods, are interned so each distinct version is stored once.
+"""
+
+import sys
+
+
+def intern(value):
+    """Interns a string, other values (e.g. None) are returned unchanged."""
+
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+    """Base class for the records, the fields of a record are its __slots__."""
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and list(self) == list(other)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(repr(value) for value in self))
+
+    def __getstate__(self):
+        return list(self)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def to_list(self):
+        """Returns the values of the fields as a list, e.g. for JSON."""
+
+        return list(self)
+
+
+class SpacedockMod(Record):
+    """A mod on SpaceDock."""
+
+    __slots__ = ('ksp_version', 'source', 'forum', 'id', 'url')
+
+    def __init__(self, ksp_version, source, forum, id, url):
+        self.ksp_version = intern(ksp_version)
+        self.source = source
+        self.forum = forum
+        self.id = id
+        self.url = url
+
+
+class CurseMod(Record):
+    """A mod on Curse, "url" is a link to the mod page with the KSP version as text."""
+
+    __slots__ = ('ksp_version', 'url')
+
+    def __init__(self, ksp_version, url):
+        self.ksp_version = intern(ksp_version)
+        self.url = url
+
+
+class CKANVersion(Record):
+    """A version of a mod in the CKAN repo, as read from one CKAN data file."""
+
+    __slots__ = ('ksp_version', 'name', 'source', 'forum', 'kerbalstuff', 'spacedock')
+
+    def __init__(self, ksp_version, name, source, forum, kerbalstuff, spacedock):
+        self.ksp_version = intern(ksp_version)
+        self.name = name
+        self.source = source
+        self.forum = forum
+        self.kerbalstuff = kerbalstuff
+        self.spacedock = spacedock
+
+
+class CKANMod(Record):
+    """A mod in the CKAN repo, with the data of the highest mod version."""
+
+    __slots__ = ('ksp_version', 'source', 'forum', 'kerbalstuff', 'spacedock')
+
+    def __init__(self, ksp_version, source, forum, kerbalstuff, spacedock):
+        self.ksp_version = ksp_version
+        self.source = source
+        self.forum = forum
+        self.kerbalstuff = kerbalstuff
+        self.spacedock = spacedock
@@ -0,0 +1,207 @@
+"""
+    snapshots.py
+    -----------
+    Implements a history of the SpaceDock, Curse, CKAN and Total tables, stored as snapshots in the database.
+
+    Each refresh is stored as a delta against the previous refresh (added, removed and changed mods), compressed
+    in an append-only table, so the storage grows with the number of changes and not with the number of mods.
+    Every CHECKPOINT_INTERVAL deltas a checkpoint with the complete table is stored, so the state at any time can be
+    rebuilt from the closest checkpoint and a limited number of deltas.
+
+    History older than RETENTION_DAYS is merged into one checkpoint each time a checkpoint is stored, "--compact"
+    also frees the space in the database file.
+
+    Usage (e.g. which mods were removed from CKAN since October 1st, or compacting the history):
+        python3 ksp-mod-analyzer/snapshots.py CKAN 2026-10-01 [end date]
+        python3 ksp-mod-analyzer/snapshots.py --compact
+"""
+
+import contextlib
+import json
+import sys
+import time
+import zlib
+from datetime import datetime
+
+import database
+
+# Tables with history, the first column after 'Id' is the mod name
+TABLES = ('SpaceDock', 'Curse', 'CKAN', 'Total')
+
+# Number of deltas between checkpoints
+CHECKPOINT_INTERVAL = 20
+
+# History older than this (days) is merged into one checkpoint by "compact"
+RETENTION_DAYS = 365
+
+
+def init_snapshots(cur):
+    """Creates the 'Snapshots' table if it doesn't exist."""
+
+    # Kind is 'checkpoint' (Data = complete table) or 'delta' (Data = changes since the previous snapshot)
+    cur.execute('CREATE TABLE IF NOT EXISTS Snapshots '
+                '(Id INTEGER PRIMARY KEY, Source TEXT, Time REAL, Kind TEXT, Data BLOB)')
+    cur.execute('CREATE INDEX IF NOT EXISTS Snapshots_Source_Time ON Snapshots (Source, Time)')
+
+def get_rows(cur, table):
+    """Gets all rows of a table as a dict {mod name: [other columns]}, without the 'Id' column."""
+
+    cur.execute('SELECT * FROM ' + table)
+    return {row[1]: list(row[2:]) for row in cur.fetchall()}
+
+def encode(data):
+    """Serializes and compresses snapshot data."""
+
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+def decode(blob):
+    """Decompresses and un-serializes snapshot data."""
+
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def compute_delta(old_rows, new_rows):
+    """Returns the changes between two sets of rows as a dict with 'added', 'removed' and 'changed' mods."""
+
+    return {'added': {mod: row for mod, row in new_rows.items() if mod not in old_rows},
+            'removed': [mod for mod in old_rows if mod not in new_rows],
+            'changed': {mod: row for mod, row in new_rows.items() if mod in old_rows and old_rows[mod] != row}}
+
+def apply_delta(rows, delta):
+    """Applies a delta to a dict of rows (in place)."""
+
+    rows.update(delta['added'])
+    for mod in delta['removed']:
+        rows.pop(mod, None)
+    rows.update(delta['changed'])
+
+def record(cur, source, old_rows, new_rows, timestamp=None):
+    """Stores the change from "old_rows" to "new_rows" for a table, called when the table has been updated."""
+
+    init_snapshots(cur)
+    if timestamp is None:
+        timestamp = time.time()
+
+    # Number of deltas since the last checkpoint, None if there is no checkpoint yet
+    cur.execute('SELECT Id FROM Snapshots WHERE Source = ? AND Kind = ? ORDER BY Id DESC LIMIT 1',
+                (source, 'checkpoint'))
+    checkpoint = cur.fetchone()
+    if checkpoint is None:
+        deltas = None
+    else:
+        cur.execute('SELECT COUNT(*) FROM Snapshots WHERE Source = ? AND Kind = ? AND Id > ?',
+                    (source, 'delta', checkpoint[0]))
+        deltas = cur.fetchone()[0]
+
+    if deltas is None or deltas >= CHECKPOINT_INTERVAL:
+        # Merge the history older than the retention time, at most once every CHECKPOINT_INTERVAL refreshes
+        compact_source(cur, source, timestamp - RETENTION_DAYS * 86400)
+
+        cur.execute('INSERT INTO Snapshots (Source, Time, Kind, Data) VALUES (?, ?, ?, ?)',
+                    (source, timestamp, 'checkpoint', encode(new_rows)))
+        return
+
+    delta = compute_delta(old_rows, new_rows)
+    if delta['added'] or delta['removed'] or delta['changed']:
+        cur.execute('INSERT INTO Snapshots (Source, Time, Kind, Data) VALUES (?, ?, ?, ?)',
+                    (source, timestamp, 'delta', encode(delta)))
+
+def state_at(cur, source, timestamp):
+    """Rebuilds the rows of a table as they were at "timestamp", from the closest checkpoint and the deltas after it."""
+
+    cur.execute('SELECT Id, Data FROM Snapshots WHERE Source = ? AND Kind = ? AND Time <= ? '
+                'ORDER BY Id DESC LIMIT 1',
+                (source, 'checkpoint', timestamp))
+    checkpoint = cur.fetchone()
+    if checkpoint is None:
+        return {}
+
+    rows = decode(checkpoint[1])
+    cur.execute('SELECT Data FROM Snapshots WHERE Source = ? AND Kind = ? AND Id > ? AND Time <= ? ORDER BY Id',
+                (source, 'delta', checkpoint[0], timestamp))
+    for (data,) in cur.fetchall():
+        apply_delta(rows, decode(data))
+    return rows
+
+def changes(db_file, source, start, end=None):
+    """Returns the changes of a table between two times (seconds since the epoch, "end" defaults to now),
+    as a dict with 'added', 'removed' and 'changed' mods.
+    """
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        cur = con.cursor()
+        init_snapshots(cur)
+        return compute_delta(state_at(cur, source, start), state_at(cur, source, time.time() if end is None else end))
+
+def history(db_file, source, start, end=None):
+    """Returns a list of (time, kind, added, removed, changed) for all snapshots of a table in a time range."""
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        cur = con.cursor()
+        init_snapshots(cur)
+        cur.execute('SELECT Time, Kind, Data FROM Snapshots WHERE Source = ? AND Time >= ? AND Time <= ? ORDER BY Id',
+                    (source, start, time.time() if end is None else end))
+
+        result = []
+        for timestamp, kind, data in cur.fetchall():
+            data = decode(data)
+            if kind == 'checkpoint':
+                result.append((timestamp, kind, len(data), 0, 0))
+            else:
+                result.append((timestamp, kind, len(data['added']), len(data['removed']), len(data['changed'])))
+        return result
+
+def compact_source(cur, source, cutoff):
+    """Merges the history of a table up to "cutoff" (seconds since the epoch) into one checkpoint."""
+
+    cur.execute('SELECT Id, Time FROM Snapshots WHERE Source = ? AND Time <= ? ORDER BY Id DESC LIMIT 1',
+                (source, cutoff))
+    last = cur.fetchone()
+    if last is None:
+        return
+
+    # Nothing to merge if the history before the cutoff is already a single checkpoint
+    last_id, last_time = last
+    cur.execute('SELECT COUNT(*), MIN(Kind) FROM Snapshots WHERE Source = ? AND Id <= ?', (source, last_id))
+    if cur.fetchone() == (1, 'checkpoint'):
+        return
+
+    # Replace everything up to the last snapshot before the cutoff with a checkpoint of that state,
+    # keeping the id so the deltas after it are still applied in order
+    rows = state_at(cur, source, last_time)
+    cur.execute('DELETE FROM Snapshots WHERE Source = ? AND Id <= ?', (source, last_id))
+    cur.execute('INSERT INTO Snapshots (Id, Source, Time, Kind, Data) VALUES (?, ?, ?, ?, ?)',
+                (last_id, source, last_time, 'checkpoint', encode(rows)))
+
+def compact(db_file, retention_days=RETENTION_DAYS):
+    """Merges all history older than "retention_days" into one checkpoint per table, and frees the space.
+
+    The history is also merged by "record" when it stores a checkpoint, without freeing the space.
+    """
+
+    cutoff = time.time() - retention_days * 86400
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        with con:
+            cur = con.cursor()
+            init_snapshots(cur)
+            for source in TABLES:
+                compact_source(cur, source, cutoff)
+        con.execute('VACUUM')
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ['--compact']:
+        compact('data/database.db')
+        sys.exit()
+
+    if len(sys.argv) < 3 or sys.argv[1] not in TABLES:
+        sys.exit('Usage: snapshots.py ' + '|'.join(TABLES) + ' <start date YYYY-MM-DD> [end date YYYY-MM-DD]\n'
+                 '       snapshots.py --compact')
+
+    start = datetime.strptime(sys.argv[2], '%Y-%m-%d').timestamp()
+    end = datetime.strptime(sys.argv[3], '%Y-%m-%d').timestamp() if len(sys.argv) > 3 else None
+    result = changes('data/database.db', sys.argv[1], start, end)
+
+    for kind in ('added', 'removed', 'changed'):
+        print('{} mods {}:'.format(len(result[kind]), kind))
+        for mod in sorted(result[kind], key=str.lower):
+            print('   ', mod)
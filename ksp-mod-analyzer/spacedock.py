@@ -5,175 +5,130 @@
     For details on the API see https://github.com/KSP-SpaceDock/SpaceDock/blob/dev/api.md
 """
 
-import sys
+import json
+import os
 
+import fetch
 import helpers
-import requests
-from PyQt5 import QtCore
+import normalize
+import pipeline
+import records
+
+# Base URL of the SpaceDock API, can be changed with an environment variable, e.g. for a local mock server
+SPACEDOCK_URL = os.environ.get('KSP_SPACEDOCK_URL', 'https://spacedock.info')
 
 # How many mods to get on each page from SpaceDock API (30-500)
 MODS_PER_PAGE = 100
 
-class SpacedockThread(QtCore.QThread):
-    """QThread for processing."""
-
-    # Signal for handling exceptions that may occur in the running thread
-    exception_signal = QtCore.pyqtSignal(str)
 
-    # Finished signal, emitted at the end of the run
-    finished_signal = QtCore.pyqtSignal(str)
+class SpacedockPipeline(pipeline.Pipeline):
+    """Pipeline for getting all mods from SpaceDock: fetch -> parse -> normalize -> store."""
 
-    # Cancelled signal, emitted when the thread is stopped
-    cancelled_signal = QtCore.pyqtSignal(str)
+    name = 'SpaceDock'
 
-    # Signal for updating the progress bar
-    notify_progress_signal = QtCore.pyqtSignal(int)
+    # Store pages in page order, a mod name appearing on several pages keeps the data from the last page
+    ordered = True
 
     def __init__(self, db_file, use_cache):
         super().__init__()
         self.db_file = db_file
         self.use_cache = use_cache
-        self.keep_running = False
-
-    def __del__(self):
-        self.wait()
-
-    def stop(self):
-        """Stops the running thread gracefully."""
 
-        print('Stopping SpaceDock thread...')
-        self.keep_running = False
+        self.stages = [pipeline.Stage('fetch', self.fetch_page, workers=fetch.MAX_CONNECTIONS_PER_HOST),
+                       pipeline.Stage('parse', parse_page),
+                       pipeline.Stage('normalize', normalize_page)]
 
-        # Wait for the thread to stop
-        self.wait()
-        self.cancelled_signal.emit('spacedock')
-        print('SpaceDock thread stopped')
+        # Raw JSON data for each page, written to disk when finished
+        self.spacedock_data = {}
 
-    def run(self):
-        """Main thread processing loop."""
+        # Dict to hold all mod data
+        self.mods = {}
 
-        self.keep_running = True
+    def source(self):
+        """Yields (page, data) for all pages, "data" is None for pages not fetched yet."""
 
-        try:
-            print('Starting SpaceDock thread...')
-            # Get data from SpaceDock and update database
-            self.update_spacedock()
-
-            # Update database table 'Total'
-            helpers.update_total_mods(self.db_file)
+        # Set initial value (3%) for progress bar to indicate processing has started
+        self.progress(3)
 
-            # Only emit finished signal if job was not cancelled (i.e. 'keep_running' is still True)
-            if self.keep_running:
-                self.finished_signal.emit('spacedock')
+        # Check if cached data on disk should be used (for testing purposes)
+        if self.use_cache:
+            spacedock_data = helpers.read_from_disk('data/spacedock.data')
+            self.total = len(spacedock_data)
+            yield from spacedock_data.items()
+            return
 
-        # Exception handling:
-        # Emits a signal if an exception occurs in the running thread
-        # The main application will then show an error message about the problem
-        # This is needed because a new message box widget cannot be created/displayed in the thread
-        except Exception as e:
-            # Stop the thread
-            self.stop()
-            print('SpaceDock thread stopped at exception')
+        # Get the first page of mods, needed to check how many sub pages there are
+        req = get_url(1)
+        print("Getting first page with request", req)
+        data = fetch.get(req).content
 
-            # Get info about the exception
-            (type, value, traceback) = sys.exc_info()
+        # Update progress bar to indicate first page received
+        self.check()
+        self.progress(10)
 
-            # Generate a detailed error message
-            msg = helpers.exception_message_qthread(type, value, traceback)
+        # Number of pages as returned from SpaceDock API
+        pages = json.loads(data.decode('utf-8'))["pages"]
+        print("Pages to get:", pages)
+        self.total = int(pages)
 
-            # Emit a signal with the error message to be displayed in a message box in the main UI
-            self.exception_signal.emit(msg)
+        # Start from page 2 as the first page has already been retrieved
+        yield 1, data
+        for page in range(2, pages + 1):
+            yield page, None
 
-    def update_spacedock(self):
-        """Updates the database with data from SpaceDock."""
+    def fetch_page(self, item):
+        """Requests a page from the SpaceDock API, unless already fetched."""
 
-        # Get the SpaceDock data
-        # "spacedock_data" is a dictionary containing all sub-pages with mods in JSON format
+        page, data = item
+        if data is None:
+            data = fetch.get(get_url(page)).content
+        return page, data
 
-        # Check if cached data on disk should be used (for testing purposes)
-        if self.use_cache:
-            spacedock_data = helpers.read_from_disk('data/spacedock.data')
-        else:
-            spacedock_data = self.parse_spacedock()
-            helpers.write_to_disk('data/spacedock.data', spacedock_data)
-
-        if self.keep_running:
-            # Empty dict to hold all mod data
-            mods = {}
-
-            # Get all mods from each sub-page and store them in the dict
-            for key, value in spacedock_data.items():
-                page = value.json()
-                for mod in page['result']:
-                    mod_name = helpers.clean_item(mod['name'])
-                    ksp_version = mod['versions'][0]['game_version']
-                    source = mod['source_code']
-                    forum = mod['website']
-                    id = mod['id']
-                    url = '<a href="https://spacedock.info/mod/' + str(id) + '">' + str(ksp_version) + '</a>'
-
-                    # Update dict
-                    mods[mod_name] = [ksp_version, source, forum, id, url]
-
-            # Update the database
-            helpers.update_db('SpaceDock', mods, self.db_file)
-
-    def parse_spacedock(self):
-        """Requests SpaceDock for all mods using the API and returns a dictionary with the data in JSON format."""
+    def store(self, item):
+        """Updates the dict with the mods from one page."""
 
-        # Set initial value (3%) for progress bar to indicate processing has started
-        self.notify_progress_signal.emit(3)
+        page, data, mods = item
+        self.spacedock_data[page] = data
+        self.mods.update(mods)
 
-        # Initial request to SpaceDock API
-        req = "https://spacedock.info/api/browse?count=" + str(MODS_PER_PAGE)
+    def finish(self):
+        """Writes the raw data to disk and updates the database."""
 
-        # Empty dictionary to store the mod data
-        mod_data = {}
+        if not self.use_cache:
+            helpers.write_to_disk('data/spacedock.data', self.spacedock_data)
 
-        try:
-            if self.keep_running:
-                # Get the first page of mods
-                print("Getting first page with request", req)
-                response = requests.get(req)
+        self.changed = helpers.update_db('SpaceDock', self.mods, self.db_file)
+        return self.mods
 
-                # Store the first page of mod data in the dictionary
-                mod_data[1] = response
 
-                # Another check is needed in case the thread was stopped while the HTTP request was running
-                if self.keep_running:
-                    # Update progress bar to indicate first page received, number of pages are still unknown
-                    self.notify_progress_signal.emit(10)
+def get_url(page):
+    """Returns the SpaceDock API URL for a page."""
 
-                # Decode JSON data that will be used to check how many sub pages there are
-                spacedock_data = response.json()
+    return SPACEDOCK_URL + "/api/browse?page=" + str(page) + "&count=" + str(MODS_PER_PAGE)
 
-                # Number of pages as returned from SpaceDock API
-                pages = spacedock_data["pages"]
-                print("Pages to get:", pages)
+def parse_page(item):
+    """Decodes the JSON data for a page."""
 
-                # Calculate the progress bar interval based on number of pages
-                progress_bar_interval = 100 / int(pages)
+    page, data = item
+    return page, data, json.loads(data.decode('utf-8'))['result']
 
-                # Request SpaceDock for each page available and store the result in the dictionary
-                # Start from page 2 as the first page has already been retrieved
-                for page in range(2, pages + 1):
-                    if self.keep_running:
-                        # Create the URL to fetch each page
-                        req = "https://spacedock.info/api/browse?page=" + str(page) + "&count=" + str(MODS_PER_PAGE)
+def normalize_page(item):
+    """Gets all mods from a decoded page and returns a dict of mods."""
 
-                        # Fetch page
-                        mod_data[page] = requests.get(req)
+    page, data, result = item
 
-                        # Another check is needed in case the thread was stopped while the HTTP request was running
-                        if self.keep_running:
-                            # Update progress bar
-                            self.notify_progress_signal.emit(progress_bar_interval * page)
-                    else:
-                        break
-        except:
-            # Raise any exception to be handled by the QThread
-            raise
+    # Clean all mod names in one call
+    mod_names = normalize.clean_items([mod['name'] for mod in result])
 
-        return mod_data
+    mods = {}
+    for mod_name, mod in zip(mod_names, result):
+        ksp_version = mod['versions'][0]['game_version']
+        source = mod['source_code']
+        forum = mod['website']
+        id = mod['id']
+        url = '<a href="https://spacedock.info/mod/' + str(id) + '">' + str(ksp_version) + '</a>'
 
+        # Update dict
+        mods[mod_name] = records.SpacedockMod(ksp_version, source, forum, id, url)
 
+    return page, data, mods
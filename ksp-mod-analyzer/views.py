@@ -0,0 +1,101 @@
+"""
+    views.py
+    -----------
+    Implements the views of the merged mod data in the 'Total' table, e.g. "All mods" or "Mods only on Curse".
+
+    The SQL query of each view is used as is by the table in the UI (sorted and filtered there), and with filtering,
+    sorting and pagination in SQL by "query", e.g. for the HTTP API of the daemon (see daemon.py).
+"""
+
+import contextlib
+import re
+
+import database
+
+# SQL query of each view, in the order shown in the UI
+VIEWS = {'All mods': 'SELECT Mod, Spacedock, Curse, CKAN, Source, Forum '
+                     'FROM Total',
+         'All mods on SpaceDock': 'SELECT Mod, SpaceDock, Source, Forum '
+                                  'FROM Total '
+                                  'WHERE SpaceDock IS NOT NULL',
+         'All mods on Curse': 'SELECT Mod, Curse, Source, Forum '
+                              'FROM Total '
+                              'WHERE Curse IS NOT NULL',
+         'All mods on CKAN': 'SELECT Mod, CKAN, Source, Forum '
+                             'FROM Total '
+                             'WHERE CKAN IS NOT NULL',
+         'Mods only on SpaceDock': 'SELECT Mod, SpaceDock, Source, Forum '
+                                   'FROM Total '
+                                   'WHERE Spacedock IS NOT NULL AND Curse IS NULL AND CKAN IS NULL',
+         'Mods only on Curse': 'SELECT Mod, Curse, Source, Forum '
+                               'FROM Total '
+                               'WHERE Curse IS NOT NULL AND Spacedock IS NULL AND CKAN IS NULL',
+         'Mods only on CKAN': 'SELECT Mod, CKAN, Source, Forum '
+                              'FROM Total '
+                              'WHERE CKAN IS NOT NULL AND Curse IS NULL AND Spacedock IS NULL'}
+
+# Max number of rows returned by "query" at a time
+MAX_PAGE_SIZE = 1000
+
+
+def slug(name):
+    """Returns the name of a view for use in a URL, e.g. "mods-only-on-curse" for "Mods only on Curse"."""
+
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+def find_view(name):
+    """Returns the name of a view from its name or slug, or None if not found."""
+
+    for view in VIEWS:
+        if name in (view, slug(view)):
+            return view
+    return None
+
+def get_columns(view):
+    """Returns the column names of a view, from the column list of its SQL query."""
+
+    select = VIEWS[view][len('SELECT '):VIEWS[view].index(' FROM ')]
+    return [column.strip() for column in select.split(',')]
+
+def validate(view, sort=None, page=1, page_size=100):
+    """Checks the parameters of "query" without reading the database, returns the sort column.
+
+    Raises ValueError for an unknown view or sort column, or an invalid page.
+    """
+
+    if view not in VIEWS:
+        raise ValueError('Unknown view "{}"'.format(view))
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError('Invalid page {} or page size {}'.format(page, page_size))
+
+    columns = get_columns(view)
+    sort = sort or columns[0]
+    if sort not in columns:
+        raise ValueError('Unknown column "{}", valid columns are: {}'.format(sort, ', '.join(columns)))
+    return sort
+
+def query(db_file, view, text='', sort=None, descending=False, page=1, page_size=100):
+    """Returns (columns, rows, total) for one page of a view.
+
+    Only mods with "text" in the mod name (case insensitive) are included, like the filter in the UI. The rows are
+    sorted by the column "sort" (default the mod name), case insensitive. "total" is the number of rows on all pages.
+    Raises ValueError for an unknown view or sort column, or an invalid page (see "validate").
+    """
+
+    sort = validate(view, sort, page, page_size)
+    columns = get_columns(view)
+
+    with contextlib.closing(database.connect(db_file)) as con:
+        # Filter on the mod name, "%" and "_" in the text are not wildcards
+        where = 'WHERE Mod LIKE ? ESCAPE \'\\\''
+        pattern = '%' + re.sub(r'([%_\\])', r'\\\1', text) + '%'
+
+        sql = 'SELECT * FROM ({}) {}'.format(VIEWS[view], where)
+        total = con.execute('SELECT COUNT(*) FROM ({})'.format(sql), (pattern,)).fetchone()[0]
+
+        # Sort by the mod name within rows with the same value, so the pages don't overlap
+        order = 'DESC' if descending else 'ASC'
+        rows = con.execute('{} ORDER BY "{}" COLLATE NOCASE {}, Mod COLLATE NOCASE LIMIT ? OFFSET ?'.format(
+            sql, sort, order), (pattern, page_size, (page - 1) * page_size)).fetchall()
+
+    return columns, rows, total
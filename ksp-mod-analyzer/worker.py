@@ -0,0 +1,209 @@
+"""
+    worker.py
+    -----------
+    Implements a QThread running a pipeline (see pipeline.py) and forwarding its events to the UI as QT signals,
+    and a QThread refreshing all repositories together with the orchestrator (see orchestrator.py).
+
+    Stopping the thread doesn't wait for it, the pipeline is cancelled (aborting network calls in progress) and the
+    cancelled signal is emitted when the thread has exited, so the UI is not blocked while the thread stops.
+"""
+
+import importlib
+import sys
+
+import helpers
+import metrics
+import pipeline
+from PyQt5 import QtCore
+
+
+class PipelineThread(QtCore.QThread):
+    """QThread for processing."""
+
+    # Signal for handling exceptions that may occur in the running thread
+    exception_signal = QtCore.pyqtSignal(str)
+
+    # Finished signal, emitted at the end of the run
+    finished_signal = QtCore.pyqtSignal(str)
+
+    # Cancelled signal, emitted when the thread has stopped after a cancellation or an exception
+    cancelled_signal = QtCore.pyqtSignal(str)
+
+    # Signal for updating the progress bar
+    notify_progress_signal = QtCore.pyqtSignal(int)
+
+    def __init__(self, name, pipeline_class, db_file, use_cache):
+        """Creates a thread running a pipeline, "pipeline_class" is the module and class name of the pipeline,
+        e.g. 'spacedock.SpacedockPipeline'. The module is imported when the thread runs for the first time,
+        so the network and parsing modules are not loaded at application start.
+
+        "name" (e.g. 'spacedock') is sent with the finished and cancelled signals.
+        """
+
+        super().__init__()
+        self.name = name
+        self.pipeline_class = pipeline_class
+        self.db_file = db_file
+        self.use_cache = use_cache
+        self.keep_running = False
+        self.pipeline = None
+
+    def __del__(self):
+        self.wait()
+
+    def start(self):
+        """Starts the thread, it can be stopped with "stop" from now on, also before "run" has been called."""
+
+        self.keep_running = True
+        self.pipeline = None
+        super().start()
+
+    def stop(self):
+        """Stops the running thread, returns at once without waiting for the thread to exit."""
+
+        print('Stopping', self.name, 'thread...')
+        self.keep_running = False
+        if self.pipeline:
+            self.pipeline.stop()
+
+    def run(self):
+        """Main thread processing loop."""
+
+        try:
+            print('Starting', self.name, 'thread...')
+            self.pipeline = load_class(self.pipeline_class)(self.db_file, self.use_cache)
+            self.pipeline.subscribe(self.pipeline_event)
+
+            # Stopped while the pipeline was being created, it's then cancelled at once
+            if not self.keep_running:
+                self.pipeline.stop()
+
+            # Get the data and update the database
+            self.pipeline.run()
+
+            # Update database table 'Total' if anything has changed, measured as part of the pipeline run
+            if self.pipeline.changed:
+                with metrics.activate(self.pipeline.metrics):
+                    helpers.update_total_mods(self.db_file)
+
+            # Only emit signals if job was not cancelled (i.e. 'keep_running' is still True)
+            if self.keep_running:
+                self.notify_progress_signal.emit(100)
+                self.finished_signal.emit(self.name)
+            else:
+                self.cancelled()
+
+        except pipeline.Cancelled:
+            print(self.name, 'pipeline cancelled')
+            self.cancelled()
+
+        # Exception handling:
+        # Emits a signal if an exception occurs in the running thread
+        # The main application will then show an error message about the problem
+        # This is needed because a new message box widget cannot be created/displayed in the thread
+        except Exception:
+            # The thread is stopped when returning from "run"
+            self.keep_running = False
+            self.cancelled()
+            print(self.name, 'thread stopped at exception')
+
+            # Get info about the exception
+            (type, value, traceback) = sys.exc_info()
+
+            # Generate a detailed error message
+            msg = helpers.exception_message_qthread(type, value, traceback)
+
+            # Emit a signal with the error message to be displayed in a message box in the main UI
+            self.exception_signal.emit(msg)
+
+    def cancelled(self):
+        """Resets the progress bar and emits the cancelled signal, called when the thread is about to exit."""
+
+        self.notify_progress_signal.emit(0)
+        self.cancelled_signal.emit(self.name)
+        print(self.name, 'thread stopped')
+
+    def pipeline_event(self, kind, value):
+        """Forwards pipeline events to the UI, called from the pipeline threads."""
+
+        # Avoid emitting signals if the run was cancelled
+        if kind == 'progress' and self.keep_running:
+            self.notify_progress_signal.emit(value)
+
+
+class OrchestratorThread(QtCore.QThread):
+    """QThread refreshing all repositories concurrently, with a single update of the 'Total' table."""
+
+    # Signal with an error message for each repository that failed
+    exception_signal = QtCore.pyqtSignal(str)
+
+    # Finished signal, emitted at the end of the run with the result of each repository, as {name: result}, the
+    # result is 'changed', 'unchanged', 'cancelled' or 'error'
+    finished_signal = QtCore.pyqtSignal(dict)
+
+    # Signal for updating the progress bar of a repository
+    notify_progress_signal = QtCore.pyqtSignal(str, int)
+
+    def __init__(self, db_file, use_cache):
+        super().__init__()
+        self.name = 'all'
+        self.db_file = db_file
+        self.use_cache = use_cache
+        self.keep_running = False
+        self.orchestrator = None
+
+    def __del__(self):
+        self.wait()
+
+    def start(self):
+        """Starts the thread, it can be stopped with "stop" from now on."""
+
+        self.keep_running = True
+        self.orchestrator = None
+        super().start()
+
+    def stop(self):
+        """Stops the running refresh, returns at once without waiting for the thread to exit."""
+
+        print('Stopping refresh of all repositories...')
+        self.keep_running = False
+        if self.orchestrator:
+            self.orchestrator.stop()
+
+    def run(self):
+        """Refreshes all repositories, the orchestrator module is imported on first use."""
+
+        results = {}
+        try:
+            self.orchestrator = load_class('orchestrator.Orchestrator')(self.db_file, use_cache=self.use_cache)
+            self.orchestrator.subscribe(self.orchestrator_event)
+
+            # Stopped while the orchestrator was being created, all repositories are then cancelled at once
+            if not self.keep_running:
+                self.orchestrator.stop()
+
+            results = self.orchestrator.refresh()
+        except Exception:
+            self.exception_signal.emit(helpers.exception_message_qthread(*sys.exc_info()))
+
+        # Show an error message for each repository that failed
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                self.exception_signal.emit(helpers.exception_message_qthread(type(result), result,
+                                                                            result.__traceback__))
+                results[name] = 'error'
+
+        self.finished_signal.emit(results)
+
+    def orchestrator_event(self, kind, name, value):
+        """Forwards the progress of each repository to the UI, called from the pipeline threads."""
+
+        if kind == 'progress' and self.keep_running:
+            self.notify_progress_signal.emit(name, value)
+
+
+def load_class(path):
+    """Imports a class from its module and class name, e.g. 'spacedock.SpacedockPipeline'."""
+
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
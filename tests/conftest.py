@@ -0,0 +1,36 @@
+"""
+    conftest.py
+    -----------
+    Shared setup of the tests: the application modules and the benchmark helpers (mock server, synthetic data)
+    are imported from their directories, like the benchmarks do.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'ksp-mod-analyzer'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+import fetch
+import mock_server
+import ratelimit
+
+
+@pytest.fixture
+def server():
+    """Local mock repository server with the fixture data, see benchmarks/mock_server.py."""
+
+    server = mock_server.MockRepositoryServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retries at once instead of waiting, and a new fetcher without the rate limits of earlier tests."""
+
+    monkeypatch.setattr(ratelimit, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setattr(fetch, '_fetcher', None)
@@ -0,0 +1,68 @@
+"""
+    test_ckan.py
+    -----------
+    Tests of selecting the latest version of a CKAN mod, and of reading changed files from a git clone of CKAN-meta.
+"""
+
+import shutil
+
+import ckan
+import ckan_git
+import pytest
+import records
+import synthetic
+
+
+def version(ksp_version, name='Mod'):
+    return records.CKANVersion(ksp_version, name, '', '', '', '')
+
+def test_select_version_highest_ksp_version():
+    versions = {'0.5pre': version('0.90', 'Old'),
+                '1.0': version('1.1.3', 'Older'),
+                '1.1': version('1.2.2', 'Previous'),
+                '1.2': version('1.2.2', 'Latest')}
+
+    assert ckan.select_version(versions).name == 'Latest'
+
+def test_select_version_natural_order():
+    versions = {'1.9': version('1.2.2', 'Previous'),
+                '1.10': version('1.2.2', 'Latest')}
+
+    assert ckan.select_version(versions).name == 'Latest'
+
+def test_select_version_epoch():
+    # A version with an epoch is newer than any version without one
+    versions = {'2.0': version('1.2.2', 'No epoch'),
+                '1:0.5': version('1.2.2', 'Epoch')}
+
+    assert ckan.select_version(versions).name == 'Epoch'
+
+def test_parse_ckan():
+    data = b'{"identifier": "Mod", "version": "1.0", "name": "[1.2] Mod", "ksp_version_min": "1.2", ' \
+           b'"resources": {"repository": "https://github.com/a/mod", "spacedock": "https://spacedock.info/mod/1"}}'
+
+    file_name, identifier, mod_version, data = ckan.parse_ckan(('Mod/Mod-1.0.ckan', data))
+
+    assert (identifier, mod_version, data.name, data.ksp_version) == ('Mod', '1.0', 'Mod', '1.2+')
+    assert data.source == 'https://github.com/a/mod'
+    assert data.spacedock == 'https://spacedock.info/mod/1'
+    assert ckan.parse_ckan(('Mod/Mod-1.0.ckan', b'{"identifier": "Mod"}')) is None
+
+@pytest.mark.skipif(shutil.which('git') is None, reason='git is not installed')
+def test_changed_files(tmp_path):
+    repo = synthetic.ckan_git_repo(str(tmp_path / 'CKAN-meta'))
+    old = ckan_git.head(repo)
+    added, deleted = synthetic.ckan_git_commit(repo, changes=3)
+    new = ckan_git.head(repo)
+
+    changed, removed = ckan_git.changed_files(repo, old, new)
+
+    assert sorted(path for path, blob in changed) == sorted(added)
+    assert removed == deleted
+
+    # The blob ids are those of the new commit
+    blobs = dict(ckan_git.list_files(repo, new))
+    assert all(blobs[path] == blob for path, blob in changed)
+
+    # An unknown commit, e.g. after a history rewrite, means all files have to be read
+    assert ckan_git.changed_files(repo, '0' * 40, new) is None
@@ -0,0 +1,67 @@
+"""
+    test_curse.py
+    -----------
+    Tests of the Curse page parsing and of probing for the number of pages.
+"""
+
+import pytest
+
+import curse
+
+BACKENDS = ['bs4'] + (['lxml'] if curse.BACKEND == 'lxml' else [])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('html', [b'', b'  \n', b'<!-- end of listing -->'])
+def test_parse_empty_page(backend, html):
+    assert curse.parse_mods(html, backend=backend) == {}
+
+def test_probe_page_count(server, no_backoff, monkeypatch):
+    monkeypatch.setattr(curse, 'CURSE_URL', server.url + '/ksp-mods/kerbal')
+    pipeline = curse.CursePipeline(':memory:', use_cache=False)
+
+    pages, found = curse.probe_page_count(pipeline.probe_mods, workers=2)
+
+    # Pages after the last one return the last page, see mock_server.send_page
+    assert pages == len(server.curse_pages)
+    assert sorted(found) == list(range(2, pages + 1))
+
+    # The probing threads record their requests in the metrics of the pipeline
+    assert pipeline.metrics.stages['http']['requests'] >= pages
+
+def test_probe_page_count_activates_pipeline(monkeypatch):
+    pipeline = curse.CursePipeline(':memory:', use_cache=False)
+    active = []
+
+    def get_mods(page):
+        active.append((curse.cancel.current(), curse.metrics.current()))
+        return {} if page > 3 else {'Mod ' + str(page): None}
+
+    monkeypatch.setattr(pipeline, 'get_mods', get_mods)
+
+    assert curse.probe_page_count(pipeline.probe_mods, workers=2)[0] == 3
+    assert set(active) == {(pipeline.cancel_token, pipeline.metrics)}
+
+def test_reused_pages_refreshed(server, no_backoff, monkeypatch, tmp_path):
+    monkeypatch.setattr(curse, 'CURSE_URL', server.url + '/ksp-mods/kerbal')
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    db_file = str(tmp_path / 'data' / 'mods.db')
+    curse.helpers.init_database(db_file)
+
+    def refresh():
+        start = server.stats['requests']
+        curse.CursePipeline(db_file, use_cache=False).run()
+        return server.stats['requests'] - start
+
+    pages = len(server.curse_pages)
+    assert refresh() == pages
+
+    # The pages after the first unchanged pages are taken from the previous run, with the time of their download
+    assert refresh() == curse.STABLE_PAGES
+    fetched = curse.helpers.get_curse_pages(db_file)[1]
+    assert len(set(fetched.values())) == 2
+
+    # All pages are downloaded again when the reused pages are too old
+    monkeypatch.setattr(curse, 'REFRESH_AFTER', 0)
+    assert refresh() == pages
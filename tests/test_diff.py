@@ -0,0 +1,65 @@
+"""
+    test_diff.py
+    -----------
+    Tests of the change report of a refresh.
+"""
+
+import diff
+
+
+def ckan_row(version, source='', forum='', spacedock=''):
+    """Returns the columns of a CKAN row after 'Mod', see diff.COLUMNS."""
+
+    return [version, source, forum, '', spacedock, None]
+
+def test_diff_rows():
+    old_rows = {'Kept': ckan_row('1.2'),
+                'Removed': ckan_row('1.0'),
+                'KerbalEngineer': ckan_row('1.1', forum='https://forum/ker'),
+                'Bumped': ckan_row('1.1', source='https://github.com/a/bumped')}
+    new_rows = {'Kept': ckan_row('1.2'),
+                'New': ckan_row('1.3'),
+                'Kerbal Engineer': ckan_row('1.1', forum='https://forum/ker'),
+                'Bumped': ckan_row('1.2', source='https://github.com/b/bumped')}
+
+    report = diff.diff_rows('CKAN', old_rows, new_rows)
+
+    assert report == {'new': ['New'],
+                      'removed': ['Removed'],
+                      'renamed': [['KerbalEngineer', 'Kerbal Engineer']],
+                      'versions': [['Bumped', '1.1', '1.2']],
+                      'links': [['Bumped', 'Source', 'https://github.com/a/bumped', 'https://github.com/b/bumped']]}
+
+def test_diff_rows_unchanged():
+    rows = {'Mod': ckan_row('1.0')}
+
+    report = diff.diff_rows('CKAN', rows, dict(rows))
+
+    assert all(not items for items in report.values())
+    assert diff.summary('CKAN', report) == 'CKAN: 0 new, 0 removed, 0 renamed, 0 version bumps, 0 link changes'
+
+def test_join_ambiguous_keys():
+    # Two removed names with the same normalized name are not joined to a new name
+    new_mods, removed_mods, joined = diff.join_rows({'Mod-A': [], 'Mod A': []}, {'mod a': []})
+
+    assert new_mods == ['mod a']
+    assert sorted(removed_mods) == ['Mod A', 'Mod-A']
+    assert joined == []
+
+def curse_row(version, url):
+    """Returns the columns of a Curse row after 'Mod', the 'URL' column is a link with the version as text."""
+
+    return [version, '', '', '<a href="https://mods.curse.com/ksp-mods/kerbal/' + url + '">' + version + '</a>']
+
+def test_diff_rows_html_link_version():
+    old_rows = {'Mod': curse_row('1.2', '1-mod'),
+                'Moved': curse_row('1.3', '2-moved')}
+    new_rows = {'Mod': curse_row('1.3', '1-mod'),
+                'Moved': curse_row('1.3', '3-moved')}
+
+    report = diff.diff_rows('Curse', old_rows, new_rows)
+
+    # A version bump is not also a link change, only the link target is compared
+    assert report['versions'] == [['Mod', '1.2', '1.3']]
+    assert report['links'] == [['Moved', 'URL', 'https://mods.curse.com/ksp-mods/kerbal/2-moved',
+                                'https://mods.curse.com/ksp-mods/kerbal/3-moved']]
@@ -0,0 +1,145 @@
+"""
+    test_fetch.py
+    -----------
+    Tests of "fetch.get" and "fetch.download" against the mock server: resuming with Range/If-Range, conditional
+    requests, client errors and the limit of concurrent requests to a host.
+"""
+
+import json
+import os
+
+import fetch
+import pytest
+import requests
+
+
+def download(server, tmp_path, validator=None):
+    """Downloads the tarball of the mock server, returns (file name, result of "download")."""
+
+    file_name = str(tmp_path / 'master.tar.gz')
+    return file_name, fetch.download(server.url + '/master.tar.gz', file_name, validator=validator)
+
+def write_part(server, tmp_path, data, validator):
+    """Writes a '.part' file with "data", as left by an interrupted download of the tarball."""
+
+    part_file = str(tmp_path / 'master.tar.gz.part')
+    with open(part_file, 'wb') as f:
+        f.write(data)
+    with open(part_file + '.json', 'w') as f:
+        json.dump({'url': server.url + '/master.tar.gz', 'validator': validator, 'length': len(server.ckan_tarball)},
+                  f)
+
+def test_download(server, tmp_path, no_backoff):
+    file_name, size = download(server, tmp_path)
+
+    assert size == len(server.ckan_tarball)
+    assert open(file_name, 'rb').read() == server.ckan_tarball
+    assert fetch.get_validator(file_name) == server.ckan_etag
+    assert not os.path.exists(file_name + '.part')
+
+def test_download_resumes_dropped_connections(server, tmp_path, no_backoff):
+    # The first two responses are cut off halfway
+    drops = iter([True, True])
+    server.drop = lambda: next(drops, False)
+
+    file_name, size = download(server, tmp_path)
+
+    assert open(file_name, 'rb').read() == server.ckan_tarball
+    assert server.stats['dropped'] == 2
+    assert server.stats['status_206'] == 2
+
+def test_download_resumes_part_file(server, tmp_path, no_backoff):
+    half = len(server.ckan_tarball) // 2
+    write_part(server, tmp_path, server.ckan_tarball[:half], server.ckan_etag)
+
+    file_name, size = download(server, tmp_path)
+
+    assert open(file_name, 'rb').read() == server.ckan_tarball
+    assert server.stats['status_206'] == 1
+    assert server.stats['bytes'] == len(server.ckan_tarball) - half
+
+def test_download_restarts_changed_file(server, tmp_path, no_backoff):
+    # The part file is from an older version of the file, the server ignores the Range for another 'If-Range'
+    write_part(server, tmp_path, b'old data', '"old"')
+
+    file_name, size = download(server, tmp_path)
+
+    assert open(file_name, 'rb').read() == server.ckan_tarball
+    assert server.stats['status_200'] == 1
+
+def test_download_unchanged(server, tmp_path, no_backoff):
+    file_name, size = download(server, tmp_path)
+    file_name, size = download(server, tmp_path, fetch.get_validator(file_name))
+
+    assert size is None
+    assert server.stats['status_304'] == 1
+    assert open(file_name, 'rb').read() == server.ckan_tarball
+
+def test_download_client_error(server, tmp_path, no_backoff):
+    with pytest.raises(requests.HTTPError):
+        fetch.download(server.url + '/missing.tar.gz', str(tmp_path / 'missing.tar.gz'))
+
+    assert server.stats['requests'] == 1
+
+def test_download_server_error_retried(server, tmp_path, no_backoff):
+    server.error_rate = 1.0
+    server.error_status = 500
+
+    with pytest.raises(requests.HTTPError):
+        download(server, tmp_path)
+
+    assert server.stats['requests'] > 1
+
+def test_get_client_error(server, no_backoff):
+    with pytest.raises(requests.HTTPError):
+        fetch.get(server.url + '/missing')
+
+    assert fetch.get(server.url + '/missing', raise_for_status=False).status_code == 404
+
+def test_get_stream_holds_host_limit(server, no_backoff):
+    fetcher = fetch.Fetcher(max_connections_per_host=1)
+    host_limit = fetcher.host_limit(server.url)
+
+    # The host slot is kept while the caller reads a streamed response, and released once when closed
+    response = fetcher.get(server.url + '/master.tar.gz', stream=True)
+    assert not host_limit.acquire(blocking=False)
+    response.close()
+    response.close()
+    assert host_limit.acquire(blocking=False)
+    host_limit.release()
+
+    fetcher.get(server.url + '/master.tar.gz')
+    assert host_limit.acquire(blocking=False)
+
+class ShortRead:
+    """Raw response returning no more data after "limit" bytes, like a connection closed without an error."""
+
+    def __init__(self, raw, limit):
+        self.raw = raw
+        self.limit = limit
+
+    def read(self, size):
+        data = self.raw.read(min(size, self.limit)) if self.limit else b''
+        self.limit -= len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+def test_download_resumes_short_read(server, tmp_path, no_backoff, monkeypatch):
+    # The first response ends halfway without an error, the part file is kept and resumed
+    read_response = fetch.read_response
+    half = len(server.ckan_tarball) // 2
+
+    def short_read(response, *args):
+        if not server.stats['status_206']:
+            response.raw = ShortRead(response.raw, half)
+        return read_response(response, *args)
+
+    monkeypatch.setattr(fetch, 'read_response', short_read)
+
+    file_name, size = download(server, tmp_path)
+
+    assert open(file_name, 'rb').read() == server.ckan_tarball
+    assert server.stats['status_206'] == 1
+    assert server.stats['bytes'] < 2 * len(server.ckan_tarball)
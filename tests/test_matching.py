@@ -0,0 +1,77 @@
+"""
+    test_matching.py
+    -----------
+    Tests of matching mod names between repositories: only hard keys and the same match key rename a mod, similar
+    names are candidates for review.
+"""
+
+import matching
+
+
+def test_match_key():
+    assert matching.match_key('Kerbal Engineer Redux') == matching.match_key('KerbalEngineer_Redux')
+
+def test_same_match_key_renamed():
+    renamed = matching.match_names(['KerbalEngineer Redux', 'Other'], ['Kerbal Engineer Redux', 'Unrelated'])
+
+    assert renamed == {'KerbalEngineer Redux': 'Kerbal Engineer Redux'}
+
+def test_hard_key_renamed():
+    renamed = matching.match_names(['KER'], ['Kerbal Engineer Redux'], {'KER': 'Kerbal Engineer Redux'})
+
+    assert renamed == {'KER': 'Kerbal Engineer Redux'}
+
+def test_identical_names_not_renamed():
+    renamed = matching.match_names(['Mod', 'mod'], ['Mod'])
+
+    # "Mod" exists as is, so "mod" can't be renamed to it
+    assert renamed == {}
+
+def test_canonical_name_used_once():
+    renamed = matching.match_names(['Kerbal-Engineer', 'kerbal engineer'], ['Kerbal Engineer'])
+
+    assert len(renamed) == 1
+
+def test_similar_names_not_renamed():
+    names = ['Kerbal Joint Reinforcement Next', 'Universal Storage', 'Toolbar Controller', 'Scatterer Pack Propulsion',
+             'Mod Pack 11']
+    canonical_names = ['Kerbal Joint Reinforcement', 'Universal Storage II', 'ToolbarControl', 'Scatterer Propulsion',
+                       'Mod Pack 10']
+
+    assert matching.match_names(names, canonical_names) == {}
+
+def test_candidates():
+    names = ['Kerbal Joint Reinforcement Next', 'Universal Storage', 'Toolbar Controller', 'Scatterer Pack Propulsion',
+             'Mod Pack 11', 'Kerbal Enginer Redux']
+    canonical_names = ['Kerbal Joint Reinforcement', 'Universal Storage II', 'ToolbarControl', 'Scatterer Propulsion',
+                       'Mod Pack 10', 'Kerbal Engineer Redux']
+
+    candidates = matching.find_candidates(names, canonical_names)
+
+    # Names with a word or number more or less, or other numbers, are not candidates
+    assert [candidate[:2] for candidate in candidates] == [('Kerbal Enginer Redux', 'Kerbal Engineer Redux'),
+                                                           ('Toolbar Controller', 'ToolbarControl')]
+    assert all(matching.MIN_SIMILARITY <= candidate[2] <= 1 for candidate in candidates)
+
+def test_candidates_exclude_renamed():
+    renamed = {'KerbalEngineer Redux': 'Kerbal Engineer Redux'}
+
+    candidates = matching.find_candidates(['KerbalEngineer Redux', 'Kerbal Enginer Redux'], ['Kerbal Engineer Redux'],
+                                          renamed)
+
+    assert candidates == []
+
+def test_same_words():
+    assert matching.same_words('KerbalEngineer Redux', 'Kerbal Engineer Redux')
+    assert not matching.same_words('Universal Storage', 'Universal Storage II')
+    assert not matching.same_words('Mod 2', 'Mod 3')
+
+def test_blocks_built_on_first_use():
+    index = matching.MatchIndex(['Kerbal Engineer Redux', 'Toolbar Controller'])
+
+    # Matching on the match key doesn't need the LSH blocks
+    assert index.match('KerbalEngineer Redux') == 'Kerbal Engineer Redux'
+    assert index._blocks is None
+
+    assert index.candidate('ToolbarControler')[0] == 'Toolbar Controller'
+    assert index._blocks is not None
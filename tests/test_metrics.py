@@ -0,0 +1,35 @@
+"""
+    test_metrics.py
+    -----------
+    Tests of the timing instrumentation: nested stages and the summary table.
+"""
+
+import metrics
+
+
+def test_nested_stages():
+    m = metrics.Metrics('Test')
+    with metrics.activate(m):
+        with metrics.stage('fetch', items=1):
+            with metrics.stage('http', requests=1):
+                pass
+        with metrics.stage('finish'):
+            pass
+
+    assert m.stages['http']['parent'] == 'fetch'
+    assert 'parent' not in m.stages['fetch']
+    assert 'parent' not in m.stages['finish']
+
+def test_summary_shares_top_level_only():
+    entry = {'source': 'Test', 'time': 0, 'wall': 10.0,
+             'stages': {'fetch': {'calls': 1, 'wall': 8.0, 'cpu': 1.0},
+                        'http': {'calls': 1, 'wall': 7.0, 'cpu': 0.5, 'parent': 'fetch'},
+                        'finish': {'calls': 1, 'wall': 2.0, 'cpu': 2.0}}}
+
+    lines = metrics.format_summary(entry).splitlines()[2:]
+
+    # The child stage is listed below its parent, without a share of the refresh
+    assert [line.split()[0] for line in lines] == ['fetch', 'http', 'finish']
+    assert lines[1].startswith('      http')
+    assert sum(float(line.split()[4]) for line in (lines[0], lines[2])) == 100
+    assert len(lines[1].split()) == 4
@@ -0,0 +1,53 @@
+"""
+    test_normalize.py
+    -----------
+    Tests that the single-regexp cleaning in normalize.py gives the same names as the original step by step cleaning.
+"""
+
+import json
+import re
+
+import normalize
+import synthetic
+
+
+def clean_item_steps(item):
+    """The original cleaning of a mod name, one regexp at a time."""
+
+    cleaned_item = item.strip()
+    cleaned_item = re.sub(r'^\[.*?\]', '', cleaned_item)
+    cleaned_item = re.sub(r'^\(.*?\)', '', cleaned_item)
+    cleaned_item = re.sub(r'[\'\"]', '', cleaned_item)
+    return cleaned_item.strip()
+
+NAMES = ['Kerbal Engineer Redux',
+         '  [1.0.5] Kerbal Engineer Redux  ',
+         '[1.x](0.90) Mod',
+         '[1.x] (0.90) Mod',
+         '(0.90) Mod [1.2]',
+         '"Quoted" mod\'s name',
+         '\'[1.0]\' Name',
+         '[a\'b] Name',
+         '[unclosed Name',
+         '()[] Name',
+         '',
+         '   ']
+
+
+def test_clean_item_same_as_steps():
+    for name in NAMES:
+        assert normalize.clean_item(name) == clean_item_steps(name), name
+
+def test_clean_items_fixture_names():
+    names = [mod['name'] for page in synthetic.spacedock_pages() for mod in json.loads(page)['result']]
+    names += [title[1].decode('utf-8') for page in synthetic.curse_pages()
+              for title in synthetic.RE_CURSE_TITLE.findall(page)]
+    names += NAMES
+    assert len(names) > 100
+
+    assert normalize.clean_items(names) == [clean_item_steps(name) for name in names]
+
+def test_clean_items_keeps_order_and_repeats():
+    names = ['[1.0] B', 'A', '[1.0] B', '(1) A']
+
+    assert normalize.clean_items(names) == ['B', 'A', 'B', 'A']
@@ -0,0 +1,75 @@
+"""
+    test_snapshots.py
+    -----------
+    Tests that the state of a table at any time is rebuilt from the checkpoints and deltas, also after compaction.
+"""
+
+import sqlite3
+
+import snapshots
+
+DAY = 86400
+
+
+def record_history(cur, count, interval=DAY):
+    """Records "count" refreshes of the CKAN table, one every "interval" seconds, with mods added, removed and
+    changed. Returns {time: rows} for each refresh.
+    """
+
+    rows = {}
+    states = {}
+    for i in range(count):
+        new_rows = {mod: list(row) for mod, row in rows.items()}
+        new_rows['Mod {}'.format(i)] = ['1.0', i]
+        if i % 3 == 0:
+            new_rows.pop('Mod {}'.format(i - 1), None)
+        if i % 4 == 0 and 'Mod 0' in new_rows:
+            new_rows['Mod 0'] = ['1.{}'.format(i), i]
+
+        snapshots.record(cur, 'CKAN', rows, new_rows, timestamp=i * interval)
+        rows = new_rows
+        states[i * interval] = new_rows
+    return states
+
+def new_cursor():
+    cur = sqlite3.connect(':memory:').cursor()
+    snapshots.init_snapshots(cur)
+    return cur
+
+def test_state_at():
+    cur = new_cursor()
+    states = record_history(cur, 3 * snapshots.CHECKPOINT_INTERVAL)
+
+    for timestamp, rows in states.items():
+        assert snapshots.state_at(cur, 'CKAN', timestamp) == rows
+        assert snapshots.state_at(cur, 'CKAN', timestamp + DAY / 2) == rows
+    assert snapshots.state_at(cur, 'CKAN', -1) == {}
+
+def test_deltas_between_checkpoints():
+    cur = new_cursor()
+    record_history(cur, 2 * snapshots.CHECKPOINT_INTERVAL + 2)
+
+    kinds = [kind for (kind,) in cur.execute('SELECT Kind FROM Snapshots ORDER BY Id')]
+    assert kinds.count('checkpoint') == 2
+    assert kinds[0] == kinds[snapshots.CHECKPOINT_INTERVAL + 1] == 'checkpoint'
+
+def test_unchanged_refresh_not_stored():
+    cur = new_cursor()
+    rows = {'Mod': ['1.0']}
+    snapshots.record(cur, 'CKAN', {}, rows, timestamp=0)
+    snapshots.record(cur, 'CKAN', rows, dict(rows), timestamp=1)
+
+    assert cur.execute('SELECT COUNT(*) FROM Snapshots').fetchone()[0] == 1
+
+def test_compaction_keeps_recent_history():
+    cur = new_cursor()
+    interval = 10 * DAY
+    states = record_history(cur, 100, interval)
+
+    # Merged into a checkpoint when a checkpoint is stored, history older than the retention time is merged
+    assert cur.execute('SELECT COUNT(*) FROM Snapshots').fetchone()[0] < 100
+
+    last = max(states)
+    for timestamp, rows in states.items():
+        if timestamp >= last - snapshots.RETENTION_DAYS * DAY:
+            assert snapshots.state_at(cur, 'CKAN', timestamp) == rows